@@ -14,6 +14,7 @@
 #include <string>
 #include <cstdlib>
 #include <cstdio>
+#include <cmath>
 #include <ostream>
 #include <iomanip>
 #include <sstream>
@@ -52,6 +52,69 @@ public:
       delete zfile;
       return p;
   }
+  vector<double> xentropy_batch(const vector<string> &windows) {
+      /* Same as xentropy, but for many windows in one call: the evaluator
+       * and the line buffer handed to FakeZFile are only built once. */
+      vector<double> results;
+      results.reserve(windows.size());
+      vector<const char *> Zords(1);
+      PerplexityOptimizer perpEval(_lm, _order);
+
+      for (size_t i = 0; i < windows.size(); i++) {
+          Zords[0] = windows[i].c_str();
+          Logger::Log(2, "Input:%s\n", Zords[0]);
+          FakeZFile zfile(Zords);
+          results.push_back(perpEval.ShortCorpusComputeEntropy(zfile, _params));
+      }
+      return results;
+  }
+  vector<double> logprobs(const vector<string> &words) {
+      /* Natural log of P(word | history) for every word of one sequence,
+       * backing off the same way the estimated model does. Each word is
+       * looked up once, so callers can build any window's entropy from
+       * sums over the result instead of re-scoring the window. */
+      const NgramModel &model = _lm.model();
+      const Vocab &vocab = _lm.vocab();
+      size_t order = _lm.order();
+      VocabIndex unk = vocab.Find("<unk>", 5);
+      vector<double> results;
+      results.reserve(words.size());
+
+      /* hists[o] is the order-o n-gram ending at the previous word, or
+       * Invalid if the model never saw it. Sentences start after </s>. */
+      vector<NgramIndex> hists(order + 1, NgramVector::Invalid);
+      vector<NgramIndex> next(order + 1, NgramVector::Invalid);
+      hists[0] = 0;
+      hists[1] = model.vectors(1).Find(0, Vocab::EndOfSentence);
+
+      for (size_t i = 0; i < words.size(); i++) {
+          VocabIndex w = vocab.Find(words[i].c_str(), words[i].size());
+          if (w == Vocab::Invalid)
+              w = unk;
+          next[0] = 0;
+          size_t found = 0;
+          for (size_t o = 1; o <= order; o++) {
+              next[o] = NgramVector::Invalid;
+              if (w != Vocab::Invalid && hists[o - 1] != NgramVector::Invalid)
+                  next[o] = model.vectors(o).Find(hists[o - 1], w);
+              if (next[o] != NgramVector::Invalid)
+                  found = o;
+          }
+
+          double logp = -70.0;
+          if (found > 0) {
+              logp = log(_lm.probs(found)[next[found]]);
+              for (size_t o = found; o < order; o++) {
+                  if (hists[o] != NgramVector::Invalid)
+                      logp += log(_lm.bows(o)[hists[o]]);
+              }
+          }
+          Logger::Log(2, "%s\t%f\n", words[i].c_str(), logp);
+          results.push_back(logp);
+          hists.swap(next);
+      }
+      return results;
+  }
   string predict(string data) {
       Logger::Log(2, "Live Guess Input: %s\n", data.c_str());
 
@@ -83,6 +146,47 @@ public:
       Logger::Log(2, "Live Guess Rankings Done\n");
       return output_str;
   }
+  /* Raw model tables, for writing the estimated model out in another
+   * format. Indices refer to MITLM's own n-gram and vocabulary order. */
+  vector<string> vocab_words() {
+      const Vocab &vocab = _lm.vocab();
+      vector<string> words;
+      words.reserve(vocab.size());
+      for (size_t i = 0; i < vocab.size(); i++)
+          words.push_back(vocab[i]);
+      return words;
+  }
+  vector<int> ngram_hists(size_t o) {
+      const NgramVector &ngrams = _lm.model().vectors(o);
+      vector<int> hists(ngrams.size());
+      for (size_t i = 0; i < ngrams.size(); i++)
+          hists[i] = ngrams.hists()[i];
+      return hists;
+  }
+  vector<int> ngram_words(size_t o) {
+      const NgramVector &ngrams = _lm.model().vectors(o);
+      vector<int> words(ngrams.size());
+      for (size_t i = 0; i < ngrams.size(); i++)
+          words[i] = ngrams.words()[i];
+      return words;
+  }
+  vector<double> ngram_probs(size_t o) {
+      size_t n = _lm.model().vectors(o).size();
+      vector<double> probs(n);
+      for (size_t i = 0; i < n; i++)
+          probs[i] = _lm.probs(o)[i];
+      return probs;
+  }
+  vector<double> ngram_bows(size_t o) {
+      /* The highest order has no backoff weights. */
+      size_t n = _lm.model().vectors(o).size();
+      vector<double> bows(n, 1.0);
+      if (o < (size_t)_lm.order()) {
+          for (size_t i = 0; i < n; i++)
+              bows[i] = _lm.bows(o)[i];
+      }
+      return bows;
+  }
 private:
   int _order;
   string _smoothing;
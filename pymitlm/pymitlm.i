@@ -10,6 +10,8 @@
 
 namespace std {
    %template(StringVector) vector<string>;
+   %template(DoubleVector) vector<double>;
+   %template(IntVector) vector<int>;
 }
 
 %include "pymitlm.h"
@@ -30,6 +30,9 @@ testx("a b c x e f g h E E")
 testx("x")
 testx("a")
 testx("a x")
+batch = ["a b c d e f g h E E", "a b c x e f g h E E", "x", "a", "a x"]
+for q, r in zip(batch, m.xentropy_batch(batch)):
+      assert r == m.xentropy(q), q
 
 #assert False
 arr = test.split(" ")
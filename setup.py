@@ -100,7 +100,7 @@ setup(
                            #library_dirs=['pymitlm/mitlm/.libs'],
                            #runtime_library_dirs=['pymitlm/mitlm/.libs'],
                            libraries=['gfortran'],
-                           swig_opts=['-c++'],
+                           swig_opts=['-c++', '-threads'],
                            extra_compile_args=['-std=gnu++11', '-fPIC']
                           )],
     py_modules=['pymitlm.pymitlm'],
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+from unnaturalcode.http.batching import Batcher, Overloaded
+
+
+class BatchingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def score_batch(windows):
+            self.calls.append(windows)
+            return [float(len(w)) for w in windows]
+
+        self.score_batch = score_batch
+
+    def test_single_request(self):
+        batcher = Batcher(self.score_batch)
+        assert batcher.score([['a'], ['a', 'b']]) == [1.0, 2.0]
+        assert batcher.score([]) == []
+        assert len(self.calls) == 1
+
+    def test_concurrent_requests_share_batches(self):
+        batcher = Batcher(self.score_batch, max_delay=0.2)
+        results = {}
+
+        def request(n):
+            results[n] = batcher.score([['x'] * n, ['same']])
+
+        threads = [threading.Thread(target=request, args=(n,))
+                   for n in range(1, 9)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for n in range(1, 9):
+            assert results[n] == [float(n), 1.0]
+        assert len(self.calls) < 8
+        # The window every request sent was only scored once per batch.
+        for windows in self.calls:
+            assert windows.count(['same']) == 1
+
+    def test_errors_reach_every_request(self):
+        def broken(windows):
+            raise ValueError('no model')
+        batcher = Batcher(broken)
+        self.assertRaises(ValueError, batcher.score, [['a']])
+
+    def test_backpressure(self):
+        scoring = threading.Event()
+        release = threading.Event()
+
+        def slow(windows):
+            scoring.set()
+            release.wait()
+            return [0.0] * len(windows)
+
+        batcher = Batcher(slow, max_delay=0, max_pending=1)
+        first = threading.Thread(target=batcher.score, args=([['a']],))
+        first.start()
+        scoring.wait()
+        # One request is being scored, the next one fills the queue...
+        queued = threading.Thread(target=batcher.score, args=([['b']],))
+        queued.start()
+        while not batcher.queue.full():
+            pass
+        # ...and the one after that is turned away.
+        self.assertRaises(Overloaded, batcher.score, [['c']])
+        release.set()
+        first.join()
+        queued.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, shutil
+from math import log, exp
+from tempfile import mkdtemp
+
+import numpy as np
+
+from unnaturalcode.binaryModel import binaryModel, corpusStamp, UNKNOWN_LOGPROB
+from unnaturalcode.unnaturalCode import ucVocabulary
+
+# A tiny bigram model, laid out the way MITLM hands it over: unsorted, with
+# histories pointing at positions in the unsorted table one order down.
+vocab = ['</s>', 'a', 'b', 'c', 'd']
+unigrams = [('d', 0.05, 1.0), ('a', 0.4, 0.5), ('</s>', 0.2, 0.8),
+            ('c', 0.1, 0.9), ('b', 0.25, 0.7)]
+bigrams = [('a', 'b', 0.6), ('</s>', 'a', 0.9), ('b', 'c', 0.5),
+           ('b', '</s>', 0.3), ('c', 'a', 0.2)]
+
+def tables():
+    uniPos = dict((w, i) for (i, (w, p, b)) in enumerate(unigrams))
+    return [
+        ([0], [0], [1.0], [1.0]),
+        ([0] * len(unigrams), [vocab.index(w) for (w, p, b) in unigrams],
+         [p for (w, p, b) in unigrams], [b for (w, p, b) in unigrams]),
+        ([uniPos[h] for (h, w, p) in bigrams],
+         [vocab.index(w) for (h, w, p) in bigrams],
+         [p for (h, w, p) in bigrams], [1.0] * len(bigrams)),
+    ]
+
+def reference(words):
+    """Straightforward bigram backoff, one word at a time."""
+    uni = dict((w, (p, b)) for (w, p, b) in unigrams)
+    bi = dict(((h, w), p) for (h, w, p) in bigrams)
+    r = []
+    prev = '</s>'
+    for w in words:
+        if (prev, w) in bi:
+            r.append(log(bi[(prev, w)]))
+        elif w in uni:
+            bow = uni[prev][1] if prev in uni else 1.0
+            r.append(log(bow) + log(uni[w][0]))
+        else:
+            r.append(UNKNOWN_LOGPROB)
+        prev = w
+    return r
+
+class testBinaryModel(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.path = os.path.join(self.td, 'ucCorpus.model')
+        binaryModel.write(self.path, vocab, tables())
+        self.m = binaryModel(self.path)
+    def testHeader(self):
+        self.assertEquals(self.m.order(), 2)
+        self.assertEquals(self.m.vocab, vocab)
+    def testLogProbs(self):
+        for words in (['a', 'b', 'c', 'a'], ['c', 'b', '</s>', 'a'],
+                      ['d', 'd'], ['a', 'x', 'b'], []):
+            r = self.m.logprobs(words)
+            ref = reference(words)
+            self.assertEquals(len(r), len(ref))
+            for (x, y) in zip(r, ref):
+                self.assertAlmostEqual(x, y)
+    def testXentropyBatch(self):
+        windows = ['a b c', 'b c a', 'a b', 'd']
+        r = self.m.xentropy_batch(windows)
+        for (window, e) in zip(windows, r):
+            ref = reference(window.split() + ['</s>'])
+            self.assertAlmostEqual(e, -sum(ref)/len(ref))
+            self.assertAlmostEqual(e, self.m.xentropy(window))
+    def testXentropyCandidates(self):
+        for (left, right) in ((['a', 'b'], ['a']), ([], ['c', 'a']),
+                              (['c'], []), (['d', 'x'], ['b', 'b'])):
+            candidates = vocab + ['x']
+            r = self.m.xentropy_candidates(left, candidates, right)
+            ref = self.m.xentropy_batch([' '.join(left + [c] + right)
+                                         for c in candidates])
+            for (x, y) in zip(r, ref):
+                self.assertAlmostEqual(x, y)
+        # Strings and comments with whitespace in them, and empty ones.
+        candidates = ['a', 'b c', ' ', 'c']
+        r = self.m.xentropy_candidates(['a', 'b a'], candidates, ['c b'])
+        for (c, e) in zip(candidates, r):
+            self.assertAlmostEqual(e, self.m.xentropy(' '.join(['a', 'b a', c, 'c b'])))
+    def testPredict(self):
+        self.assertEquals(self.m.successors(['b'], 1)[0][1],
+                          vocab.index('c'))
+        self.assertEquals(self.m.predict('c').splitlines()[0],
+                          '%f\tc a' % 0.2)
+        # Nothing ever follows d, so fall back to unigrams.
+        self.assertEquals(len(self.m.successors(['d'], 10)), len(vocab))
+    def testSuccessorIndex(self):
+        path = os.path.join(self.td, 'unindexed.model')
+        binaryModel.write(path, vocab, tables(), successors=0)
+        unindexed = binaryModel(path)
+        for words in ([], ['a'], ['b'], ['d'], ['a', 'b'], ['x']):
+            for k in (1, 2, 10):
+                self.assertEquals(self.m.successors(words, k),
+                                  unindexed.successors(words, k))
+        del unindexed
+    def testIds(self):
+        v = ucVocabulary()
+        windows = [['a', 'b', 'c'], ['x', 'c', 'a'], ['d', 'd', 'b']]
+        ids = np.array([[v.intern(w) for w in window] for window in windows])
+        r = self.m.xentropy_ids(ids, v)
+        ref = self.m.xentropy_batch([' '.join(w) for w in windows])
+        for (x, y) in zip(r, ref):
+            self.assertAlmostEqual(x, y)
+        # Grown since it was last translated.
+        ids = [v.intern(w) for w in ('c', 'a', 'y', 'b')]
+        for (x, y) in zip(self.m.logprobs_ids(ids, v),
+                          self.m.logprobs(['c', 'a', 'y', 'b'])):
+            self.assertAlmostEqual(x, y)
+        self.assertEquals(self.m.xentropy_ids(np.array([[v.intern('a b')]]), v),
+                          None)
+    def testCorpusStamp(self):
+        corpus = os.path.join(self.td, 'stamped')
+        with open(corpus, 'w') as f:
+            f.write('a b c\n')
+        stamp = corpusStamp(corpus)
+        path = corpus + '.model'
+        binaryModel.write(path, vocab, tables(), stamp=stamp)
+        self.assertEquals(binaryModel.readStamp(path), stamp)
+        self.assertEquals(binaryModel(path).corpusStamp, stamp)
+        # Appended to after the stamp was taken, as while estimating.
+        with open(corpus, 'a') as f:
+            f.write('c b a\n')
+        self.assertNotEqual(binaryModel.readStamp(path), corpusStamp(corpus))
+        self.assertEquals(binaryModel.readStamp(self.path), (-1, -1))
+    @classmethod
+    def tearDownClass(self):
+        del self.m
+        shutil.rmtree(self.td)
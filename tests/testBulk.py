@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import io
+import json
+import tarfile
+import threading
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from unnaturalcode.http.bulk import read_ndjson, read_tar, imap_bounded
+
+
+class BulkTestCase(unittest.TestCase):
+
+    def test_read_ndjson(self):
+        stream = io.BytesIO(
+            json.dumps({'name': 'a.py', 's': 'x = 1\n'}) + '\n'
+            '\n'
+            '{"s": "pass"}\n'
+            'not json\n'
+            '{"name": "b.py", "s": 3}\n')
+        documents = list(read_ndjson(stream))
+        assert documents[:2] == [('a.py', 'x = 1\n'), (3, 'pass')]
+        assert [name for (name, e) in documents[2:]] == [4, 5]
+        assert all(isinstance(e, ValueError) for (name, e) in documents[2:])
+
+    def test_read_tar(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+            for (name, content) in (('p/a.py', 'x = 1\n'), ('p/b.py', '')):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+            info = tarfile.TarInfo('p/sub')
+            info.type = tarfile.DIRTYPE
+            archive.addfile(info)
+        buf.seek(0)
+        assert list(read_tar(buf)) == [('p/a.py', 'x = 1\n'), ('p/b.py', '')]
+
+    def test_imap_bounded(self):
+        pool = ThreadPool(4)
+        read = []
+        lock = threading.Lock()
+
+        def items():
+            for i in range(100):
+                with lock:
+                    read.append(i)
+                yield i
+
+        def square(i):
+            if i == 13:
+                raise ValueError(i)
+            return i * i
+
+        results = imap_bounded(pool, square, items(), max_pending=8)
+        first = next(results)
+        # Items are read only a few ahead of the results taken.
+        assert len(read) <= 9
+        rest = list(results)
+        errors = [r for r in rest + [first] if isinstance(r, ValueError)]
+        assert len(errors) == 1
+        squares = sorted(r for r in rest + [first] if not isinstance(r, Exception))
+        assert squares == [i * i for i in range(100) if i != 13]
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import unittest
+
+from unnaturalcode.http.caching import LRUCache, size_of, ENTRY_OVERHEAD
+
+
+class CachingTestCase(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = LRUCache(1 << 20)
+        assert cache.get(('a', 'b')) is None
+        cache.put(('a', 'b'), 1.5)
+        assert cache.get(('a', 'b')) == 1.5
+        assert cache.get(('a', 'c'), 0) == 0
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_byte_budget(self):
+        entry = size_of('k0') + size_of(0.0) + ENTRY_OVERHEAD
+        cache = LRUCache(3 * entry)
+        for i in range(3):
+            cache.put('k%i' % i, float(i))
+        # Using k0 makes k1 the least recently used.
+        assert cache.get('k0') == 0.0
+        cache.put('k3', 3.0)
+        assert len(cache) == 3
+        assert cache.bytes <= cache.max_bytes
+        assert cache.get('k1') is None
+        assert cache.get('k0') == 0.0
+
+    def test_oversized_and_clear(self):
+        cache = LRUCache(256)
+        cache.put('big', 'x' * 1000)
+        assert cache.get('big') is None
+        cache.put('small', [(False, 1.0)])
+        assert cache.get('small') == [(False, 1.0)]
+        cache.clear()
+        assert len(cache) == 0 and cache.bytes == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import threading
+
+from unnaturalcode.unnaturalCode import *
+from unnaturalcode.pythonSource import *
+from unnaturalcode.ucTestData import (somePythonCode, lotsOfPythonCode,
+                                      codeWithComments, incompletePythonCode)
+
+class testColumnarSource(unittest.TestCase):
+    def testSameLexemes(self):
+        for code in (somePythonCode, lotsOfPythonCode, codeWithComments):
+            c = pythonColumnarSource(code)
+            l = pythonSource(code)
+            self.assertEquals(list(c), list(l))
+            self.assertTrue(isinstance(c[0], pythonLexeme))
+            self.assertEquals(c[-1], l[-1])
+            self.assertEquals(c.strings(), [i[4] for i in l])
+            self.assertEquals(c.deLex(), l.deLex())
+    def testMidLine(self):
+        self.assertEquals(
+            list(pythonColumnarSource(incompletePythonCode, mid_line=True)),
+            list(pythonSource(incompletePythonCode, mid_line=True)))
+    def testScrubbed(self):
+        c = pythonColumnarSource(codeWithComments).scrubbed()
+        l = pythonSource(codeWithComments).scrubbed()
+        self.assertTrue(isinstance(c, pythonColumnarSource))
+        self.assertEquals(list(c), list(l))
+        self.assertEquals(c.strings(), [i[4] for i in l])
+    def testSlices(self):
+        c = pythonColumnarSource(lotsOfPythonCode)
+        l = pythonSource(lotsOfPythonCode)
+        self.assertEquals(list(c[3:9]), l[3:9])
+        self.assertEquals(c[3:9].strings(), [i[4] for i in l[3:9]])
+        self.assertEquals([c[0]] + c[1:], list(l))
+        self.assertEquals(list(c.toSource()), list(l))
+        self.assertTrue(isinstance(c.toSource(), pythonSource))
+    def testInterned(self):
+        c = pythonColumnarSource(lotsOfPythonCode)
+        d = pythonColumnarSource(lotsOfPythonCode)
+        self.assertEquals(c.stringIds, d.stringIds)
+        self.assertEquals(c.typeIds, d.typeIds)
+    def testOwnVocabulary(self):
+        v = ucVocabulary()
+        c = pythonColumnarSource(codeWithComments, vocabulary=v)
+        self.assertTrue(c.vocabulary is v)
+        self.assertTrue(c.scrubbed().vocabulary is v)
+        self.assertTrue(c[1:4].vocabulary is v)
+        self.assertTrue(ucColumnarSource.vocabulary is not v)
+        d = pythonColumnarSource(lotsOfPythonCode)
+        d.extend(c)
+        self.assertEquals(d.strings()[-len(c):], c.strings())
+    def testConcurrentIntern(self):
+        v = ucVocabulary()
+        strings = [str(i % 500) for i in range(20000)]
+        def intern():
+            for s in strings:
+                v.intern(s)
+        threads = [threading.Thread(target=intern) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(len(v), 500)
+        self.assertEquals(sorted(v.ids.values()), range(500))
+        for (s, i) in v.ids.items():
+            self.assertEquals(v[i], s)
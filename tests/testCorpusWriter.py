@@ -0,0 +1,73 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, shutil, gzip
+from tempfile import mkdtemp
+
+from unnaturalcode.corpusWriter import corpusWriter
+
+class testCorpusWriter(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTestCorpusWriter')
+    def tearDown(self):
+        shutil.rmtree(self.td)
+    def testCommit(self):
+        path = os.path.join(self.td, 'corpus')
+        w = corpusWriter(path)
+        w.add([u'for i in range', u'print \u00e9'])
+        self.assertEquals(os.path.getsize(path), 0)
+        self.assertEquals(w.commit(), len(u'for i in range\nprint \u00e9\n'.encode('UTF-8')))
+        self.assertEquals(w.commit(), 0)
+        w.add([u'pass'])
+        w.close()
+        with open(path) as f:
+            self.assertEquals(f.read().decode('UTF-8'),
+                              u'for i in range\nprint \u00e9\npass\n')
+    def testBufferLimit(self):
+        path = os.path.join(self.td, 'corpus')
+        w = corpusWriter(path, bufferBytes=10)
+        self.assertEquals(w.add([u'a b']), 0)
+        self.assertEquals(w.add([u'c d e f']), 12)
+        self.assertEquals(os.path.getsize(path), 12)
+        w.close()
+    def testUnsynced(self):
+        path = os.path.join(self.td, 'corpus')
+        synced = []
+        fsync = os.fsync
+        os.fsync = synced.append
+        try:
+            w = corpusWriter(path)
+            w.add([u'a b'])
+            self.assertEquals(w.commit(sync=False), 4)
+            self.assertEquals(os.path.getsize(path), 4)
+            self.assertEquals(len(synced), 0)
+            w.add([u'c d'])
+            w.commit(sync=False)
+            w.close()
+            self.assertEquals(len(synced), 1)
+        finally:
+            os.fsync = fsync
+        with open(path) as f:
+            self.assertEquals(f.read(), 'a b\nc d\n')
+    def testCompressed(self):
+        path = os.path.join(self.td, 'corpus.gz')
+        for sentence in (u'a b', u'c d'):
+            w = corpusWriter(path)
+            w.add([sentence])
+            w.close()
+        self.assertEquals(gzip.open(path).read(), 'a b\nc d\n')
@@ -0,0 +1,77 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, shutil, random
+from tempfile import mkdtemp
+
+from unnaturalcode.dedupIndex import dedupIndex, signature
+
+def stream(seed, n=400):
+    r = random.Random(seed)
+    return [r.choice(['def', 'f', '(', ')', ':', 'x', '+', '1', u'\u00e9'])
+            for i in range(n)]
+
+class testDedupIndex(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTestDedup')
+        self.path = os.path.join(self.td, 'corpus')
+    def tearDown(self):
+        shutil.rmtree(self.td)
+    def testExact(self):
+        d = dedupIndex(self.path, self.path)
+        self.assertTrue(d.admit(stream(1)))
+        self.assertFalse(d.admit(stream(1)))
+        self.assertTrue(d.admit(stream(2)))
+        d.commit()
+        # A record torn by a killed process.
+        with open(self.path + '.hashes', 'ab') as f:
+            f.write('torn')
+        d = dedupIndex(self.path, self.path)
+        self.assertFalse(d.admit(stream(2)))
+        self.assertTrue(d.admit(stream(3)))
+        d.commit()
+        self.assertEquals(os.path.getsize(self.path + '.hashes'), 3 * 20)
+        d.clear()
+        self.assertTrue(d.admit(stream(1)))
+    def testNear(self):
+        d = dedupIndex(self.path, self.path, nearThreshold=0.8)
+        self.assertTrue(d.admit(stream(1)))
+        edited = stream(1)
+        edited[200] = 'pass'
+        self.assertFalse(d.admit(edited))
+        self.assertTrue(d.admit(stream(2)))
+        d.commit()
+        d = dedupIndex(self.path, self.path, nearThreshold=0.8)
+        self.assertFalse(d.admit(edited))
+        self.assertEquals(len(d.signatures), 2)
+    def testAbandon(self):
+        d = dedupIndex(self.path, self.path, nearThreshold=0.8)
+        self.assertTrue(d.admit(stream(1)))
+        self.assertTrue(d.admit(stream(2)))
+        # The corpus append failed.
+        d.abandon()
+        d.commit()
+        self.assertFalse(os.path.exists(self.path + '.hashes'))
+        self.assertTrue(d.admit(stream(1)))
+        d.commit()
+        self.assertTrue(d.admit(stream(2)))
+        self.assertFalse(d.admit(stream(1)))
+    def testSignature(self):
+        self.assertEquals(list(signature(stream(1))), list(signature(stream(1))))
+        self.assertEquals(len(signature([])), 64)
+        self.assertEquals(len(signature(['a'])), 64)
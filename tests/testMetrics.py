@@ -0,0 +1,66 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from unnaturalcode import ucMetrics
+from unnaturalcode.ucMetrics import ucCounter, ucGauge, ucHistogram
+
+class testMetrics(unittest.TestCase):
+    def testCounter(self):
+        c = ucCounter('test_things_total', 'Things.', ('kind',))
+        c.inc('a')
+        c.inc('a', amount=2)
+        c.inc('b')
+        self.assertEquals(c.exposition().splitlines(), [
+            '# HELP test_things_total Things.',
+            '# TYPE test_things_total counter',
+            'test_things_total{kind="a"} 3.0',
+            'test_things_total{kind="b"} 1.0'])
+    def testHistogram(self):
+        h = ucHistogram('test_seconds', 'Time.', ('stage',),
+                        buckets=(0.1, 1.0))
+        for v in (0.05, 0.1, 0.5, 2.0):
+            h.observe(v, 'lex')
+        with h.time('score'):
+            pass
+        lines = h.exposition().splitlines()
+        self.assertEquals(lines[2:7], [
+            'test_seconds_bucket{stage="lex",le="0.1"} 2.0',
+            'test_seconds_bucket{stage="lex",le="1.0"} 3.0',
+            'test_seconds_bucket{stage="lex",le="+Inf"} 4.0',
+            'test_seconds_sum{stage="lex"} 2.65',
+            'test_seconds_count{stage="lex"} 4.0'])
+        self.assertTrue('test_seconds_count{stage="score"} 1.0' in lines)
+    def testExposition(self):
+        g = ucGauge('test_size', 'Size.', ('corpus',))
+        ucMetrics.addCollector(lambda: g.set(42, 'py\n"x"'))
+        text = ucMetrics.exposition()
+        self.assertTrue('test_size{corpus="py\\n\\"x\\""} 42.0\n' in text)
+        self.assertTrue('# TYPE process_resident_memory_bytes gauge' in text)
+    def testDiscard(self):
+        g = ucGauge('test_bytes', 'Bytes.', ('corpus', 'order'))
+        c = ucCounter('test_lookups_total', 'Lookups.', ('corpus',))
+        for corpus in ('py', 'other'):
+            g.set(1, corpus, 0)
+            g.set(2, corpus, 1)
+            c.inc(corpus)
+        ucMetrics.discardLabels(corpus='other')
+        self.assertEquals(sorted(g.values), [('py', 0), ('py', 1)])
+        self.assertEquals(list(c.values), [('py',)])
+        g.discard(order=1)
+        self.assertEquals(list(g.values), [('py', 0)])
@@ -0,0 +1,72 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from StringIO import StringIO
+
+from unnaturalcode import flexibleTokenize
+from unnaturalcode.pythonSource import *
+from unnaturalcode.ucTestData import (testProjectFiles, somePythonCode,
+                                      lotsOfPythonCode, codeWithComments,
+                                      incompletePythonCode,
+                                      codeWithDeleteFailure)
+
+# Awkward inputs that the test data might not cover.
+oddities = [
+    "", "\n", "x", "x = 1  ", "  x\n", "\tif x:\n\t\ty\n",
+    "def f(a,\n      b):\n  return '''x\ny'''\n",
+    "s = 'unterminated\n", "s = \"\"\"never\nends\n",
+    "a = 'con\\\ntinued'\n", "a = 'con\\\nnot\n",
+    "x = 1 + \\\n    2\n", "$ ? !\n", "if x:\n  y\n z\n",
+    "x = (1,\n# comment\n2)\r\n", "1.5e3j + .5 + 0x1fL + 0777 + 0b101\n",
+    "u'x' ur\"y\" b'''z''' BR\"\"\"w\"\"\"\n", "print x # trailing",
+]
+
+def reference(code, mid_line=False):
+    """What pythonSource.lex produced from generate_tokens."""
+    return [pythonLexeme.fromTuple(t) for t in
+            flexibleTokenize.generate_tokens(StringIO(code).readline,
+                                             mid_line)]
+
+class testPythonTokenizer(unittest.TestCase):
+    def check(self, code, columnar=True):
+        for mid_line in (False, True):
+            expected = reference(code, mid_line)
+            scanned = list(flexibleTokenize.scan_tokens(code, mid_line))
+            self.assertEquals(scanned, [(l[0], l[1]) + l[2] + l[3]
+                                        for l in expected])
+            lexed = pythonSource(code, mid_line=mid_line)
+            self.assertEquals(list(lexed), expected)
+            self.assertEquals([type(l) for l in lexed],
+                              [pythonLexeme] * len(lexed))
+            self.assertEquals([(type(l.start), type(l.end)) for l in lexed],
+                              [(ucPos, ucPos)] * len(lexed))
+            if columnar:
+                self.assertEquals(
+                    list(pythonColumnarSource(code, mid_line=mid_line)),
+                    expected)
+    def testConformsOnTestData(self):
+        for path in testProjectFiles:
+            with open(path) as f:
+                self.check(f.read(), columnar=False)
+    def testConformsOnSamples(self):
+        for code in (somePythonCode, lotsOfPythonCode, codeWithComments,
+                     incompletePythonCode, codeWithDeleteFailure):
+            self.check(code)
+    def testConformsOnOddities(self):
+        for code in oddities:
+            self.check(code)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from unnaturalcode.http.sessions import Session
+from unnaturalcode.pythonSource import pythonSource
+
+SOURCE = '''import os
+
+def f(x, y=(1,
+            2)):
+    """Adds things.
+    """
+    if x:
+        return x + \\
+            y
+    return os.sep  # done
+
+class C(object):
+    def g(self):
+        pass
+'''
+
+PIECES = ['    ', '"""', '(', ')', 'x = 1\\n', 'def h():\\n', '\\\\\\n',
+          '# comment\\n', '\\t', '\\n', 'if a:\\n    pass\\n', "'", 'return ']
+
+
+class SessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        lang = pythonSource()
+        self.lex = lambda lines, first, indents: lang.lexLines(
+            lines, True, first, indents)
+        self.scored = []
+
+    def score(self, windows):
+        self.scored.extend(windows)
+        return [float(hash(tuple(w)) % 1000) for w in windows]
+
+    def session(self, text, window_size=5):
+        return Session(text, self.lex, self.score, window_size, lambda: 0)
+
+    def assertSameAsFresh(self, session):
+        fresh = self.session(''.join(session.lines), session.window_size)
+        assert session.strings == fresh.strings
+        assert session.token_lines == fresh.token_lines
+        assert session.starts == fresh.starts
+        assert session.entropies == fresh.entropies
+
+    def test_small_edit_rescores_few_windows(self):
+        session = self.session(SOURCE * 20)
+        del self.scored[:]
+        session.replace(8, 9, '            y + 1\n')
+        # Only windows that reach into the changed statement.
+        assert 0 < len(self.scored) < 20
+        self.assertSameAsFresh(session)
+
+    def test_random_edits(self):
+        random.seed(0)
+        session = self.session(SOURCE * 3)
+        for _ in range(200):
+            start = random.randint(0, len(session.lines))
+            end = random.randint(start, min(len(session.lines), start + 3))
+            if random.random() < 0.5 and session.lines:
+                text = ''.join(random.choice(session.lines)
+                               for _ in range(random.randint(0, 3)))
+            else:
+                text = ''.join(random.choice(PIECES)
+                               for _ in range(random.randint(0, 4)))
+            session.replace(start, end, text)
+            self.assertSameAsFresh(session)
+
+    def test_ranking(self):
+        session = self.session(SOURCE)
+        ranking = session.ranking(3)
+        assert len(ranking) == 3
+        entropies = [r['entropy'] for r in ranking]
+        assert entropies == sorted(entropies, reverse=True)
+        assert entropies[0] == max(session.entropies)
+        assert all(1 <= r['start'] <= r['end'] <= len(session.lines)
+                   for r in ranking)
+        self.assertRaises(ValueError, session.replace, 3, 1, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
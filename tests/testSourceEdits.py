@@ -0,0 +1,96 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import random
+from copy import copy
+
+from unnaturalcode.unnaturalCode import *
+from unnaturalcode.pythonSource import *
+from unnaturalcode.ucTestData import (lotsOfPythonCode, codeWithComments,
+                                      codeWithDeleteFailure)
+
+class eagerPythonSource(pythonSource):
+    """Moves every lexeme on each edit, like ucSource always used to."""
+    maxEdits = 0
+
+class testSourceEdits(unittest.TestCase):
+    def edit(self, code, seed):
+        rand = random.Random(seed)
+        lazy = pythonSource(code)
+        eager = eagerPythonSource(code)
+        donors = pythonSource(codeWithComments)
+        for step in range(0, 40):
+            if rand.random() < 0.5 and len(lazy) > 2:
+                i = rand.randrange(1, len(lazy))
+                self.assertEquals(lazy.pop(i), eager.pop(i))
+            else:
+                i = rand.randrange(1, len(lazy))
+                donor = donors[rand.randrange(0, len(donors))]
+                lazy.insert(i, donor)
+                eager.insert(i, donor)
+            j = rand.randrange(0, len(lazy))
+            self.assertEquals(lazy[j], eager[j])
+            self.assertEquals(lazy[-1], eager[-1])
+        self.assertTrue(len(lazy.edits) > 0)
+        self.assertEquals(lazy.strings(), eager.strings())
+        self.assertEquals(lazy.deLex(), eager.deLex())
+        self.assertEquals(list(lazy), list(eager))
+        self.assertEquals(len(lazy.edits), 0)
+    def testLazyEdits(self):
+        for seed in range(0, 10):
+            self.edit(lotsOfPythonCode, seed)
+            self.edit(codeWithDeleteFailure, seed)
+    def testCopyFlushes(self):
+        r = pythonSource(lotsOfPythonCode)
+        r.pop(1)
+        c = copy(r)
+        c.pop(1)
+        self.assertEquals(len(r.edits), 0)
+        self.assertEquals(len(c.edits), 1)
+        self.assertEquals(len(c), len(r) - 1)
+        self.assertEquals(r.strings()[2:], c.strings()[1:])
+        self.assertEquals(r[0], c[0])
+    def testSnapshots(self):
+        r = pythonSource(lotsOfPythonCode)
+        donors = pythonSource(codeWithComments)
+        rand = random.Random(1)
+        for attempt in range(0, 20):
+            s = r.snapshot()
+            c = copy(r)
+            self.assertTrue(s.base is r.snapshot().base)
+            for step in range(0, 3):
+                i = rand.randrange(1, len(c))
+                if rand.random() < 0.5:
+                    self.assertEquals(s.pop(i), c.pop(i))
+                else:
+                    donor = donors[rand.randrange(0, len(donors))]
+                    self.assertEquals(list(s.insert(i, donor)),
+                                      list(c.insert(i, donor)))
+                t = s.snapshot()
+            self.assertEquals(len(s), len(c))
+            self.assertEquals(s.strings(), c.strings())
+            self.assertEquals([s[j] for j in range(0, len(s))], list(c))
+            self.assertEquals(s.deLex(), c.deLex())
+            self.assertEquals(list(t), list(c))
+        self.assertEquals(r, pythonSource(lotsOfPythonCode))
+    def testSnapshotInvalidated(self):
+        r = pythonSource(lotsOfPythonCode)
+        s = r.snapshot()
+        r.pop(1)
+        self.assertFalse(s.base is r.snapshot().base)
+        self.assertEquals(len(s), len(r) + 1)
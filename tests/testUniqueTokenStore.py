@@ -0,0 +1,76 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, shutil, pickle
+from tempfile import mkdtemp
+
+from unnaturalcode import uniqueTokenStore as store
+from unnaturalcode.uniqueTokenStore import uniqueTokenStore
+
+class testUniqueTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTestTokens')
+        self.path = os.path.join(self.td, 'corpus.uniqueTokens')
+    def tearDown(self):
+        shutil.rmtree(self.td)
+    def add(self, s, tokens, strings):
+        new = [(string, ('NAME', string)) for string in strings]
+        tokens.update(new)
+        s.add(new, tokens)
+    def testAppendAndLoad(self):
+        # An old-style snapshot, pickled whole.
+        with open(self.path, 'wb') as f:
+            pickle.dump({'a': ('NAME', 'a')}, f)
+        snapshotBytes = os.path.getsize(self.path)
+        s = uniqueTokenStore(self.path, self.path)
+        tokens = s.load()
+        self.add(s, tokens, ['b', 'c'])
+        self.add(s, tokens, ['d'])
+        # Only appended to the log.
+        self.assertEquals(os.path.getsize(self.path), snapshotBytes)
+        self.assertEquals(uniqueTokenStore(self.path, self.path).load(), tokens)
+    def testTornRecord(self):
+        s = uniqueTokenStore(self.path, self.path)
+        tokens = {}
+        self.add(s, tokens, ['a'])
+        with open(self.path + '.log', 'ab') as f:
+            f.write(store.MAGIC + 'garbage')
+        self.add(s, tokens, ['b'])
+        self.assertEquals(sorted(s.load()), ['a', 'b'])
+    def testCompaction(self):
+        s = uniqueTokenStore(self.path, self.path)
+        tokens = {}
+        old = store.MIN_COMPACT_BYTES
+        store.MIN_COMPACT_BYTES = 0
+        try:
+            self.add(s, tokens, ['a'])
+            self.add(s, tokens, ['b'])
+        finally:
+            store.MIN_COMPACT_BYTES = old
+        self.assertEquals(os.path.getsize(self.path + '.log'), 0)
+        self.assertEquals(sorted(s.load()), ['a', 'b'])
+    def testSeparateWritePath(self):
+        s = uniqueTokenStore(self.path, self.path)
+        tokens = {}
+        self.add(s, tokens, ['a'])
+        written = os.path.join(self.td, 'other.uniqueTokens')
+        t = uniqueTokenStore(self.path, written)
+        tokens = t.load()
+        self.add(t, tokens, ['b'])
+        self.assertEquals(sorted(uniqueTokenStore(written, written).load()),
+                          ['a', 'b'])
@@ -32,7 +32,7 @@ from unnaturalcode.pythonSource import *
 from unnaturalcode.mitlmCorpus import *
 from unnaturalcode.modelValidator import *
 
-import os, os.path, zmq, sys, shutil, token, gc
+import os, os.path, zmq, sys, shutil, token, gc, pickle
 from glob import glob
 from tempfile import *
 
@@ -138,6 +138,39 @@ class testSourceModelWithFiles(unittest.TestCase):
     def testTrainString(self):
         self.sm.trainString(lotsOfPythonCode)
         self.sm.trainString(somePythonCode)
+    def testTrainManyLexemes(self):
+        # Other tests train the same code.
+        self.sm.dedup.clear()
+        before = os.path.getsize(self.cm.writeCorpus) if os.path.exists(self.cm.writeCorpus) else 0
+        generation = self.cm.corpusGeneration
+        self.sm.trainManyLexemes([pythonSource(lotsOfPythonCode),
+                                  pythonSource(somePythonCode)])
+        self.assertEquals(self.cm.corpusGeneration, generation + 1)
+        with open(self.cm.writeCorpus) as f:
+            f.seek(before)
+            self.assertEquals(len(f.read().splitlines()), 2)
+    def testTrainScrubbed(self):
+        self.sm.dedup.clear()
+        scrubbed = [self.sm.scrubLexemes(pythonSource(lotsOfPythonCode)),
+                    self.sm.scrubLexemes(pythonSource(somePythonCode))]
+        # Lexed and scrubbed training has to survive a trip to a worker.
+        scrubbed = pickle.loads(pickle.dumps(scrubbed))
+        before = os.path.getsize(self.cm.writeCorpus) if os.path.exists(self.cm.writeCorpus) else 0
+        self.sm.trainScrubbed(scrubbed)
+        with open(self.cm.writeCorpus) as f:
+            f.seek(before)
+            lines = f.read().splitlines()
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(lines[1], self.cm.corpify(
+            self.sm.rememberLexemes(pythonSource(somePythonCode))))
+        for string in scrubbed[0][0]:
+            self.assertTrue(string in self.sm.listOfUniqueTokens)
+    def testTrainDuplicate(self):
+        self.sm.dedup.clear()
+        self.assertEquals(self.sm.trainString(somePythonCode), 1)
+        size = os.path.getsize(self.cm.writeCorpus)
+        self.assertEquals(self.sm.trainString(somePythonCode), 0)
+        self.assertEquals(os.path.getsize(self.cm.writeCorpus), size)
     def testTrainFile(self):
         self.sm.trainFile(testProject1File)
     @unittest.skipIf(os.getenv("FAST", False), "Skipping slow tests...")
@@ -158,6 +191,43 @@ class testSourceModelWithFiles(unittest.TestCase):
         self.sm.release()
         shutil.rmtree(self.td)
 
+class testFollowModel(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.corpus = os.path.join(self.td, 'ucCorpus')
+        with open(self.corpus, 'w') as f:
+            f.write('a b\n')
+        self.cm = mitlmCorpus(readCorpus=self.corpus, writeCorpus=self.corpus)
+        self.cm.followModel()
+    def writeModel(self):
+        binaryModel.write(self.cm.modelPath, ['</s>', 'a', 'b'],
+                          [([0], [0], [1.0], [1.0]),
+                           ([0, 0, 0], [0, 1, 2], [0.2, 0.4, 0.4],
+                            [1.0, 1.0, 1.0])],
+                          stamp=corpusStamp(self.corpus))
+    def testDeleted(self):
+        self.writeModel()
+        model = self.cm.followMitlm()
+        self.assertTrue(isinstance(model, binaryModel))
+        # What GenericCorpus.reset does.
+        shutil.move(self.corpus, self.corpus + '.bak')
+        self.cm.deleteModel()
+        self.assertFalse(os.path.exists(self.cm.modelPath))
+        self.assertEquals(self.cm.followMitlm(), None)
+        self.assertEquals(self.cm.mitlm, None)
+    def testStale(self):
+        self.writeModel()
+        self.assertTrue(isinstance(self.cm.followMitlm(), binaryModel))
+        # Deleted by another process, and trained a little since, while
+        # the model file stayed.
+        os.remove(self.corpus)
+        with open(self.corpus, 'w') as f:
+            f.write('a\n')
+        self.assertEquals(self.cm.followMitlm(), None)
+        self.assertEquals(self.cm.mitlm, None)
+    def tearDown(self):
+        shutil.rmtree(self.td)
+
 @unittest.skipIf(os.getenv("FAST", False), "Skipping slow tests...")
 class testTrainedSourceModel(unittest.TestCase):
     @classmethod
@@ -192,6 +262,22 @@ class testTrainedSourceModel(unittest.TestCase):
         r = self.sm.worstWindows(pythonSource(somePythonCodeFromProject))
         for i in range(0, len(r)-2):
             self.assertTrue(r[i][1] >= r[i+1][1])
+    def testQueryIds(self):
+        # Scored by id on the binary model, columnar or not.
+        self.cm.saveModel()
+        self.assertTrue(isinstance(self.cm.startMitlm(), binaryModel))
+        listed = pythonSource(somePythonCodeFromProject)
+        columnar = self.sm.lex(somePythonCodeFromProject)
+        expected = self.cm.queryCorpusBatch(self.sm.windowStrings(listed))
+        for lexemes in (listed, columnar):
+            r = self.sm.windowedQuery(lexemes, returnWindows=False)
+            self.assertEquals(len(r), len(expected))
+            for ((w, e), x) in zip(r, expected):
+                self.assertAlmostEqual(e, x)
+        (windows, unwindows) = self.sm.unwindowedQuery(listed)
+        (cwindows, cunwindows) = self.sm.unwindowedQuery(columnar)
+        for ((w, e), (cw, ce)) in zip(unwindows, cunwindows):
+            self.assertAlmostEqual(e, ce)
     @classmethod
     def tearDownClass(self):
         self.sm.release()
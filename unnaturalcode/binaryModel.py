@@ -0,0 +1,473 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Estimated n-gram models in a compact binary file.
+
+The file is read through mmap, so loading it costs little more than paging
+it in, and every process that loads the same file shares its pages. Layout,
+all little-endian:
+
+    magic         8 bytes, "UCLMBIN3"
+    order, vocabulary size, vocabulary bytes, k  4 x int64
+    corpus stamp  2 x int64, the size and mtime (ns) of the corpus file
+                  as it was before the model was estimated from it
+    n-gram count for each order 0 .. order       (order+1) x int64
+    successor count for each order 0 .. order-1  order x int64
+    vocabulary    NUL-separated UTF-8, padded to 8 bytes
+    then for each order 0 .. order:
+      keys        int64, sorted; history * vocabulary size + word
+      logprobs    float64, natural log P(word | history)
+      logbows     float64, natural log backoff weight of the n-gram
+    then for each order 0 .. order-1, the successor index:
+      starts      int64, one more than the n-grams of the order; the
+                  successors of n-gram i are starts[i] up to starts[i+1]
+      words       int64, the k (at most) likeliest words after each n-gram
+      logprobs    float64, their natural log probabilities, highest first
+
+A history is the position of an n-gram in the table one order down.
+Vocabulary index 0 is the end of sentence, which also starts sentences.
+Files with the magic "UCLMBIN2" have no corpus stamp. Files with the
+magic "UCLMBIN1" have a 3 x int64 header, no successor counts and no
+successor index. Both are still read.
+"""
+
+import os
+import struct
+import weakref
+from logging import debug, info, warning, error
+
+import numpy as np
+
+MAGIC = b'UCLMBIN3'
+UNSTAMPED_MAGIC = b'UCLMBIN2'
+OLD_MAGIC = b'UCLMBIN1'
+
+# How many successors of each n-gram the successor index keeps.
+SUCCESSORS = 32
+
+# What a word the model knows nothing about costs; same as pymitlm.
+UNKNOWN_LOGPROB = -70.0
+# What translation() maps a string to that the model would see as several
+# words, or none.
+SPLIT = -2
+
+
+def pad8(n):
+    return (n + 7) & ~7
+
+
+def corpusStamp(path):
+    """The stamp of the corpus file at path, or None if there isn't one."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, int(st.st_mtime * 1e9))
+
+
+class binaryModel(object):
+    """
+    A read-only n-gram model that answers the same queries as
+    pymitlm.PyMitlm, from a file written by binaryModel.fromMitlm.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            self.corpusStamp = None
+            if magic in (MAGIC, UNSTAMPED_MAGIC):
+                (self._order, self.vocabSize, vocabBytes,
+                 self.successorK) = struct.unpack('<4q', f.read(32))
+                if magic == MAGIC:
+                    self.corpusStamp = struct.unpack('<2q', f.read(16))
+            elif magic == OLD_MAGIC:
+                (self._order, self.vocabSize, vocabBytes) = struct.unpack(
+                    '<3q', f.read(24))
+                self.successorK = 0
+            else:
+                raise ValueError("%s is not a binary model" % path)
+            counts = struct.unpack('<%iq' % (self._order + 1),
+                                   f.read(8 * (self._order + 1)))
+            if magic != OLD_MAGIC:
+                successorCounts = struct.unpack('<%iq' % self._order,
+                                                f.read(8 * self._order))
+            else:
+                successorCounts = ()
+            offset = f.tell()
+            self.vocab = f.read(vocabBytes).split(b'\0')
+        assert len(self.vocab) == self.vocabSize
+        self.vocabIndex = dict((w, i) for (i, w) in enumerate(self.vocab))
+        self.unk = self.vocabIndex.get(b'<unk>', -1)
+        # translation() of each ucVocabulary asked about, dropped with it.
+        self.translations = weakref.WeakKeyDictionary()
+        offset = pad8(offset + vocabBytes)
+        self.keyTables = []
+        self.logprobTables = []
+        self.logbowTables = []
+        for n in counts:
+            for (table, dtype) in ((self.keyTables, '<i8'),
+                                   (self.logprobTables, '<f8'),
+                                   (self.logbowTables, '<f8')):
+                if n > 0:
+                    table.append(np.memmap(path, dtype=dtype, mode='r',
+                                           offset=offset, shape=(n,)))
+                else:
+                    table.append(np.zeros(0, dtype=dtype))
+                offset += 8 * n
+        self.successorStarts = []
+        self.successorWords = []
+        self.successorLogprobs = []
+        for (o, n) in enumerate(successorCounts):
+            self.successorStarts.append(np.memmap(
+                path, dtype='<i8', mode='r', offset=offset,
+                shape=(counts[o] + 1,)))
+            offset += 8 * (counts[o] + 1)
+            for (table, dtype) in ((self.successorWords, '<i8'),
+                                   (self.successorLogprobs, '<f8')):
+                if n > 0:
+                    table.append(np.memmap(path, dtype=dtype, mode='r',
+                                           offset=offset, shape=(n,)))
+                else:
+                    table.append(np.zeros(0, dtype=dtype))
+                offset += 8 * n
+        info("Loaded %s: order %i, %i words, %i n-grams" % (
+             path, self._order, self.vocabSize, sum(counts)))
+
+    @staticmethod
+    def readStamp(path):
+        """
+        The corpus stamp in the header of the model at path, without
+        loading it; None if it has none or can't be read.
+        """
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return None
+                f.seek(32, os.SEEK_CUR)
+                return struct.unpack('<2q', f.read(16))
+        except (IOError, struct.error):
+            return None
+
+    @classmethod
+    def write(cls, path, vocab, tables, successors=SUCCESSORS, stamp=None):
+        """
+        Write a model. vocab is the list of words; tables[o] is a tuple
+        (hists, words, probs, bows) of equal length sequences for the
+        order o n-grams, where hists index the order o-1 n-grams in the
+        order given. The tables are sorted on the way out, and the
+        likeliest `successors` words after each n-gram are indexed.
+        stamp is the corpusStamp() of the corpus the model was estimated
+        from.
+        """
+        vocabSize = len(vocab)
+        order = len(tables) - 1
+        vocabBlob = b'\0'.join(vocab)
+        # remap[i] is where the i-th n-gram of the previous order ended up.
+        remap = np.zeros(1, dtype=np.int64)
+        sortedTables = []
+        for o in range(0, order + 1):
+            (hists, words, probs, bows) = [np.asarray(t) for t in tables[o]]
+            if o == 0:
+                keys = np.zeros(len(words), dtype=np.int64)
+            else:
+                keys = (remap[hists.astype(np.int64)] * vocabSize
+                        + words.astype(np.int64))
+            perm = np.argsort(keys, kind='mergesort')
+            remap = np.empty(len(perm), dtype=np.int64)
+            remap[perm] = np.arange(len(perm), dtype=np.int64)
+            with np.errstate(divide='ignore'):
+                sortedTables.append((
+                    keys[perm],
+                    np.log(probs.astype(np.float64)[perm]),
+                    np.log(bows.astype(np.float64)[perm])))
+        index = [cls.successorIndex(len(sortedTables[o][0]),
+                                    sortedTables[o + 1][0],
+                                    sortedTables[o + 1][1],
+                                    vocabSize, successors)
+                 for o in range(0, order)]
+        # Write next to the destination and rename, so processes that have
+        # the old file mapped keep a consistent view of it.
+        tmpPath = "%s.%i.tmp" % (path, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<4q', order, vocabSize, len(vocabBlob),
+                                successors))
+            f.write(struct.pack('<2q', *(stamp or (-1, -1))))
+            f.write(struct.pack('<%iq' % (order + 1),
+                                *[len(t[0]) for t in sortedTables]))
+            f.write(struct.pack('<%iq' % order,
+                                *[len(words) for (starts, words, logprobs)
+                                  in index]))
+            f.write(vocabBlob)
+            f.write(b'\0' * (pad8(f.tell()) - f.tell()))
+            for (keys, logprobs, logbows) in sortedTables:
+                f.write(keys.astype('<i8').tostring())
+                f.write(logprobs.astype('<f8').tostring())
+                f.write(logbows.astype('<f8').tostring())
+            for (starts, words, logprobs) in index:
+                f.write(starts.astype('<i8').tostring())
+                f.write(words.astype('<i8').tostring())
+                f.write(logprobs.astype('<f8').tostring())
+        os.rename(tmpPath, path)
+
+    @staticmethod
+    def successorIndex(count, keys, logprobs, vocabSize, k):
+        """
+        The successor index of the count n-grams one order below the
+        sorted n-grams with the given keys and logprobs: (starts, words,
+        logprobs), the k likeliest words after each n-gram, likeliest
+        first.
+        """
+        hists = keys // vocabSize
+        # By history, then likeliest first; ties stay in word order.
+        perm = np.lexsort((-logprobs, hists))
+        groupStarts = np.searchsorted(hists, np.arange(count + 1))
+        rank = np.arange(len(perm)) - groupStarts[hists[perm]]
+        keep = perm[rank < k]
+        starts = np.searchsorted(hists[keep], np.arange(count + 1))
+        return (starts.astype(np.int64), keys[keep] % vocabSize,
+                logprobs[keep])
+
+    @classmethod
+    def fromMitlm(cls, mitlm, path, stamp=None):
+        """
+        Write the model estimated by a pymitlm.PyMitlm to path. stamp is
+        the corpusStamp() of its corpus, taken before estimating.
+        """
+        tables = []
+        for o in range(0, mitlm.order() + 1):
+            tables.append((mitlm.ngram_hists(o), mitlm.ngram_words(o),
+                           mitlm.ngram_probs(o), mitlm.ngram_bows(o)))
+        cls.write(path, list(mitlm.vocab_words()), tables, stamp=stamp)
+        return cls(path)
+
+    def order(self):
+        return self._order
+
+    def index(self, words):
+        """Vocabulary indices of words; unknown words are <unk> or -1."""
+        return np.array([self.vocabIndex.get(w, self.unk) for w in words],
+                        dtype=np.int64)
+
+    def wordIndex(self, word):
+        """
+        Vocabulary index of one string, like index(), or SPLIT if the model
+        would see it as several words, or none.
+        """
+        if word.split() == [word]:
+            return self.vocabIndex.get(word, self.unk)
+        return SPLIT
+
+    def translation(self, vocabulary):
+        """
+        Array from the ids of a ucVocabulary to vocabulary indices of this
+        model, extended as the vocabulary grows.
+        """
+        table = self.translations.get(vocabulary, np.zeros(0, np.int64))
+        if len(table) < len(vocabulary):
+            grown = np.empty(len(vocabulary), dtype=np.int64)
+            grown[:len(table)] = table
+            for i in xrange(len(table), len(vocabulary)):
+                word = vocabulary.strings[i]
+                if isinstance(word, unicode):
+                    word = word.encode("UTF-8")
+                grown[i] = self.wordIndex(word)
+            self.translations[vocabulary] = table = grown
+        return table
+
+    def find(self, o, hists, words):
+        """Position of each (history, word) n-gram of order o, or -1."""
+        keys = self.keyTables[o]
+        if len(keys) == 0:
+            return np.full(np.shape(words), -1, dtype=np.int64)
+        wanted = hists * self.vocabSize + words
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        found = (hists >= 0) & (words >= 0) & (keys[pos] == wanted)
+        return np.where(found, pos, -1)
+
+    def contexts(self, words):
+        """
+        For a 2-d array of word indices, one sequence per row, returns a
+        list with, for each order o, the position of the order o n-gram
+        ending at each word. Column 0 is the sentence start.
+        """
+        (rows, n) = words.shape
+        ctx = np.empty((rows, n + 1), dtype=np.int64)
+        ctx[:, 0] = 0
+        ctx[:, 1:] = words
+        idx = [np.zeros((rows, n + 1), dtype=np.int64)]
+        for o in range(1, self._order + 1):
+            if o == 1:
+                cur = self.find(1, np.zeros_like(ctx), ctx)
+            else:
+                cur = np.full((rows, n + 1), -1, dtype=np.int64)
+                cur[:, 1:] = self.find(o, idx[o - 1][:, :-1], ctx[:, 1:])
+            idx.append(cur)
+        return idx
+
+    def score(self, words):
+        """
+        Natural log P(word | history) for a 2-d array of word indices,
+        backing off like the estimated model does.
+        """
+        idx = self.contexts(words)
+        logp = np.full(words.shape, UNKNOWN_LOGPROB)
+        done = np.zeros(words.shape, dtype=bool)
+        backoff = np.zeros(words.shape)
+        for o in range(self._order, 0, -1):
+            here = idx[o][:, 1:]
+            hit = (here >= 0) & ~done
+            logp[hit] = self.logprobTables[o][here[hit]] + backoff[hit]
+            done |= hit
+            # Falling back to order o-1 costs the backoff weight of the
+            # order o-1 history.
+            hist = idx[o - 1][:, :-1]
+            has = (hist >= 0) & ~done
+            backoff[has] += self.logbowTables[o - 1][hist[has]]
+        return logp
+
+    def logprobs(self, words):
+        """Same as PyMitlm.logprobs."""
+        if len(words) == 0:
+            return []
+        return list(self.score(self.index(words)[np.newaxis, :])[0])
+
+    def xentropy(self, data):
+        """Same as PyMitlm.xentropy."""
+        return self.xentropy_batch([data])[0]
+
+    def xentropy_batch(self, windows):
+        """
+        Same as PyMitlm.xentropy_batch. Windows of the same length are
+        scored together as one array.
+        """
+        results = [None] * len(windows)
+        byLength = {}
+        for (i, window) in enumerate(windows):
+            # The end of sentence is predicted too.
+            words = window.split() + [self.vocab[0]]
+            byLength.setdefault(len(words), []).append((i, words))
+        for (n, group) in byLength.items():
+            words = np.vstack([self.index(w) for (i, w) in group])
+            entropies = -self.score(words).mean(axis=1)
+            for ((i, w), e) in zip(group, entropies):
+                results[i] = float(e)
+        return results
+
+    def xentropy_ids(self, windows, vocabulary):
+        """
+        xentropy_batch of a 2-d array of ids in vocabulary, one window per
+        row, without making strings of them. None if a string in there
+        isn't a single word.
+        """
+        (rows, n) = windows.shape
+        words = np.empty((rows, n + 1), dtype=np.int64)
+        words[:, :n] = self.translation(vocabulary)[windows]
+        words[:, n] = 0   # the end of sentence
+        if (words == SPLIT).any():
+            return None
+        return [float(e) for e in -self.score(words).mean(axis=1)]
+
+    def logprobs_ids(self, ids, vocabulary):
+        """logprobs of ids in vocabulary; None like xentropy_ids."""
+        if len(ids) == 0:
+            return []
+        words = self.translation(vocabulary)[ids]
+        if (words == SPLIT).any():
+            return None
+        return list(self.score(words[np.newaxis, :])[0])
+
+    def xentropy_candidates(self, left, candidates, right):
+        """
+        xentropy of left + [c] + right for every candidate word c, all
+        lists of words. Only the n-grams that can reach the candidate are
+        looked up per candidate; the rest of the window is scored once.
+        Words with whitespace in them count as the words they split into,
+        as in xentropy_batch.
+        """
+        if len(candidates) == 0:
+            return []
+        n = self._order - 1
+        left = [p for w in left for p in w.split()]
+        right = [p for w in right for p in w.split()]
+        l = self.index(left)
+        r = np.append(self.index(right), 0)   # the end of sentence
+        c = np.array([self.wordIndex(w) for w in candidates], dtype=np.int64)
+        # Candidates that aren't one word shift the window: score them
+        # whole, and anything in their place here.
+        split = np.flatnonzero(c == SPLIT)
+        c[split] = 0
+        # Anything more than n words after the candidate never sees it.
+        fixed = self.score(np.concatenate((l, c[:1], r))[np.newaxis, :])[0]
+        fixed = fixed[:len(l)].sum() + fixed[len(l) + 1 + n:].sum()
+        # The last n words of the left context are all a candidate's
+        # history can reach; shorter left contexts start the sentence.
+        tail = l[max(0, len(l) - n):]
+        head = r[:n]
+        rows = np.empty((len(c), len(tail) + 1 + len(head)), dtype=np.int64)
+        rows[:, :len(tail)] = tail
+        rows[:, len(tail)] = c
+        rows[:, len(tail) + 1:] = head
+        varying = self.score(rows)[:, len(tail):].sum(axis=1)
+        results = [float(e) for e in
+                   -(fixed + varying) / (len(l) + 1 + len(r))]
+        whole = self.xentropy_batch([b' '.join(left + [candidates[i]] + right)
+                                     for i in split])
+        for (i, e) in zip(split, whole):
+            results[i] = e
+        return results
+
+    def successors(self, words, k):
+        """
+        Up to k (logprob, word index) pairs that most often follow the
+        given context, from the longest part of it the model has seen.
+        """
+        idx = self.contexts(self.index(words)[np.newaxis, :])
+        for o in range(min(self._order - 1, len(words) + 1), -1, -1):
+            hist = idx[o][0, -1]
+            if hist < 0:
+                continue
+            if k <= self.successorK:
+                starts = self.successorStarts[o]
+                lo = starts[hist]
+                hi = min(starts[hist + 1], lo + k)
+                if hi == lo:
+                    continue
+                return zip(self.successorLogprobs[o][lo:hi],
+                           [int(w) for w in self.successorWords[o][lo:hi]])
+            keys = self.keyTables[o + 1]
+            lo = np.searchsorted(keys, hist * self.vocabSize)
+            hi = np.searchsorted(keys, (hist + 1) * self.vocabSize)
+            if hi == lo:
+                continue
+            logprobs = np.asarray(self.logprobTables[o + 1][lo:hi])
+            best = np.argsort(-logprobs, kind='mergesort')[:k]
+            return [(logprobs[i], int(keys[lo + i] % self.vocabSize))
+                    for i in best]
+        return []
+
+    def predict(self, data):
+        """
+        Same output format as PyMitlm.predict: one line per suggestion,
+        a probability, a tab, then the context followed by the suggestion.
+        """
+        words = data.split()
+        return "".join("%f\t%s\n" % (np.exp(logprob),
+                                     b" ".join(words + [self.vocab[w]]))
+                       for (logprob, w) in self.successors(words, 10))
@@ -0,0 +1,105 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Appends sentences to a corpus file.
+
+Sentences are encoded as they are added and kept in memory until commit(),
+which appends them all with one write and one fsync, holding an exclusive
+lock so that processes sharing the corpus don't interleave. A commit that
+doesn't sync only flushes, leaving the fsync to the next one that does, or
+to close(). A corpus file
+whose name ends in .gz gets each commit as a gzip member; gunzip, and so
+MITLM, read a file of several members as one.
+"""
+
+import os
+import zlib
+import fcntl
+
+# Commit by itself once this much is waiting.
+BUFFER_BYTES = int(os.getenv("ucCorpusBuffer", 4 * 1024 * 1024))
+
+
+def gzipMember(data, level=6):
+    """data as a complete gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class corpusWriter(object):
+
+    def __init__(self, path, bufferBytes=BUFFER_BYTES, compress=None):
+        self.path = path
+        self.bufferBytes = bufferBytes
+        self.compress = path.endswith(".gz") if compress is None else compress
+        self.f = open(path, "ab")
+        self.buffer = []
+        self.pending = 0
+        self.unsynced = False
+
+    @property
+    def closed(self):
+        return self.f.closed
+
+    def add(self, sentences):
+        """
+        Add sentences, unicode strings without newlines, to be written on
+        the next commit. Commits if a lot is waiting, and then returns what
+        commit() did; otherwise 0.
+        """
+        data = u"".join(s + u"\n" for s in sentences).encode("UTF-8")
+        self.buffer.append(data)
+        self.pending += len(data)
+        if self.pending >= self.bufferBytes:
+            return self.commit()
+        return 0
+
+    def commit(self, sync=True):
+        """
+        Write everything added since the last commit to disk, or with
+        sync=False just to the OS. Returns how many bytes of sentences
+        that was.
+        """
+        if self.pending == 0:
+            if sync and self.unsynced:
+                os.fsync(self.f.fileno())
+                self.unsynced = False
+            return 0
+        data = b"".join(self.buffer)
+        if self.compress:
+            data = gzipMember(data)
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        try:
+            self.f.write(data)
+            self.f.flush()
+            if sync:
+                os.fsync(self.f.fileno())
+        finally:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.unsynced = not sync
+        committed = self.pending
+        self.buffer = []
+        self.pending = 0
+        return committed
+
+    def close(self):
+        """Commit, then close the file."""
+        try:
+            self.commit()
+        finally:
+            self.f.close()
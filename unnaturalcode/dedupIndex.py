@@ -0,0 +1,231 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keeps duplicate token streams out of a corpus.
+
+Every stream added to the corpus is remembered by the SHA-1 of its
+strings, in `<corpus>.hashes`, so that an exact duplicate is recognised
+with one set lookup. Optionally, streams are also remembered by a MinHash
+signature of their shingles (runs of consecutive tokens), in
+`<corpus>.minhash`. A stream whose signature agrees with one already
+there in at least nearThreshold of its positions is a near duplicate. The
+signatures are split into bands, and only streams sharing a band with it
+are compared.
+"""
+
+import os
+import zlib
+import fcntl
+import hashlib
+
+import numpy as np
+
+DIGEST_BYTES = 20
+# Shingles of this many tokens are hashed for MinHash.
+SHINGLE_SIZE = 5
+# Signatures have BANDS * ROWS hashes; streams sharing any band of ROWS
+# hashes are compared.
+BANDS = 16
+ROWS = 4
+# Shingles hashed at a time, to bound memory.
+CHUNK = 8192
+
+
+def encoded(strings):
+    return [s.encode("UTF-8") if isinstance(s, unicode) else s
+            for s in strings]
+
+
+def digest(strings):
+    """SHA-1 of a list of strings."""
+    return hashlib.sha1(b"\0".join(encoded(strings))).digest()
+
+
+# The random hash functions of signature(), the same in every process.
+_random = np.random.RandomState(20140101)
+_multipliers = ((_random.randint(0, 1 << 31, BANDS * ROWS).astype(np.uint64)
+                 << np.uint64(33))
+                | (_random.randint(0, 1 << 31, BANDS * ROWS).astype(np.uint64)
+                   << np.uint64(1)) | np.uint64(1))
+_offsets = (_random.randint(0, 1 << 31, BANDS * ROWS).astype(np.uint64)
+            << np.uint64(32))
+_shingleMultiplier = np.uint64(1000003)
+
+
+def signature(strings):
+    """MinHash signature of the shingles of a list of strings."""
+    tokens = np.array([zlib.crc32(s) & 0xffffffff for s in encoded(strings)],
+                      dtype=np.uint64)
+    r = np.full(BANDS * ROWS, np.iinfo(np.uint32).max, dtype=np.uint64)
+    if len(tokens) == 0:
+        return r.astype(np.uint32)
+    size = min(SHINGLE_SIZE, len(tokens))
+    count = len(tokens) - size + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for j in range(size):
+        # Wraps around modulo 2**64, as intended.
+        shingles = shingles * _shingleMultiplier + tokens[j:j + count]
+    for start in range(0, count, CHUNK):
+        x = shingles[start:start + CHUNK]
+        h = (_multipliers[:, np.newaxis] * x + _offsets[:, np.newaxis])
+        r = np.minimum(r, (h >> np.uint64(32)).min(axis=1))
+    return r.astype(np.uint32)
+
+
+class dedupIndex(object):
+    """
+    The hashes of the token streams of one corpus. Read from readPath and
+    appended to writePath, like the corpus itself. Near duplicates are only
+    looked for if nearThreshold is more than 0.
+    """
+
+    def __init__(self, readPath, writePath, nearThreshold=0.0):
+        self.writePath = writePath
+        self.nearThreshold = nearThreshold
+        self.digests = set()
+        self.signatures = []
+        self.buckets = {}
+        self.pendingDigests = []
+        self.pendingSignatures = []
+        # How much of each file at writePath has been read.
+        self.read = {}
+        self.readFile(readPath + ".hashes", self.addDigests)
+        if nearThreshold > 0:
+            self.readFile(readPath + ".minhash", self.addSignatures)
+        if readPath != writePath:
+            self.read = {}
+
+    def readFile(self, path, add, f=None, offset=0):
+        """Pass the whole records in path, after offset, to add."""
+        recordBytes = self.recordBytes(path)
+        try:
+            if f is None:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            else:
+                f.seek(offset)
+                data = f.read()
+        except IOError:
+            return
+        data = data[:len(data) - len(data) % recordBytes]
+        add(data)
+        self.read[path] = offset + len(data)
+
+    def recordBytes(self, path):
+        if path.endswith(".hashes"):
+            return DIGEST_BYTES
+        return BANDS * ROWS * 4
+
+    def addDigests(self, data):
+        for i in range(0, len(data), DIGEST_BYTES):
+            self.digests.add(data[i:i + DIGEST_BYTES])
+
+    def addSignatures(self, data):
+        for row in np.frombuffer(data, dtype='<u4').reshape(-1, BANDS * ROWS):
+            self.addSignature(row)
+
+    def bands(self, sig):
+        return [(b, sig[b * ROWS:(b + 1) * ROWS].tostring())
+                for b in range(BANDS)]
+
+    def addSignature(self, sig):
+        i = len(self.signatures)
+        self.signatures.append(sig)
+        for key in self.bands(sig):
+            self.buckets.setdefault(key, []).append(i)
+
+    def nearDuplicate(self, sig):
+        """Is sig close enough to a signature already seen?"""
+        for key in self.bands(sig):
+            for i in self.buckets.get(key, ()):
+                if np.mean(self.signatures[i] == sig) >= self.nearThreshold:
+                    return True
+        return any(np.mean(pending == sig) >= self.nearThreshold
+                   for pending in self.pendingSignatures)
+
+    def admit(self, strings):
+        """
+        Is strings neither a stream already seen nor (if looking for them)
+        close to one? If so, it is held as pending until commit() saves it,
+        or abandon() forgets it because it didn't make it into the corpus.
+        """
+        d = digest(strings)
+        if d in self.digests or d in self.pendingDigests:
+            return False
+        if self.nearThreshold > 0:
+            sig = signature(strings)
+            if self.nearDuplicate(sig):
+                return False
+            self.pendingSignatures.append(sig)
+        self.pendingDigests.append(d)
+        return True
+
+    def commit(self, sync=True):
+        """
+        Append what admit() let in since the last commit, and take in what
+        other processes appended since this one last looked. With
+        sync=False the appends are flushed but not synced.
+        """
+        self.append(self.writePath + ".hashes", self.addDigests,
+                    b"".join(self.pendingDigests), sync)
+        self.digests.update(self.pendingDigests)
+        self.pendingDigests = []
+        if self.nearThreshold > 0:
+            self.append(self.writePath + ".minhash", self.addSignatures,
+                        b"".join(s.astype('<u4').tostring()
+                                 for s in self.pendingSignatures), sync)
+            for sig in self.pendingSignatures:
+                self.addSignature(sig)
+        self.pendingSignatures = []
+
+    def abandon(self):
+        """Forget what admit() let in since the last commit."""
+        self.pendingDigests = []
+        self.pendingSignatures = []
+
+    def append(self, path, add, data, sync=True):
+        if not data:
+            return
+        with open(path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(f.fileno()).st_size
+                # Drop a record torn by a killed process.
+                f.truncate(size - size % self.recordBytes(path))
+                self.readFile(path, add, f, self.read.get(path, 0))
+                f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+                self.read[path] = f.tell()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clear(self):
+        """Forget every stream, and remove the files at writePath."""
+        self.digests = set()
+        self.signatures = []
+        self.buckets = {}
+        self.pendingDigests = []
+        self.pendingSignatures = []
+        self.read = {}
+        for path in (self.writePath + ".hashes", self.writePath + ".minhash"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -112,8 +112,14 @@ ContStr = group(r"[uUbB]?[rR]?'[^\n'\\]*(?:\\.[^\n'\\]*)*" +
 PseudoExtras = group(r'\\\r?\n|\Z', Comment, Triple)
 PseudoToken = Whitespace + group(PseudoExtras, Number, Funny, ContStr, Name)
 
-tokenprog, pseudoprog, single3prog, double3prog = map(
-    re.compile, (Token, PseudoToken, Single3, Double3))
+# PseudoToken with a name on each alternative, for scan_tokens.
+NamedPseudoToken = Whitespace + '(?:%s)' % '|'.join(
+    '(?P<%s>%s)' % alternative for alternative in (
+        ('extras', PseudoExtras), ('number', Number), ('funny', Funny),
+        ('contstr', ContStr), ('name', Name)))
+
+tokenprog, pseudoprog, single3prog, double3prog, namedpseudoprog = map(
+    re.compile, (Token, PseudoToken, Single3, Double3, NamedPseudoToken))
 endprogs = {"'": re.compile(Single), '"': re.compile(Double),
             "'''": single3prog, '"""': double3prog,
             "r'''": single3prog, 'r"""': double3prog,
@@ -448,6 +454,161 @@ def generate_tokens(readline, mid_line=False):
         yield (DEDENT, '', (lnum, 0), (lnum, 0), '')
     yield (ENDMARKER, '', (lnum, 0), (lnum, 0), '')
 
+def split_lines(source):
+    "The lines of source as readline would return them."
+    lines = source.split('\n')
+    last = lines.pop()
+    lines = [l + '\n' for l in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+def scan_tokens(source, mid_line=False):
+    """
+    The same tokens as generate_tokens(StringIO(source).readline, mid_line),
+    faster. Takes the whole source as a string and generates flat 6-tuples:
+    the token type's name (as in tok_name), the token string, and the
+    starting row and column, then the ending row and column. The original
+    line isn't included.
+    """
+    return scan_lines(split_lines(source), mid_line)
+
+def scan_lines(lines, mid_line=False, first=0, indents=(0,)):
+    """
+    Like scan_tokens, on a list of lines from split_lines, starting at
+    lines[first]. That line has to start a statement, indented by the
+    columns in indents; row numbers count from the start of the list.
+    """
+    nlines = len(lines)
+    pseudomatch = namedpseudoprog.match
+    lnum = first
+    parenlev = continued = 0
+    contstr, needcont = '', 0
+    indents = list(indents)
+
+    while 1:                                   # loop over lines in stream
+        line = lines[lnum] if lnum < nlines else ''
+        lnum += 1
+        pos, max = 0, len(line)
+
+        if contstr:                            # continued string
+            if not line:
+                yield ('STRING', contstr, strstart[0], strstart[1], lnum, 0)
+                break
+            endmatch = endprog.match(line)
+            if endmatch:
+                pos = end = endmatch.end(0)
+                yield ('STRING', contstr + line[:end],
+                       strstart[0], strstart[1], lnum, end)
+                contstr, needcont = '', 0
+            elif needcont and line[-2:] != '\\\n' and line[-3:] != '\\\r\n':
+                yield ('ERRORTOKEN', contstr + line,
+                       strstart[0], strstart[1], lnum, len(line))
+                contstr = ''
+                continue
+            else:
+                contstr = contstr + line
+                continue
+
+        elif parenlev == 0 and not continued:  # new statement
+            if not line: break
+            column = 0
+            while pos < max:                   # measure leading whitespace
+                c = line[pos]
+                if c == ' ':
+                    column += 1
+                elif c == '\t':
+                    column = (column//tabsize + 1)*tabsize
+                elif c == '\f':
+                    column = 0
+                else:
+                    break
+                pos += 1
+            if pos == max:
+                break
+
+            c = line[pos]
+            if c in '#\r\n':                   # skip comments or blank lines
+                if c == '#':
+                    comment_token = line[pos:].rstrip('\r\n')
+                    nl_pos = pos + len(comment_token)
+                    yield ('COMMENT', comment_token, lnum, pos, lnum, nl_pos)
+                    yield ('NL', line[nl_pos:], lnum, nl_pos, lnum, max)
+                else:
+                    yield ('NL', line[pos:], lnum, pos, lnum, max)
+                continue
+
+            if column > indents[-1]:           # count indents or dedents
+                indents.append(column)
+                yield ('INDENT', line[:pos], lnum, 0, lnum, pos)
+            while column < indents[-1]:
+                indents.pop()
+                yield ('DEDENT', '', lnum, pos, lnum, pos)
+
+        else:                                  # continued statement
+            if not line:
+                break
+            continued = 0
+
+        while pos < max:
+            match = pseudomatch(line, pos)
+            if match:                          # scan for tokens
+                kind = match.lastgroup
+                start, end = match.span(kind)
+                pos = end
+                if start == end:
+                    continue
+                token = line[start:end]
+
+                if kind == 'name':                         # ordinary name
+                    yield ('NAME', token, lnum, start, lnum, end)
+                elif kind == 'funny':
+                    initial = token[0]
+                    if initial in '\r\n':
+                        yield ('NL' if parenlev > 0 else 'NEWLINE',
+                               token, lnum, start, lnum, end)
+                    else:
+                        if initial in '([{':
+                            parenlev += 1
+                        elif initial in ')]}':
+                            parenlev -= 1
+                        yield ('OP', token, lnum, start, lnum, end)
+                elif kind == 'number':                     # ordinary number
+                    yield ('NUMBER', token, lnum, start, lnum, end)
+                elif kind == 'contstr':
+                    if token[-1] == '\n':                  # continued string
+                        strstart = (lnum, start)
+                        endprog = (endprogs[token[0]] or endprogs[token[1]] or
+                                   endprogs[token[2]])
+                        contstr, needcont = line[start:], 1
+                        break
+                    else:                                  # ordinary string
+                        yield ('STRING', token, lnum, start, lnum, end)
+                elif token[0] == '#':
+                    yield ('COMMENT', token, lnum, start, lnum, end)
+                elif token[0] == '\\':                    # continued stmt
+                    continued = 1
+                else:                                      # triple quoted
+                    endprog = endprogs[token]
+                    endmatch = endprog.match(line, pos)
+                    if endmatch:                           # all on one line
+                        pos = endmatch.end(0)
+                        yield ('STRING', line[start:pos], lnum, start, lnum, pos)
+                    else:
+                        strstart = (lnum, start)           # multiple lines
+                        contstr = line[start:]
+                        break
+            else:
+                yield ('ERRORTOKEN', line[pos], lnum, pos, lnum, pos+1)
+                pos += 1
+
+    if mid_line:
+        return
+
+    for indent in indents[1:]:                 # pop remaining indent levels
+        yield ('DEDENT', '', lnum, 0, lnum, 0)
+    yield ('ENDMARKER', '', lnum, 0, lnum, 0)
+
 if __name__ == '__main__':                     # testing
     import sys
     if len(sys.argv) > 1:
@@ -23,8 +23,21 @@ except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
     from unnaturalcode.http import unnaturalhttp
 
+import argparse
 from flask import Flask
 
-app = Flask(__name__)
-app.register_blueprint(unnaturalhttp)
-app.run(host='0.0.0.0')
+parser = argparse.ArgumentParser(description='Serve the UnnaturalCode HTTP API.')
+parser.add_argument('-w', '--workers', type=int, default=0,
+                    help='pre-fork this many worker processes that share '
+                         'the models (0, the default, runs the Flask server)')
+parser.add_argument('--host', default='0.0.0.0')
+parser.add_argument('-p', '--port', type=int, default=5000)
+args = parser.parse_args()
+
+if args.workers > 0:
+    from unnaturalcode.http.prefork import serve
+    serve(host=args.host, port=args.port, workers=args.workers)
+else:
+    app = Flask(__name__)
+    app.register_blueprint(unnaturalhttp)
+    app.run(host=args.host, port=args.port, threaded=True)
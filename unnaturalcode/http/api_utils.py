@@ -22,15 +22,48 @@ Utitlities for common Flask operations.
 """
 
 from functools import wraps
-from flask import json, abort, request
+from flask import json, abort, request, g, jsonify, make_response
 from corpora import CORPORA
 
 
 def get_corpus_or_404(name):
-    "Returns corpus_name; aborts Request if the corpus_name is not found."
-    if name not in CORPORA:
+    """
+    Returns corpus_name; aborts Request if the corpus_name is not found.
+    The corpus stays open until release_corpora() is called at the end of
+    the request.
+    """
+    try:
+        corpus = CORPORA.acquire(name)
+    except KeyError:
+        abort(404)
+    if not hasattr(g, 'corpora'):
+        g.corpora = []
+    g.corpora.append(corpus)
+    return corpus
+
+
+def release_corpora():
+    "Lets go of the corpora get_corpus_or_404 returned in this request."
+    for corpus in getattr(g, 'corpora', ()):
+        CORPORA.release(corpus)
+    g.corpora = []
+
+
+def get_session_or_404(corpus_name, doc_id):
+    """
+    Returns the session for doc_id on corpus_name; aborts if there isn't
+    one, with 409 if it was dropped when the corpus was let go of.
+    """
+    corpus = get_corpus_or_404(corpus_name)
+    if corpus.sessions is None:
+        abort(404)
+    session = corpus.sessions.get(doc_id)
+    if session is None:
+        if CORPORA.was_dropped(corpus_name, doc_id):
+            abort(make_response(jsonify(
+                error='Session dropped; PUT the document again'), 409))
         abort(404)
-    return CORPORA[name]
+    return session
 
 
 def get_string_content():
@@ -25,7 +25,7 @@ def make_app():
 
 def server():
     app = make_app()
-    app.run(debug=True, host='0.0.0.0')
+    app.run(debug=True, host='0.0.0.0', threaded=True)
 
 if __name__ == '__main__':
     exit(server())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-batching for scoring requests.
+
+Request threads hand their windows to a Batcher and wait. One scoring
+thread takes whatever has queued up within a small latency budget, scores
+every distinct window in one call into the language model, and hands each
+request its entropies back. When too many requests are waiting, new ones
+are turned away with Overloaded instead of queueing without bound.
+"""
+
+import time
+import threading
+import Queue
+
+__all__ = ['Batcher', 'Overloaded']
+
+
+class Overloaded(Exception):
+    "Raised when the scoring queue is full."
+
+
+class Job(object):
+    def __init__(self, windows):
+        self.windows = windows
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Batcher(object):
+    """
+    Scores lists of windows (each a list of token strings) with
+    `score_batch`, which takes a list of windows and returns a list of
+    entropies, batching together the windows of concurrent requests.
+    """
+
+    def __init__(self, score_batch, max_delay=0.005, max_windows=4096,
+                 max_pending=256):
+        self.score_batch = score_batch
+        # How long the first request of a batch waits for company.
+        self.max_delay = max_delay
+        # Stop gathering once a batch has this many windows.
+        self.max_windows = max_windows
+        self.queue = Queue.Queue(max_pending)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+
+    def start(self):
+        "Called automatically. Starts the scoring thread in this process."
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def score(self, windows):
+        """
+        Entropy of each window, in order. Blocks until the batch it ends up
+        in is scored; raises Overloaded if the queue is full.
+        """
+        if len(windows) == 0:
+            return []
+        job = Job(windows)
+        self.start()
+        try:
+            self.queue.put_nowait(job)
+        except Queue.Full:
+            raise Overloaded()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stop(self):
+        "Stop the scoring thread once it has scored what is queued."
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                self.queue.put(None)
+            self.thread = None
+
+    def gather(self):
+        """
+        Wait for a job, then take any that arrive within the budget. None
+        if the thread is to stop.
+        """
+        first = self.queue.get()
+        if first is None:
+            return None
+        jobs = [first]
+        count = len(jobs[0].windows)
+        deadline = time.time() + self.max_delay
+        while count < self.max_windows:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                job = self.queue.get(timeout=remaining)
+            except Queue.Empty:
+                break
+            if job is None:
+                # Score what was gathered, then stop.
+                self.queue.put(None)
+                break
+            jobs.append(job)
+            count += len(job.windows)
+        return jobs
+
+    def run(self):
+        while True:
+            jobs = self.gather()
+            if jobs is None:
+                return
+            # The same window from several requests is only scored once.
+            distinct = {}
+            for job in jobs:
+                for window in job.windows:
+                    distinct.setdefault(tuple(window), len(distinct))
+            windows = [None] * len(distinct)
+            for (window, i) in distinct.items():
+                windows[i] = list(window)
+            try:
+                entropies = self.score_batch(windows)
+                for job in jobs:
+                    job.result = [entropies[distinct[tuple(window)]]
+                                  for window in job.windows]
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            self.batches += 1
+            for job in jobs:
+                job.done.set()
@@ -24,11 +24,19 @@ Currently only serves up a Python service.
 
 import shutil
 import os
+import time
 
-from api_utils import get_corpus_or_404, get_string_content
-from flask import Flask, make_response, jsonify, Blueprint
+from api_utils import (get_corpus_or_404, get_session_or_404,
+                       get_string_content, release_corpora)
+from corpora import CORPORA
+from flask import (Flask, make_response, jsonify, Blueprint, request, abort,
+                   json, Response, stream_with_context, url_for, g)
 from flask.ext.cors import cross_origin, CORS
-from token_fmt import parse_tokens
+from token_fmt import parse_tokens, decode_tokens, TOKENS_MIMETYPE
+from batching import Overloaded
+from bulk import read_ndjson, read_tar, imap_bounded, pool
+from metrics import request_seconds
+from unnaturalcode.ucMetrics import exposition
 
 
 app = unnaturalhttp = Blueprint('unnaturalcode-http', __name__)
@@ -36,6 +44,41 @@ app = unnaturalhttp = Blueprint('unnaturalcode-http', __name__)
 #/ ROUTES /####################################################################
 ###############################################################################
 
+@app.before_request
+def start_timer():
+    g.request_started = time.time()
+
+@app.after_request
+def record_time(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        request_seconds.observe(time.time() - started,
+                                request.endpoint, response.status_code)
+    return response
+
+@app.teardown_request
+def release(exc):
+    # After a streamed response has been sent, too.
+    release_corpora()
+
+@app.route('/metrics')
+def metrics():
+    """
+    GET /metrics
+
+    Metrics of this process, in the Prometheus text format.
+    """
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """
+    Too many scoring requests are already waiting; ask the client to back
+    off for a moment.
+    """
+    return make_response(jsonify(error='Too many requests queued'), 503,
+                         {'Retry-After': '1'})
+
 @app.route('/<corpus_name>/')
 def corpus_info(corpus_name):
     """
@@ -53,15 +96,21 @@ def corpus_info(corpus_name):
 @cross_origin()
 def predict(corpus_name, token_str=""):
     """
-    POST /{corpus}/predict/{tokens*}
+    GET /{corpus}/predict/{tokens*}
     POST /{corpus}/predict/f=?
 
-    Returns a number of suggestions for the given token prefix.
+    Returns a number of suggestions for the given token prefix. The POST
+    body may also be tokens in the binary encoding of token_fmt.
     """
     corpus = get_corpus_or_404(corpus_name)
 
     if token_str:
         tokens = parse_tokens(token_str)
+    elif request.mimetype == TOKENS_MIMETYPE:
+        try:
+            tokens = decode_tokens(request.get_data())
+        except ValueError:
+            abort(400)
     else:
         tokens = corpus.tokenize(get_string_content())
 
@@ -81,8 +130,8 @@ def cross_entropy(corpus_name):
     """
     corpus = get_corpus_or_404(corpus_name)
     content = get_string_content()
-    tokens = corpus.tokenize(content)
-    return jsonify(cross_entropy=corpus.cross_entropy(tokens))
+    return jsonify(cross_entropy=corpus.cached('xentropy', content,
+                                               corpus.cross_entropy))
 
 @app.route('/<corpus_name>/windowed-cross-entropy')
 @app.route('/<corpus_name>/wxentropy', methods=('GET', 'POST'))
@@ -96,8 +145,184 @@ def windowed_cross_entropy(corpus_name):
     """
     corpus = get_corpus_or_404(corpus_name)
     content = get_string_content()
-    tokens = corpus.tokenize(content)
-    return jsonify(windowed_cross_entropy=corpus.windowed_cross_entropy(tokens))
+    return jsonify(windowed_cross_entropy=corpus.cached(
+        'wxentropy', content, corpus.windowed_cross_entropy))
+
+@app.route('/<corpus_name>/bulk/xentropy', methods=('POST',))
+@cross_origin()
+def bulk_cross_entropy(corpus_name):
+    """
+    POST /{corpus}/bulk/xentropy
+
+    Score every document in the request body: newline-delimited JSON
+    objects {"name": ..., "s": ...}, or a tar stream (Content-Type
+    application/x-tar). Responds with one JSON object per document, as
+    each is scored.
+    """
+    corpus = get_corpus_or_404(corpus_name)
+    try:
+        count = int(request.args.get('n', 10))
+    except ValueError:
+        abort(400)
+    documents = get_documents()
+
+    def score(document):
+        (name, content) = document
+        result = {'name': name}
+        try:
+            if isinstance(content, Exception):
+                raise content
+            tokens = corpus.tokenize(content)
+            while True:
+                try:
+                    result.update(corpus.rank(tokens, count))
+                    break
+                except Overloaded:
+                    # Other requests come first; this one can wait.
+                    time.sleep(0.1)
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    def results():
+        for result in imap_bounded(pool(), score, documents):
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(results()),
+                    mimetype='application/x-ndjson')
+
+# How many documents bulk training appends to the corpus at a time.
+TRAIN_BATCH = 256
+
+def get_documents():
+    "The documents of a bulk request; see bulk_cross_entropy."
+    if request.mimetype in ('application/x-tar', 'application/x-gtar'):
+        return read_tar(request.stream)
+    return read_ndjson(request.stream)
+
+@app.route('/<corpus_name>/bulk/train', methods=('POST',))
+def bulk_train(corpus_name):
+    """
+    POST /{corpus}/bulk/train
+
+    Train the corpus with every document in the request body, in the same
+    formats as bulk_cross_entropy. The model is re-estimated once, in the
+    background; GET /{corpus}/model tells when it's done.
+    """
+    corpus = get_corpus_or_404(corpus_name)
+
+    def tokenize(document):
+        (name, content) = document
+        try:
+            if isinstance(content, Exception):
+                raise content
+            tokens = corpus.tokenize(content)
+            if len(tokens) == 0:
+                raise ValueError("No tokens")
+            return (name, tokens, None)
+        except Exception as e:
+            return (name, None, str(e))
+
+    documents = tokens = 0
+    errors = []
+    batch = []
+    for (name, lexemes, error) in imap_bounded(pool(), tokenize,
+                                               get_documents()):
+        if error is not None:
+            errors.append({'name': name, 'error': error})
+            continue
+        batch.append(lexemes)
+        documents += 1
+        tokens += len(lexemes)
+        if len(batch) >= TRAIN_BATCH:
+            corpus.train_many(batch)
+            batch = []
+    if batch:
+        corpus.train_many(batch)
+    if documents:
+        corpus.rebuild()
+
+    return make_response(jsonify(documents=documents, tokens=tokens,
+                                 errors=errors),
+                         202, {'Location': url_for('.model_status',
+                                                   corpus_name=corpus_name)})
+
+@app.route('/<corpus_name>/model')
+def model_status(corpus_name):
+    """
+    GET /{corpus}/model
+
+    Whether the model has been re-estimated since the corpus was trained.
+    """
+    return jsonify(get_corpus_or_404(corpus_name).model_status)
+
+def ranked(session):
+    "The response for an editor session: its worst windows."
+    try:
+        count = int(request.values.get('n', 10))
+    except ValueError:
+        abort(400)
+    return jsonify(ranking=session.ranking(count),
+                   tokens=len(session.strings))
+
+@app.route('/<corpus_name>/documents/<doc_id>', methods=('PUT',))
+@cross_origin()
+def open_document(corpus_name, doc_id):
+    """
+    PUT /{corpus}/documents/{doc_id}
+
+    Start (or restart) an editor session on the uploaded file.
+    """
+    corpus = get_corpus_or_404(corpus_name)
+    if corpus.sessions is None:
+        abort(404)
+    content = get_string_content()
+    session = corpus.open_session(doc_id, content)
+    CORPORA.forget_dropped(corpus_name, doc_id)
+    return ranked(session)
+
+@app.route('/<corpus_name>/documents/<doc_id>', methods=('PATCH',))
+@cross_origin()
+def edit_document(corpus_name, doc_id):
+    """
+    PATCH /{corpus}/documents/{doc_id}
+
+    Replace lines ?start up to ?end (counting from 0) with ?s, and return
+    the windows with the highest cross-entropy.
+    """
+    session = get_session_or_404(corpus_name, doc_id)
+    try:
+        start = int(request.form['start'])
+        end = int(request.form.get('end', start))
+        text = request.form.get('s', '')
+        with session.lock:
+            session.replace(start, end, text)
+    except (KeyError, ValueError):
+        abort(400)
+    return ranked(session)
+
+@app.route('/<corpus_name>/documents/<doc_id>', methods=('GET',))
+@cross_origin()
+def document_ranking(corpus_name, doc_id):
+    """
+    GET /{corpus}/documents/{doc_id}
+
+    The windows of the document with the highest cross-entropy.
+    """
+    session = get_session_or_404(corpus_name, doc_id)
+    with session.lock:
+        session.refresh()
+    return ranked(session)
+
+@app.route('/<corpus_name>/documents/<doc_id>', methods=('DELETE',))
+def close_document(corpus_name, doc_id):
+    corpus = get_corpus_or_404(corpus_name)
+    dropped = CORPORA.was_dropped(corpus_name, doc_id)
+    CORPORA.forget_dropped(corpus_name, doc_id)
+    if corpus.sessions is None or not (corpus.sessions.discard(doc_id)
+                                       or dropped):
+        abort(404)
+    return '', 204, {}
 
 @app.route('/<corpus_name>/', methods=('POST',))
 def train(corpus_name):
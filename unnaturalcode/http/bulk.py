@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Many documents in one request.
+
+Documents come in as newline-delimited JSON objects, {"name": ..., "s":
+...}, or as the regular files of a (possibly compressed) tar stream. They
+are handed to a pool of threads as they are read, a bounded number at a
+time, and each one's result is sent back as soon as it is ready.
+"""
+
+import os
+import json
+import tarfile
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+__all__ = ['read_ndjson', 'read_tar', 'imap_bounded', 'pool']
+
+_pool = None
+
+
+def pool():
+    "The thread pool bulk requests share, started on first use."
+    global _pool
+    if _pool is None:
+        _pool = ThreadPool(int(os.getenv("ucBulkThreads",
+                                         multiprocessing.cpu_count())))
+    return _pool
+
+
+def read_ndjson(stream):
+    """
+    Generates (name, content) for each line of stream. A line that isn't
+    a JSON object with a string "s" generates (name, ValueError).
+    """
+    for (number, line) in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            document = json.loads(line)
+            name = document.get('name', number)
+            content = document['s']
+            if not isinstance(content, basestring):
+                raise ValueError('"s" must be a string')
+        except (ValueError, KeyError, AttributeError) as e:
+            yield (number, ValueError("Line %i: %s" % (number, e)))
+            continue
+        yield (name, content)
+
+
+def read_tar(stream):
+    "Generates (name, content) for each regular file in a tar stream."
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile():
+                yield (member.name, archive.extractfile(member).read())
+
+
+def imap_bounded(pool, function, items, max_pending=64):
+    """
+    Like pool.imap_unordered(function, items), but reads items only as
+    fast as results are taken, keeping at most max_pending in flight. If
+    function raises, the exception is generated instead of a result.
+    """
+    def attempt(item):
+        try:
+            return function(item)
+        except Exception as e:
+            return e
+
+    done = Queue.Queue()
+    pending = 0
+    for item in items:
+        pool.apply_async(attempt, (item,), callback=done.put)
+        pending += 1
+        while pending >= max_pending or not done.empty():
+            yield done.get()
+            pending -= 1
+    while pending:
+        yield done.get()
+        pending -= 1
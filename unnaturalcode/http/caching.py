@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Caching of scoring results.
+
+Editors send the same buffer, or one that differs in a few lines, over and
+over. Each corpus keeps an LRUCache of whole-document results (keyed by a
+hash of the document) and of window entropies (keyed by the window's
+tokens), so that repeated and overlapping requests are answered from
+memory.
+"""
+
+import threading
+from collections import OrderedDict
+
+__all__ = ['LRUCache']
+
+# Rough cost in bytes of a cache entry beyond the strings in it.
+ENTRY_OVERHEAD = 128
+
+
+def size_of(value):
+    "Rough size in bytes of a key or value made of strings and numbers."
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return 8 * len(value) + sum(size_of(v) for v in value)
+    return 8
+
+
+class LRUCache(object):
+    """
+    A mapping that holds at most about `max_bytes` worth of entries,
+    forgetting the least recently used ones first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        "The value for key, or default. Counts as a use of the entry."
+        with self.lock:
+            try:
+                (value, size) = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        "Remember value for key, making room for it if necessary."
+        size = size_of(key) + size_of(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                (_, (_, evicted)) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
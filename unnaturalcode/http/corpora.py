@@ -23,19 +23,31 @@ Currently, only PythonCorpus is defined.
 """
 
 import os
+import re
 import shutil
+import hashlib
+import threading
+from collections import OrderedDict
 
 from unnaturalcode import ucUser
+from unnaturalcode.ucMetrics import stageSeconds, discardLabels
+from unnaturalcode.binaryModel import binaryModel
+from batching import Batcher
+from caching import LRUCache
+from sessions import Session, SessionStore, worst_windows
 
 from flask.json import loads as unjson
 
-__all__ = ['PythonCorpus', 'CORPORA', 'GenericCorpus']
+__all__ = ['PythonCorpus', 'CORPORA', 'GenericCorpus', 'CorpusRegistry']
 
 # See "On Naturalness of Software", Hindle et al. 2012
 BEHINDLE_NGRAM_ORDER = 6
 GOOD_ENOUGH_NGRAM_ORDER = 4
 CAMPBELL_NGRAM_ORDER = 10
 
+# Memory each corpus may spend remembering scores.
+CACHE_BYTES = int(os.getenv("ucCacheBytes", 64 * 1024 * 1024))
+
 class GenericCorpus(object):
     """
     The default UnnaturalCode Python corpus.
@@ -45,20 +57,33 @@ class GenericCorpus(object):
     description = __doc__
     language = 'Generic'
 
-    # Get the singleton instance of the underlying Python language (source)
-    # model.
-    # [sigh]... this API.
-    _user = ucUser.genericUser(ngram_order=CAMPBELL_NGRAM_ORDER)
-    _sourceModel = _user.sm
-    _lang = _sourceModel.lang()
-    _mitlm = _sourceModel.cm
-
-    order = _mitlm.order
+    # The ucUser that sets up the language (source) model, and the corpus
+    # file name it uses in UC_DATA, after the corpus name and a dot.
+    user_class = ucUser.genericUser
+    file_name = 'genericCorpus'
+    ngram_order = CAMPBELL_NGRAM_ORDER
     # Hard-coded because "it's the best! the best a language model can get!"
     smoothing = 'ModKN'
-
-    def __init__(self):
+    # Whether editor sessions can re-lex just the lines that changed.
+    incremental = False
+
+    def __init__(self, corpus_name=None):
+        # [sigh]... this API.
+        self._user = self.user_class(ngram_order=self.ngram_order,
+                                     corpusName=corpus_name)
+        self._sourceModel = self._user.sm
+        self._lang = self._sourceModel.lang()
+        self._mitlm = self._sourceModel.cm
+        self.order = self._mitlm.order
         self.last_updated = None
+        # Concurrent scoring requests share calls into the model.
+        self.batcher = Batcher(self._mitlm.queryCorpusBatch)
+        # Whole-document results and window entropies. Entries are keyed on
+        # generation, bumped by train and reset, and on the model they were
+        # scored with, which changes when it is re-estimated.
+        self.cache = LRUCache(CACHE_BYTES)
+        self.generation = 0
+        self.sessions = SessionStore() if self.incremental else None
 
     @property
     def summary(self):
@@ -73,16 +98,98 @@ class GenericCorpus(object):
         Tokenizes the given string in the manner appropriate for this
         corpus's language model.
         """
-        return self._sourceModel.lang(unjson(string))
+        with stageSeconds.time('lex', self._mitlm.name):
+            return self._sourceModel.lang(unjson(string))
 
     def train(self, tokens):
         """
         Trains the language model with tokens -- precious tokens!
         Updates last_updated as a side-effect.
         """
-        returnv = self._sourceModel.trainLexemes(tokens)
-        self._mitlm.stopMitlm()
-        return returnv
+        # The model is re-estimated in the background on the next query.
+        self.invalidate()
+        with stageSeconds.time('train', self._mitlm.name):
+            return self._sourceModel.trainLexemes(self.as_source(tokens))
+
+    def train_many(self, token_lists):
+        """
+        Trains the language model with several token strings at once; the
+        model isn't re-estimated until rebuild() or the next query.
+        """
+        self.invalidate()
+        with stageSeconds.time('train', self._mitlm.name):
+            return self._sourceModel.trainManyLexemes(
+                [self.as_source(tokens) for tokens in token_lists])
+
+    def as_source(self, tokens):
+        "Training needs the tokens as the language's source object."
+        if type(tokens) is list:
+            return self._sourceModel.lang(tokens)
+        return tokens
+
+    def rebuild(self):
+        """
+        Starts re-estimating the model in the background now, rather than
+        on the next query. Processes that follow a model file leave this to
+        the process that writes it.
+        """
+        if not self._mitlm.following:
+            self._mitlm.rebuildMitlm()
+
+    @property
+    def model_status(self):
+        "Whether the model has caught up with training."
+        cm = self._mitlm
+        if cm.following:
+            current = cm.modelIsCurrent()
+            rebuilding = not current
+        else:
+            current = cm.mitlmGeneration >= cm.corpusGeneration
+            rebuilding = cm.rebuilding()
+        return {
+            'corpus_generation': cm.corpusGeneration,
+            'model_generation': cm.mitlmGeneration,
+            'current': current,
+            'rebuilding': rebuilding,
+        }
+
+    def invalidate(self):
+        "Forget every cached score."
+        self.generation += 1
+        self.cache.clear()
+
+    def model_stamp(self):
+        "Identifies the model that scores would be computed with right now."
+        self._mitlm.startMitlm()
+        return (self.generation, self._mitlm.epoch, self._mitlm.mitlmGeneration)
+
+    def cached(self, kind, content, compute):
+        """
+        Returns compute(tokens) for the tokenized content, or what it
+        returned for the same content last time.
+        """
+        data = content.encode('UTF-8') if isinstance(content, unicode) else content
+        key = (kind, self.model_stamp(), hashlib.sha1(data).digest())
+        result = self.cache.get(key)
+        if result is None:
+            result = compute(self.tokenize(content))
+            self.cache.put(key, result)
+        return result
+
+    def score_windows(self, windows):
+        """
+        Entropy of each window (a list of token strings), scoring only the
+        ones that aren't cached.
+        """
+        stamp = self.model_stamp()
+        keys = [(stamp, tuple(window)) for window in windows]
+        entropies = [self.cache.get(key) for key in keys]
+        missing = [i for (i, e) in enumerate(entropies) if e is None]
+        scored = self.batcher.score([windows[i] for i in missing])
+        for (i, e) in zip(missing, scored):
+            entropies[i] = e
+            self.cache.put(keys[i], e)
+        return entropies
 
     def predict(self, tokens):
         """
@@ -114,18 +221,74 @@ class GenericCorpus(object):
         """
         Calculates the cross entropy for the given token string.
         """
-        return self._sourceModel.queryLexed(tokens)
+        return self.score_windows([self._sourceModel.stringifyAll(tokens)])[0]
 
     def windowed_cross_entropy(self, tokens):
         """
         Calculates the cross entropy for the given token string.
         """
-        return self._sourceModel.windowedQuery(tokens, returnWindows=False)
+        windows = self._sourceModel.windowStrings(tokens)
+        return [(False, e) for e in self.score_windows(windows)]
+
+    def rank(self, tokens, k=10):
+        """
+        Returns a dict of:
+            * cross_entropy: of the whole token string.
+            * ranking: the k windows with the highest cross entropy, and
+                       the lines they span.
+        """
+        windows = self._sourceModel.windowStrings(tokens)
+        return {
+            'cross_entropy': self.cross_entropy(tokens),
+            'ranking': worst_windows(self.score_windows(windows),
+                                     [t[2][0] - 1 for t in tokens],
+                                     self._sourceModel.windowSize, k)
+        }
+
+    def open_session(self, doc_id, content):
+        """
+        Lex and score a document that will be edited through its session.
+        """
+        session = Session(content, self.lex_lines, self.score_windows,
+                          self._sourceModel.windowSize, self.model_stamp)
+        self.sessions.put(doc_id, session)
+        return session
+
+    def resident_bytes(self):
+        "Roughly how much memory the model takes, if it is loaded."
+        model = self._mitlm.mitlm
+        if model is None:
+            return 0
+        if isinstance(model, binaryModel):
+            path = model.path
+        else:
+            path = self._mitlm.readCorpus
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def close(self):
+        "Let go of the model and everything else kept for this corpus."
+        self.batcher.stop()
+        self.cache.clear()
+        self._mitlm.release()
+        self._mitlm.stopMitlm()
+        # Or /metrics goes on reporting it.
+        discardLabels(corpus=self._mitlm.name)
 
     def reset(self):
+        self.invalidate()
         # Ask MITLM politely to relinquish its resources and halt.
         self._mitlm.release()
+        self._mitlm.stopMitlm()
         self._user.delete()
+        # Or followers go on serving it.
+        self._mitlm.deleteModel()
+        # What was trained before may be trained again.
+        self._sourceModel.dedup.clear()
+        # What was measured of the old model no longer holds.
+        discardLabels(corpus=self._mitlm.name)
 
     def __del__(self):
         # Ensures that MITLM has stopped.
@@ -141,26 +304,171 @@ class PythonCorpus(GenericCorpus):
     description = __doc__
     language = 'Python'
 
-    # Get the singleton instance of the underlying Python language (source)
-    # model.
-    # [sigh]... this API.
-    _user = ucUser.pyUser(ngram_order=GOOD_ENOUGH_NGRAM_ORDER)
-    _sourceModel = _user.sm
-    _lang = _sourceModel.lang()
-    _mitlm = _sourceModel.cm
-
-    order = _mitlm.order
-    # Hard-coded because "it's the best! the best a language model can get!"
-    smoothing = 'ModKN'
+    user_class = ucUser.pyUser
+    file_name = 'pyCorpus'
+    ngram_order = GOOD_ENOUGH_NGRAM_ORDER
+    incremental = True
 
     def tokenize(self, string, mid_line=True):
         """
         Tokenizes the given string in the manner appropriate for this
         corpus's language model.
         """
-        return self._lang.lex(string, mid_line)
+        with stageSeconds.time('lex', self._mitlm.name):
+            return self._lang.lex(string, mid_line)
+
+    def lex_lines(self, lines, first, indents):
+        """
+        Tokenizes lines from the statement starting on lines[first], the
+        same way tokenize would.
+        """
+        return self._lang.lexLines(lines, True, first, indents)
 
-CORPORA = {
-    'py': PythonCorpus(),
-    'generic' : GenericCorpus()
-}
+class CorpusRegistry(object):
+    """
+    Every corpus in UC_DATA, by name: `name.pyCorpus` is a Python corpus
+    called name and `name.genericCorpus` a generic one, while `pyCorpus`
+    and `genericCorpus` are the `py` and `generic` corpora, always served.
+
+    Corpora are set up on first use. When the models of those in use take
+    more than max_bytes, the least recently used are let go of. Requests
+    acquire() the corpora they use and release() them when done, and one
+    let go of while a request has it is only closed once released. Editor
+    sessions on it are dropped; was_dropped() remembers which, so that
+    their editors can be told to open them again.
+    """
+
+    kinds = (PythonCorpus, GenericCorpus)
+    defaults = {'py': PythonCorpus, 'generic': GenericCorpus}
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.loaded = OrderedDict()
+        self.lock = threading.RLock()
+        # How many requests have each corpus acquired, and which of those
+        # have been let go of meanwhile.
+        self.users = {}
+        self.retired = set()
+        # (name, doc_id) of sessions dropped with their corpus.
+        self.dropped = OrderedDict()
+        # Set by the pre-forking server: corpora use the model file the
+        # master process keeps up to date.
+        self.follow = False
+
+    def data_dir(self):
+        return os.getenv("UC_DATA", os.path.expanduser("~/.unnaturalCode"))
+
+    def discover(self):
+        """
+        {name: (corpus class, name given to it, corpus file)} for every
+        corpus there is.
+        """
+        corpora = {}
+        data_dir = self.data_dir()
+        for (name, cls) in self.defaults.items():
+            corpora[name] = (cls, None, os.path.join(data_dir, cls.file_name))
+        try:
+            files = os.listdir(data_dir)
+        except OSError:
+            files = []
+        for f in files:
+            (name, dot, kind) = f.partition('.')
+            if not dot or not CORPUS_NAME.match(name) or name in corpora:
+                continue
+            for cls in self.kinds:
+                if kind == cls.file_name:
+                    corpora[name] = (cls, name, os.path.join(data_dir, f))
+        return corpora
+
+    def __contains__(self, name):
+        return name in self.loaded or name in self.discover()
+
+    def __getitem__(self, name):
+        with self.lock:
+            corpus = self.loaded.pop(name, None)
+            if corpus is None:
+                corpora = self.discover()
+                if name not in corpora:
+                    raise KeyError(name)
+                (cls, corpus_name, path) = corpora[name]
+                corpus = cls(corpus_name)
+                if self.follow:
+                    corpus._mitlm.followModel()
+            self.loaded[name] = corpus
+            self.evict()
+            return corpus
+
+    def acquire(self, name):
+        "self[name], not to be closed until it is release()d."
+        with self.lock:
+            corpus = self[name]
+            self.users[corpus] = self.users.get(corpus, 0) + 1
+            return corpus
+
+    def release(self, corpus):
+        with self.lock:
+            self.users[corpus] -= 1
+            if self.users[corpus] > 0:
+                return
+            del self.users[corpus]
+            if corpus in self.retired:
+                self.retired.discard(corpus)
+                corpus.close()
+
+    def was_dropped(self, name, doc_id):
+        "Was the session doc_id dropped when corpus name was let go of?"
+        return (name, doc_id) in self.dropped
+
+    def forget_dropped(self, name, doc_id):
+        "The session doc_id has been opened again, or closed."
+        with self.lock:
+            self.dropped.pop((name, doc_id), None)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return sorted(self.discover())
+
+    def values(self):
+        "The corpora in use."
+        with self.lock:
+            return list(self.loaded.values())
+
+    def evict(self):
+        "Let go of least recently used corpora until the rest fit."
+        sizes = [(name, corpus.resident_bytes())
+                 for (name, corpus) in self.loaded.items()]
+        total = sum(size for (name, size) in sizes)
+        # The most recently used stays, whatever its size.
+        for (name, size) in sizes[:-1]:
+            if total <= self.max_bytes:
+                break
+            corpus = self.loaded.pop(name)
+            if corpus.sessions is not None:
+                with corpus.sessions.lock:
+                    for doc_id in corpus.sessions.sessions:
+                        self.dropped[(name, doc_id)] = True
+                while len(self.dropped) > MAX_DROPPED:
+                    self.dropped.popitem(last=False)
+            if corpus in self.users:
+                # Closed when the last request using it is done.
+                self.retired.add(corpus)
+            else:
+                corpus.close()
+            total -= size
+
+
+# Corpus names are used in URLs and file names.
+CORPUS_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# Memory the models of the corpora in use may take.
+MODEL_BYTES = int(os.getenv("ucModelBytes", 4 * 1024 * 1024 * 1024))
+
+# How many dropped sessions are remembered.
+MAX_DROPPED = 4096
+
+CORPORA = CorpusRegistry(MODEL_BYTES)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Metrics of the HTTP service, on top of those in unnaturalcode.ucMetrics.
+
+Request times are recorded as requests finish; everything about the
+corpora (cache hits, vocabulary and model sizes) is read off them when
+/metrics is requested.
+"""
+
+import os
+
+from unnaturalcode.binaryModel import binaryModel
+from unnaturalcode.ucMetrics import (ucCounter, ucGauge, ucHistogram,
+                                     addCollector)
+from corpora import CORPORA
+
+__all__ = ['request_seconds']
+
+request_seconds = ucHistogram(
+    'unnaturalcode_http_request_seconds',
+    'Time spent handling HTTP requests.', ('endpoint', 'status'))
+cache_lookups = ucCounter(
+    'unnaturalcode_cache_lookups_total',
+    'Lookups in the result cache.', ('corpus', 'result'))
+score_batches = ucCounter(
+    'unnaturalcode_score_batches_total',
+    'Batches of windows scored together.', ('corpus',))
+vocabulary_size = ucGauge(
+    'unnaturalcode_vocabulary_size',
+    'Unique tokens the corpus has been trained with.', ('corpus',))
+ngrams = ucGauge(
+    'unnaturalcode_ngrams',
+    'N-grams of each order in the model.', ('corpus', 'order'))
+model_bytes = ucGauge(
+    'unnaturalcode_model_bytes',
+    'Size of the mapped binary model file.', ('corpus',))
+
+
+def collect():
+    for corpus in CORPORA.values():
+        cm = corpus._mitlm
+        cache_lookups.set(corpus.cache.hits, cm.name, 'hit')
+        cache_lookups.set(corpus.cache.misses, cm.name, 'miss')
+        score_batches.set(corpus.batcher.batches, cm.name)
+        vocabulary_size.set(len(corpus._sourceModel.listOfUniqueTokens),
+                            cm.name)
+        model = cm.mitlm
+        if isinstance(model, binaryModel):
+            for (order, keys) in enumerate(model.keyTables):
+                ngrams.set(len(keys), cm.name, order)
+            try:
+                model_bytes.set(os.path.getsize(model.path), cm.name)
+            except OSError:
+                pass
+
+addCollector(collect)
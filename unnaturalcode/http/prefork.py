@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pre-forking server for production.
+
+The master process estimates each corpus' model, writes it out as a binary
+model file and binds the listening socket. It then forks worker processes
+that all accept on that socket. Workers map a model file in when its
+corpus is first used, so every worker shares the same pages, and they
+never estimate models themselves: training requests append to the corpus
+file, and every so often the master forks a process that re-estimates the
+model files, while it goes on restarting workers that die. Workers pick up
+a new model file on their next query.
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import multiprocessing
+from logging import info, warning, error
+
+from werkzeug.serving import make_server
+
+from unnaturalcode.mitlmCorpus import mitlmCorpus
+from .app import make_app
+from .corpora import CORPORA
+
+__all__ = ['serve']
+
+# The master's mitlmCorpus of each corpus file, only used to write models.
+_models = {}
+
+
+def models():
+    "A mitlmCorpus for every corpus in UC_DATA, including new ones."
+    for (cls, corpus_name, path) in CORPORA.discover().values():
+        if path not in _models:
+            _models[path] = mitlmCorpus(readCorpus=path, writeCorpus=path,
+                                        order=cls.ngram_order)
+    return _models.values()
+
+
+def refresh_models():
+    "Re-estimate any model file that is older than its corpus."
+    for cm in models():
+        try:
+            if cm.refreshModel():
+                info("Re-estimated %s" % cm.modelPath)
+        except Exception as e:
+            error("Could not re-estimate %s: %s" % (cm.modelPath, e))
+        finally:
+            # The master never queries; let go of what estimating left.
+            cm.stopMitlm()
+
+
+def refresher():
+    "Fork a process that runs refresh_models() once; returns its pid."
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 0
+        try:
+            refresh_models()
+        except Exception as e:
+            error("Refreshing models failed: %s" % e)
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+
+def worker(server):
+    "Body of a worker process; never returns."
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    status = 0
+    try:
+        server.serve_forever()
+    except Exception as e:
+        error("Worker %i died: %s" % (os.getpid(), e))
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(host='0.0.0.0', port=5000, workers=None, interval=5.0):
+    """
+    Serve the API from `workers` processes (by default, one per core),
+    re-estimating models changed by training every `interval` seconds.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    app = make_app()
+
+    # Everything workers share has to be set up before they are forked.
+    refresh_models()
+    for corpus in CORPORA.values():
+        corpus.close()
+    CORPORA.loaded.clear()
+    CORPORA.follow = True
+    # Threads within each worker, so that concurrent requests can be
+    # scored in one batch.
+    server = make_server(host, port, app, threaded=True)
+
+    children = set()
+    # The pid of the process re-estimating models, if there is one.
+    refreshing = None
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            worker(server)
+        children.add(pid)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    info("Serving on %s:%i with %i workers" % (host, port, workers))
+
+    try:
+        while True:
+            time.sleep(interval)
+            # Replace workers that died.
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except OSError as e:
+                    if e.errno != errno.ECHILD:
+                        raise
+                    break
+                if pid == 0:
+                    break
+                if pid == refreshing:
+                    refreshing = None
+                    continue
+                children.discard(pid)
+                warning("Worker %i exited with %i; restarting" % (pid, status))
+                spawn()
+            # Estimating can take a long time; the next round starts once
+            # this one is done.
+            if refreshing is None:
+                refreshing = refresher()
+    finally:
+        if refreshing is not None:
+            children.add(refreshing)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        server.socket.close()
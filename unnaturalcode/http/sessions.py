@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Editor sessions: documents kept lexed and scored between requests.
+
+An editor uploads a document once, then sends the lines it changed. Only
+the statements around the change are lexed again; lexing stops at the
+first statement past the change that starts the same way it did before,
+because everything after it lexes the same as before. Only the windows
+that include changed tokens are scored again.
+"""
+
+import heapq
+import threading
+from collections import OrderedDict
+
+from unnaturalcode.flexibleTokenize import split_lines, tabsize
+
+__all__ = ['Session', 'SessionStore', 'worst_windows']
+
+
+def indent_column(whitespace):
+    "The column that leading whitespace indents to, as the lexer counts it."
+    column = 0
+    for c in whitespace:
+        if c == ' ':
+            column += 1
+        elif c == '\t':
+            column = (column//tabsize + 1)*tabsize
+        elif c == '\f':
+            column = 0
+    return column
+
+
+def worst_windows(entropies, token_lines, window_size, k):
+    """
+    The k windows with the highest entropy, highest first, with the lines
+    they span (counting from 1). token_lines are the (0-based) lines the
+    tokens start on.
+    """
+    worst = heapq.nlargest(k, range(len(entropies)),
+                           key=entropies.__getitem__)
+    last = len(token_lines) - 1
+    return [{'start': token_lines[i] + 1 if token_lines else 1,
+             'end': (token_lines[min(i + window_size - 1, last)] + 1
+                     if token_lines else 1),
+             'entropy': entropies[i]}
+            for i in worst]
+
+
+class Session(object):
+    """
+    A document being edited. `lex_lines(lines, first, indents)` generates
+    lexemes from the statement starting on lines[first]; `score` takes a
+    list of windows (lists of token strings) and returns their entropies;
+    `stamp()` changes whenever scores might have.
+    """
+
+    def __init__(self, text, lex_lines, score, window_size, stamp):
+        self.lex_lines = lex_lines
+        self.score = score
+        self.window_size = window_size
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.lines = []
+        # starts[l] is the indentation stack of the statement starting on
+        # line l, or None if no statement starts there.
+        self.starts = []
+        # Token strings, and the (0-based) line each token starts on.
+        self.strings = []
+        self.token_lines = []
+        self.entropies = []
+        self.scored_with = None
+        self.replace(0, 0, text)
+
+    def replace(self, start, end, text):
+        """
+        Replace lines start up to (not including) end, counting from 0,
+        with the lines of text, then lex and score what changed.
+        """
+        if not 0 <= start <= end <= len(self.lines):
+            raise ValueError("No lines %i to %i" % (start, end))
+        new = split_lines(text)
+        if new and end < len(self.lines) and not new[-1].endswith('\n'):
+            new[-1] += '\n'
+        if (new and start == len(self.lines) > 0
+                and not self.lines[-1].endswith('\n')):
+            # Appending after a last line that has no newline yet.
+            start -= 1
+            new.insert(0, self.lines[-1] + '\n')
+        delta = len(new) - (end - start)
+        old_starts = self.starts
+        self.lines[start:end] = new
+        edited = start + len(new)
+
+        first = start
+        while first > 0 and (first >= len(old_starts)
+                             or old_starts[first] is None):
+            first -= 1
+        indents = old_starts[first] if first < len(old_starts) else (0,)
+        if indents is None:
+            indents = (0,)
+
+        # Lex until a statement past the edit starts as it did before.
+        strings = []
+        token_lines = []
+        starts = {}
+        stop = len(self.lines)
+        stack = list(indents)
+        pending = first
+        parenlev = 0
+        lost = False
+        for lexeme in self.lex_lines(self.lines, first, indents):
+            (kind, value, (row, col)) = (lexeme[0], lexeme[1], lexeme[2])
+            line = row - 1
+            if line == pending:
+                state = tuple(stack)
+                old = line - delta
+                if (line >= edited and old < len(old_starts)
+                        and old_starts[old] == state):
+                    stop = line
+                    break
+                starts[line] = state
+                pending = None
+            if kind == 'INDENT':
+                stack.append(indent_column(value))
+            elif kind == 'DEDENT':
+                stack.pop()
+            elif kind == 'OP' and value in '([{':
+                parenlev += 1
+            elif kind == 'OP' and value in ')]}':
+                parenlev -= 1
+            elif kind == 'ERRORTOKEN' and len(value) > 1:
+                # An unterminated string; the lexer keeps a little state
+                # from it that tokens don't show, so stop keeping track.
+                lost = True
+            elif kind in ('NEWLINE', 'NL') and parenlev == 0 and not lost:
+                pending = line + 1
+            strings.append(lexeme[4])
+            token_lines.append(line)
+
+        self.starts[first:stop - delta] = [starts.get(l)
+                                           for l in range(first, stop)]
+        # Splice the tokens in, moving the ones after them down.
+        a = self.find(first)
+        b = self.find(stop - delta)
+        if delta:
+            self.token_lines[b:] = [l + delta for l in self.token_lines[b:]]
+        self.token_lines[a:b] = token_lines
+        old_count = len(self.strings)
+        self.strings[a:b] = strings
+        try:
+            self.rescore(a, b, a + len(strings), old_count)
+        except Exception:
+            # The entropies no longer line up with the tokens.
+            self.scored_with = None
+            raise
+
+    def find(self, line):
+        "Index of the first token on or after line."
+        lo, hi = 0, len(self.token_lines)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.token_lines[mid] < line:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def windows(self, lo, hi):
+        "The token strings of windows lo up to hi."
+        n = self.window_size
+        if len(self.strings) <= n:
+            return [self.strings]
+        return [self.strings[i:i+n] for i in range(lo, hi)]
+
+    def window_count(self, tokens):
+        return max(1, tokens - self.window_size + 1)
+
+    def rescore(self, a, b_old, b_new, old_count):
+        """
+        Score the windows that include tokens a up to b_new, which replaced
+        tokens a up to b_old of old_count tokens.
+        """
+        n = self.window_size
+        new_count = len(self.strings)
+        if (self.stamp() != self.scored_with
+                or old_count <= n or new_count <= n):
+            return self.score_all()
+        lo = max(0, a - n + 1)
+        hi = min(b_new, self.window_count(new_count))
+        shift = b_new - b_old
+        self.entropies = (self.entropies[:lo]
+                          + self.score(self.windows(lo, hi))
+                          + self.entropies[hi - shift:])
+
+    def score_all(self):
+        self.scored_with = self.stamp()
+        self.entropies = self.score(
+            self.windows(0, self.window_count(len(self.strings))))
+
+    def refresh(self):
+        "Score everything again if the model changed."
+        if self.stamp() != self.scored_with:
+            self.score_all()
+
+    def ranking(self, k=10):
+        """
+        The k windows with the highest entropy, highest first, with the
+        lines they span (counting from 1).
+        """
+        return worst_windows(self.entropies, self.token_lines,
+                             self.window_size, k)
+
+
+class SessionStore(object):
+    "The most recently used sessions of a corpus, by document id."
+
+    def __init__(self, max_sessions=64):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, doc_id):
+        "The session for doc_id, or None."
+        with self.lock:
+            session = self.sessions.pop(doc_id, None)
+            if session is not None:
+                self.sessions[doc_id] = session
+            return session
+
+    def put(self, doc_id, session):
+        with self.lock:
+            self.sessions.pop(doc_id, None)
+            self.sessions[doc_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def discard(self, doc_id):
+        with self.lock:
+            return self.sessions.pop(doc_id, None) is not None
@@ -19,47 +19,124 @@
 
 """
 Parse token formats.
+
+Tokens come either as a URL path, `text:CATEGORY/text:CATEGORY/...` with
+backslash escapes, or in the binary encoding of encode_tokens: for each
+token, the length of its category as a varint, the category, the length
+of its text as a varint and the text, all UTF-8.
 """
 
-import more_itertools
+import re
+
+__all__ = ['parse_tokens', 'generate_parsed_tokens', 'encode_tokens',
+           'decode_tokens', 'TOKENS_MIMETYPE']
+
+TOKENS_MIMETYPE = 'application/x-unnaturalcode-tokens'
+
+# An escaped character, a separator, or a run of anything else (including
+# a backslash with nothing after it).
+_PIECE = re.compile(r'\\(.)|([:/])|([^\\:/]+|\\)', re.DOTALL)
 
 
-# This is pretty gross.
 def generate_parsed_tokens(token_str):
     """
-    Generate parsed tokens.
+    Generate parsed tokens. A separator at the very end of token_str is
+    taken literally.
     """
-    char_stream = more_itertools.peekable(token_str)
-
-    token_text = ''
-    token_category = ''
-    bucket = 'text'
-
-    while char_stream:
-        char = next(char_stream)
-        next_char = char_stream.peek(None)
-        if char == '\\' and next_char:
-            # It's an escaped char; add it to the set.
-            token_text += next_char
-            next(char_stream)
-        elif char == ':' and next_char:
-            bucket = 'category'
-        elif char == '/' and next_char:
-            # We have completed a token!
-            yield (token_category, token_text, [], [], token_text)
-            # Reset everything.
-            bucket = 'text'
-            token_text = ''
-            token_category = ''
+    end = len(token_str)
+    text = []
+    category = []
+    bucket = text
+
+    for match in _PIECE.finditer(token_str):
+        (escaped, separator, run) = match.groups()
+        if escaped is not None:
+            # Escaped characters always belong to the text.
+            text.append(escaped)
+        elif run is not None:
+            bucket.append(run)
+        elif match.end() == end:
+            bucket.append(separator)
+        elif separator == ':':
+            bucket = category
         else:
-            # We can simply add the character to the string.
-            if bucket == 'text':
-                token_text += char
-            else:
-                token_category += char
-
-    if token_text or token_category:
-        yield (token_category, token_text, [], [], token_text)
+            # We have completed a token!
+            token_text = ''.join(text)
+            yield (''.join(category), token_text, [], [], token_text)
+            text = []
+            category = []
+            bucket = text
+
+    if text or category:
+        token_text = ''.join(text)
+        yield (''.join(category), token_text, [], [], token_text)
+
+
+def _varint(n):
+    r = bytearray()
+    while n >= 0x80:
+        r.append(n & 0x7f | 0x80)
+        n >>= 7
+    r.append(n)
+    return bytes(r)
+
+
+def encode_tokens(tokens):
+    r"""
+    Binary encoding of (category, text) pairs.
+
+    >>> encode_tokens([('NAME', u'for'), ('', u'i')])
+    '\x04NAME\x03for\x00\x01i'
+    """
+    parts = []
+    for (category, text) in tokens:
+        for field in (category, text):
+            if isinstance(field, unicode):
+                field = field.encode('UTF-8')
+            parts.append(_varint(len(field)))
+            parts.append(field)
+    return b''.join(parts)
+
+
+def decode_tokens(data):
+    r"""
+    Parses the binary encoding of tokens; raises ValueError if it is cut
+    short or isn't UTF-8.
+
+    >>> decode_tokens(encode_tokens([('NAME', u'for'), ('OP', u'\u2192' * 200)]))[0]
+    (u'NAME', u'for', [], [], u'for')
+    >>> len(decode_tokens(encode_tokens([('OP', u'\u2192' * 200)]))[0][1])
+    200
+    >>> decode_tokens('\x04NAME\x03fo')
+    Traceback (most recent call last):
+        ...
+    ValueError: Token encoding ends early
+    """
+    data = bytearray(data)
+    tokens = []
+    i = 0
+    end = len(data)
+    while i < end:
+        fields = []
+        for _ in (0, 1):
+            length = 0
+            shift = 0
+            while True:
+                if i >= end:
+                    raise ValueError("Token encoding ends early")
+                byte = data[i]
+                i += 1
+                length |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            if i + length > end:
+                raise ValueError("Token encoding ends early")
+            fields.append(bytes(data[i:i + length]).decode('UTF-8'))
+            i += length
+        (category, text) = fields
+        tokens.append((category, text, [], [], text))
+    return tokens
 
 
 def parse_tokens(token_str):
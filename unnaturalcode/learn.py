@@ -16,23 +16,157 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
 
+"""
+Adds files to the Python corpus. Files are lexed and scrubbed by a pool of
+processes; this one adds them to the corpus and the unique tokens in
+batches. Each batch's files are then appended to a list next to the
+corpus, so that --resume can skip them after an interruption.
+"""
+
+import os
+import sys
+import time
 import argparse
+import multiprocessing
 
+from unnaturalcode.ucUtil import slurp
+from unnaturalcode.sourceModel import sourceModel
 from unnaturalcode.ucUser import pyUser
 
-def main():
-  ucpy = pyUser()
+def findFiles(paths):
+  """The files named, and the .py files under the directories named."""
+  for path in paths:
+    if not os.path.isdir(path):
+      yield path
+      continue
+    for (dirpath, dirnames, filenames) in os.walk(path):
+      dirnames.sort()
+      for filename in sorted(filenames):
+        if filename.endswith('.py'):
+          yield os.path.join(dirpath, filename)
+
+def scrubFile(job):
+  """
+  Lex and scrub a file, in a worker process. Returns (path, scrubbed,
+  None), or (path, None, why) if it could not be read or lexed.
+  """
+  (lexer, path) = job
+  try:
+    scrubbed = lexer(slurp(path)).scrubbed()
+    return (path, sourceModel.scrubLexemes(scrubbed), None)
+  except Exception as e:
+    return (path, None, "%s: %s" % (type(e).__name__, e))
+
+class ingestLog(object):
+  """The files that have been added to the corpus, one path per line."""
+
+  def __init__(self, path, resume):
+    self.path = path
+    self.done = set()
+    if resume and os.path.exists(path):
+      with open(path) as f:
+        self.done = set(line.rstrip('\n') for line in f)
+    self.f = open(path, 'a' if resume else 'w')
+
+  def add(self, paths):
+    self.f.write(''.join(p + '\n' for p in paths))
+    self.f.flush()
+    os.fsync(self.f.fileno())
+
+  def close(self):
+    self.f.close()
 
+class progress(object):
+  """Reports files done and files per second to stderr now and then."""
+
+  def __init__(self, total, interval=2.0, out=sys.stderr):
+    self.total = total
+    self.interval = interval
+    self.out = out
+    self.done = 0
+    self.failed = 0
+    self.start = self.last = time.time()
+
+  def report(self):
+    if self.out is None:
+      return
+    elapsed = max(time.time() - self.start, 1e-9)
+    self.out.write("%i/%i files, %i failed, %.1f files/s\n" % (
+      self.done, self.total, self.failed, self.done / elapsed))
+    self.out.flush()
+
+  def update(self, failed=False):
+    self.done += 1
+    self.failed += failed
+    now = time.time()
+    if now - self.last >= self.interval:
+      self.last = now
+      self.report()
+
+def ingest(sm, files, logPath, jobs=None, batchSize=500, resume=False,
+           quiet=False):
+  """
+  Train sm on files with a pool of jobs processes, adding batchSize files
+  to the corpus at a time. Returns how many files were added, leaving out
+  duplicates.
+  """
+  log = ingestLog(logPath, resume)
+  files = [os.path.abspath(f) for f in files]
+  files = [f for f in files if f not in log.done]
+  report = progress(len(files), out=None if quiet else sys.stderr)
+  pool = multiprocessing.Pool(jobs)
+  added = 0
+  batch = []
+  paths = []
+  try:
+    for (path, scrubbed, why) in pool.imap_unordered(
+        scrubFile, ((sm.lexer, f) for f in files), chunksize=8):
+      if why is not None:
+        sys.stderr.write("Skipping %s: %s\n" % (path, why))
+      else:
+        batch.append(scrubbed)
+      # Failed files are done too: they would fail again.
+      paths.append(path)
+      report.update(why is not None)
+      if len(paths) >= batchSize:
+        added += sm.trainScrubbed(batch)
+        log.add(paths)
+        batch = []
+        paths = []
+    added += sm.trainScrubbed(batch)
+    log.add(paths)
+  finally:
+    pool.terminate()
+    log.close()
+  report.report()
+  return added
+
+def main():
   parser = argparse.ArgumentParser(description='Add known-good Python files to UnnaturalCode.')
 
   parser.add_argument('files', metavar='file', type=str, nargs='+',
-                    help='A file to be added.')
+                    help='A file to be added, or a directory of .py files.')
+  parser.add_argument('-m', '--model', action='store_true',
+                    help='Also estimate the model and save it in binary form for fast startup.')
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                    help='Processes lexing files (default: one per core).')
+  parser.add_argument('-b', '--batch', type=int, default=500,
+                    help='Files added to the corpus at a time.')
+  parser.add_argument('-r', '--resume', action='store_true',
+                    help='Skip files a previous, interrupted run added.')
+  parser.add_argument('-q', '--quiet', action='store_true',
+                    help='Do not report progress.')
 
   args = parser.parse_args()
 
-  ucpy.sm.trainFile(args.files)
+  ucpy = pyUser()
+  ingest(ucpy.sm, findFiles(args.files), ucpy.cm.writeCorpus + ".ingested",
+         jobs=args.jobs, batchSize=args.batch, resume=args.resume,
+         quiet=args.quiet)
+  if args.model:
+    ucpy.cm.saveModel()
 
   ucpy.release()
   
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -19,11 +19,15 @@ from __future__ import print_function
 import os
 import os.path
 import errno
+import math
 from unnaturalcode.unnaturalCode import *
 import logging
 from logging import debug, info, warning, error, getLogger
-import codecs
+import threading
 import pymitlm
+from unnaturalcode.binaryModel import binaryModel, corpusStamp
+from unnaturalcode.corpusWriter import corpusWriter
+from unnaturalcode.ucMetrics import stageSeconds, modelRebuilds
 
 allWhitespace = re.compile('^\s+$')
 
@@ -42,17 +46,225 @@ class mitlmCorpus(object):
         self.readCorpus = (readCorpus or os.getenv("ucCorpus", "/tmp/ucCorpus"))
         self.writeCorpus = (writeCorpus or os.getenv("ucWriteCorpus", self.readCorpus))
         self.corpusFile = False
+        self.modelPath = self.readCorpus + ".model"
+        # Identifies the corpus in metrics.
+        self.name = os.path.basename(self.readCorpus)
         self.order = order
         self.mitlm = None
+        # The corpus file is the count store: sentences are appended to it
+        # and MITLM estimates from the whole file. corpusGeneration counts
+        # appends, mitlmGeneration is the count the current model has seen.
+        self.corpusGeneration = 0
+        self.mitlmGeneration = 0
+        self.epoch = 0
+        self.rebuilder = None
+        self.mitlmLock = threading.Lock()
+        # Held while a model is estimated, so only one is at a time.
+        self.buildLock = threading.Lock()
+        # Set by followModel(): the (mtime, inode) of the binary model file
+        # this process last mapped in, or None before the first one.
+        self.following = False
+        self.followed = None
+
+    def buildMitlm(self):
+        """
+        Estimate a new model from everything in the corpus file. If the
+        corpus is kept as a binary model, that is rewritten too.
+        """
+        modelRebuilds.inc(self.name)
+        # Taken first: what is appended while estimating may or may not be
+        # in the model, so the model must not count as having seen it.
+        stamp = corpusStamp(self.readCorpus)
+        with stageSeconds.time('estimate', self.name):
+            mitlm = pymitlm.PyMitlm(self.readCorpus, self.order, "KN", True)
+            if os.path.exists(self.modelPath):
+                mitlm = binaryModel.fromMitlm(mitlm, self.modelPath, stamp)
+        return mitlm
+
+    def modelIsCurrent(self):
+        """
+        Is there a binary model estimated from the corpus as it is now?
+        Compares the corpus with the stamp it had before the model was
+        estimated, not with when the model was written.
+        """
+        stamp = corpusStamp(self.readCorpus)
+        return (stamp is not None
+                and binaryModel.readStamp(self.modelPath) == stamp)
+
+    def loadModel(self):
+        """
+        Map the binary model in, if there is one and the corpus hasn't
+        changed since it was written.
+        """
+        if self.modelIsCurrent():
+            return binaryModel(self.modelPath)
+        return None
+
+    def refreshModel(self):
+        """
+        Re-estimate the binary model if the corpus has changed since it was
+        written. Returns whether it did.
+        """
+        if not os.path.exists(self.readCorpus):
+            # Deleted; don't leave followers its model.
+            self.deleteModel()
+            return False
+        if self.modelIsCurrent():
+            return False
+        self.saveModel()
+        return True
+
+    def deleteModel(self):
+        """
+        Remove the binary model file, and any being written, once the
+        corpus it was estimated from is gone.
+        """
+        (directory, name) = os.path.split(self.modelPath)
+        try:
+            writing = [os.path.join(directory, f)
+                       for f in os.listdir(directory or ".")
+                       if f.startswith(name + ".") and f.endswith(".tmp")]
+        except OSError:
+            writing = []
+        for path in [self.modelPath] + writing:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def modelIsOfCorpus(self, model):
+        """
+        Was model estimated from the corpus file there now, if maybe before
+        its latest appends? The corpus only grows, so it can't be smaller or
+        older than it was then. Models without a stamp are trusted.
+        """
+        stamp = corpusStamp(self.readCorpus)
+        if stamp is None:
+            return False
+        if model.corpusStamp is None or model.corpusStamp == (-1, -1):
+            return True
+        return (stamp[0] >= model.corpusStamp[0]
+                and stamp[1] >= model.corpusStamp[1])
+
+    def followModel(self):
+        """
+        Stop estimating models in this process: queries use the binary model
+        file, which some other process keeps up to date with refreshModel,
+        and pick up each new one as it is written.
+        """
+        self.following = True
+
+    def followMitlm(self):
+        """
+        The model in the binary model file, mapped in again whenever it is
+        rewritten. None if there is none, or if it is of a corpus that has
+        since been deleted; startMitlm() then goes on as if not following.
+        """
+        try:
+            st = os.stat(self.modelPath)
+            key = (st.st_mtime, st.st_ino)
+        except OSError:
+            key = None
+        if key != self.followed:
+            model = binaryModel(self.modelPath) if key is not None else None
+            with self.mitlmLock:
+                self.epoch += 1
+                self.mitlm = model
+                self.followed = key
+        model = self.mitlm
+        if key is None or not isinstance(model, binaryModel):
+            return None
+        if not self.modelIsOfCorpus(model):
+            with self.mitlmLock:
+                if self.mitlm is model:
+                    self.epoch += 1
+                    self.mitlm = None
+            return None
+        return model
+
+    def saveModel(self):
+        """
+        Estimate the model and write it out as a binary file, which is
+        loaded instead of the text corpus from then on.
+        """
+        with self.buildLock:
+            modelRebuilds.inc(self.name)
+            generation = self.corpusGeneration
+            stamp = corpusStamp(self.readCorpus)
+            with stageSeconds.time('estimate', self.name):
+                mitlm = pymitlm.PyMitlm(self.readCorpus, self.order, "KN",
+                                        True)
+                model = binaryModel.fromMitlm(mitlm, self.modelPath, stamp)
+            with self.mitlmLock:
+                self.epoch += 1
+                self.mitlm = model
+                self.mitlmGeneration = generation
+        return model
 
     def startMitlm(self):
         """
         Called automatically. Initializes MITLM, however we're interfacing to
-        it nowadays.
+        it nowadays. If the corpus has grown since the model was estimated,
+        a new model is estimated in the background and the old one keeps
+        answering queries until it is ready.
+        """
+        if self.following:
+            mitlm = self.followMitlm()
+            if mitlm is not None:
+                return mitlm
+        # Read once: stopMitlm() may clear the attribute at any time.
+        mitlm = self.mitlm
+        if mitlm is None:
+            mitlm = self.swapMitlm(self.epoch)
+        elif self.mitlmGeneration < self.corpusGeneration:
+            self.rebuildMitlm()
+        return mitlm
+
+    def rebuildMitlm(self):
         """
-        if self.mitlm == None:
-            self.mitlm = pymitlm.PyMitlm(self.readCorpus, self.order,
-                                         "KN", True)
+        Start re-estimating the model on a background thread, unless that
+        is already happening.
+        """
+        with self.mitlmLock:
+            if self.rebuilder is None or not self.rebuilder.is_alive():
+                self.rebuilder = threading.Thread(target=self.swapMitlm,
+                                                  args=(self.epoch,))
+                self.rebuilder.daemon = True
+                self.rebuilder.start()
+
+    def rebuilding(self):
+        """Is a new model being estimated in the background?"""
+        return self.rebuilder is not None and self.rebuilder.is_alive()
+
+    def swapMitlm(self, epoch):
+        """
+        Load or estimate a model of the corpus as it is now, and make it
+        the one queries use unless stopMitlm() was called in the meantime.
+        Returns the model either way.
+        """
+        with self.buildLock:
+            with self.mitlmLock:
+                # Built by another thread while this one waited.
+                mitlm = self.mitlm
+                if (mitlm is not None and epoch == self.epoch
+                        and self.mitlmGeneration >= self.corpusGeneration):
+                    return mitlm
+            generation = self.corpusGeneration
+            mitlm = self.loadModel() or self.buildMitlm()
+            with self.mitlmLock:
+                # stopMitlm() was called while we were estimating.
+                if epoch == self.epoch:
+                    self.mitlm = mitlm
+                    self.mitlmGeneration = generation
+            return mitlm
+
+    def stopMitlm(self):
+        """Throw away the model; the next query estimates a new one."""
+        with self.mitlmLock:
+            self.epoch += 1
+            self.mitlm = None
+            self.followed = None
 
     def corpify(self, lexemes):
         """Stringify lexed source: produce space-seperated sequence of lexemes"""
@@ -65,32 +277,52 @@ class mitlmCorpus(object):
         if (self.corpusFile):
             assert not self.corpusFile.closed
             return
-        self.corpusFile = codecs.open(self.writeCorpus, 'a', encoding='UTF-8')
+        self.corpusFile = corpusWriter(self.writeCorpus)
 
     def closeCorpus(self):
         """Closes the corpus (if necessary)"""
         if (self.corpusFile):
+            self.commitCorpus()
             self.corpusFile.close()
             assert self.corpusFile.closed
             self.corpusFile = None
 
     def addToCorpus(self, lexemes):
-        """Adds a string of lexemes to the corpus"""
-        assert isinstance(lexemes, list)
-        assert len(lexemes)
+        """Adds a string of lexemes to the corpus, without syncing it"""
+        return self.addAllToCorpus([lexemes], sync=False)
+
+    def addAllToCorpus(self, lexemeses, commit=True, sync=True):
+        """
+        Adds several strings of lexemes to the corpus in one write. With
+        commit=False, they are only buffered until commitCorpus(); with
+        sync=False, the commit doesn't wait for the disk.
+        """
+        assert isinstance(lexemeses, list)
+        lines = []
+        for lexemes in lexemeses:
+            assert isinstance(lexemes, list)
+            assert len(lexemes)
+            cl = self.corpify(lexemes)
+            assert(len(cl))
+            assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
+            lines.append(cl)
         self.openCorpus()
-        cl = self.corpify(lexemes)
-        assert(len(cl))
-        assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
-        print(cl, file=self.corpusFile)
-        self.corpusFile.flush()
-        # MITLM cannot (as of now) update its model, so just throw out the old
-        # one.
-        self.mitlm = None
+        if self.corpusFile.add(lines):
+            # The buffer filled up and was committed.
+            self.corpusGeneration += 1
+        if commit:
+            self.commitCorpus(sync)
+
+    def commitCorpus(self, sync=True):
+        """Write out, and sync unless told not to, what has been added."""
+        if not self.corpusFile or not self.corpusFile.commit(sync):
+            return
+        # MITLM cannot (as of now) update its model, so the next query
+        # starts re-estimating it while the old one keeps serving.
+        self.corpusGeneration += 1
 
     def queryCorpus(self, request):
-        self.startMitlm()
-        r = self.mitlm.xentropy((" ".join(request)).encode("UTF-8"))
+        r = self.startMitlm().xentropy((" ".join(request)).encode("UTF-8"))
         if r >= 1.0e70:
           qString = self.corpify(request)
           warning("Infinity: %s" % qString)
@@ -98,11 +330,109 @@ class mitlmCorpus(object):
           self.checkMitlm()
         return r
 
-    def predictCorpus(self, lexemes):
+    def queryCorpusBatch(self, requests):
+        """
+        Like queryCorpus, but scores a whole list of requests with one call
+        into MITLM. Returns a list of entropies in the same order.
+        """
+        if len(requests) == 0:
+            return []
+        mitlm = self.startMitlm()
+        with stageSeconds.time('score', self.name):
+            r = mitlm.xentropy_batch([(" ".join(request)).encode("UTF-8")
+                                      for request in requests])
+        for i in range(0, len(r)):
+            if r[i] >= 1.0e70:
+                warning("Infinity: %s" % self.corpify(requests[i]))
+                warning(str(r[i]))
+        return list(r)
+
+    def queryCorpusIds(self, windows, vocabulary):
+        """
+        Like queryCorpusBatch, for a 2-d array of ids in a ucVocabulary,
+        one window per row. A binary model scores the ids as they are.
+        """
+        if len(windows) == 0:
+            return []
+        mitlm = self.startMitlm()
+        if isinstance(mitlm, binaryModel):
+            with stageSeconds.time('score', self.name):
+                r = mitlm.xentropy_ids(windows, vocabulary)
+            if r is not None:
+                return r
+        strings = vocabulary.strings
+        return self.queryCorpusBatch([[strings[i] for i in window]
+                                      for window in windows])
+
+    def queryLogProbIds(self, ids, vocabulary):
+        """Like queryLogProbs, for ids in a ucVocabulary."""
+        mitlm = self.startMitlm()
+        if isinstance(mitlm, binaryModel):
+            r = mitlm.logprobs_ids(ids, vocabulary)
+            if r is not None:
+                return r
+        return self.queryLogProbs([vocabulary.strings[i] for i in ids])
+
+    def queryCandidates(self, left, candidates, right):
+        """
+        Entropy of left + [c] + right for each lexeme c in candidates,
+        scored in one batch. With a binary model the context is looked
+        up once and each candidate only costs the n-grams it is in.
+        """
+        mitlm = self.startMitlm()
+        if isinstance(mitlm, binaryModel):
+            encode = lambda ls: [l.encode("UTF-8") for l in ls]
+            return mitlm.xentropy_candidates(encode(left), encode(candidates),
+                                             encode(right))
+        return self.queryCorpusBatch([left + [c] + right for c in candidates])
+
+    def successorCandidates(self, context, k):
+        """
+        The k lexemes the model thinks most likely to follow context, or
+        None if the model can't list them.
+        """
+        mitlm = self.startMitlm()
+        if not isinstance(mitlm, binaryModel):
+            return None
+        return [mitlm.vocab[w].decode("UTF-8") for (logprob, w)
+                in mitlm.successors([l.encode("UTF-8") for l in context], k)]
+
+    def queryLogProbs(self, request):
+        """
+        Natural log probability of each lexeme in the request given the
+        lexemes before it, in one pass over the request.
+        """
+        return list(self.startMitlm().logprobs([l.encode("UTF-8") for l in request]))
+
+    def predictCorpus(self, lexemes, k=10):
+        """
+        Up to k (probability, [lexeme]) pairs, likeliest first, for what
+        follows lexemes. A binary model answers from its successor index.
+        """
+        mitlm = self.startMitlm()
+        if isinstance(mitlm, binaryModel):
+            return [(math.exp(logprob), [mitlm.vocab[w].decode("UTF-8")])
+                    for (logprob, w) in mitlm.successors(
+                        [l.encode("UTF-8") for l in lexemes], k)]
         return self.parsePredictionResult(
-            self.mitlm.predict(lexemes),
+            mitlm.predict((" ".join(lexemes)).encode("UTF-8")),
             remove_prefix=len(lexemes)
-        )
+        )[:k]
+
+    @staticmethod
+    def parsePredictionResult(result, remove_prefix=0):
+        """
+        Parse the output of PyMitlm.predict, one probability, a tab and the
+        words of a suggestion per line, into (probability, words) pairs,
+        leaving out the first remove_prefix words of each.
+        """
+        r = []
+        for line in result.splitlines():
+            if not line.strip():
+                continue
+            (probability, words) = line.split("\t", 1)
+            r.append((float(probability), words.split()[remove_prefix:]))
+        return r
 
     def release(self):
         """Close files and stop MITLM"""
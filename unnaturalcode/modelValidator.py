@@ -66,7 +66,7 @@ class ValidationFile(object):
         self.tempDir = tempDir
     
     def mutate(self, lexemes, locationPrev, location, locationNext):
-        assert isinstance(lexemes, ucSource)
+        assert isinstance(lexemes, (ucSource, ucSnapshot))
         #self.mutatedLexemes = self.lm(lexemes.deLex())
         self.mutatedLexemes = lexemes
         self.mutatedLocationPrev = locationPrev
@@ -316,6 +316,17 @@ class ModelValidation(object):
             pass
         elif os.path.exists(self.corpusPath + ".uniqueTokens"):
             os.remove(self.corpusPath + ".uniqueTokens")
+        if keep:
+            pass
+        elif os.path.exists(self.corpusPath + ".uniqueTokens.log"):
+            os.remove(self.corpusPath + ".uniqueTokens.log")
+        for suffix in (".hashes", ".minhash"):
+            if not keep and os.path.exists(self.corpusPath + suffix):
+                os.remove(self.corpusPath + suffix)
+        if keep:
+            pass
+        elif os.path.exists(self.corpusPath + ".model"):
+            os.remove(self.corpusPath + ".model")
         self.cm = corpus(readCorpus=self.corpusPath, writeCorpus=self.corpusPath, order=10)
         self.lm = language
         self.sm = sourceModel(cm=self.cm, language=self.lm)
@@ -6,7 +6,7 @@ class Mutators(object):
 
     def deleteRandom(self, vFile):
         """Delete a random token from a file."""
-        ls = copy(vFile.scrubbed)
+        ls = vFile.scrubbed.snapshot()
         idx = randint(1, len(ls)-2)
         after = ls[idx+1]
         token = ls.pop(idx)
@@ -16,7 +16,7 @@ class Mutators(object):
         return None
             
     def insertRandom(self, vFile):
-        ls = copy(vFile.scrubbed)
+        ls = vFile.scrubbed.snapshot()
         token = ls[randint(0, len(ls)-1)]
         pos = randint(1, len(ls)-2)
         inserted = ls.insert(pos, token)
@@ -26,7 +26,7 @@ class Mutators(object):
         return None
             
     def replaceRandom(self, vFile):
-        ls = copy(vFile.scrubbed)
+        ls = vFile.scrubbed.snapshot()
         token = ls[randint(0, len(ls)-1)]
         pos = randint(1, len(ls)-2)
         oldToken = ls.pop(pos)
@@ -79,9 +79,26 @@ class pythonSource(ucSource):
     lexemeClass = pythonLexeme
     
     def lex(self, code, mid_line=False):
-        tokGen = flexibleTokenize.generate_tokens(StringIO(code).readline,
-            mid_line)
-        return [pythonLexeme.fromTuple(t) for t in tokGen]
+        return list(self.lexLines(flexibleTokenize.split_lines(code), mid_line))
+
+    def lexLines(self, lines, mid_line=False, first=0, indents=(0,)):
+        """
+        Generates the lexemes of a list of lines, starting at a statement
+        that begins on lines[first] indented by indents; see
+        flexibleTokenize.scan_lines.
+        """
+        # Builds the lexemes directly; same as fromTuple on each token.
+        newLexeme = tuple.__new__
+        stringified = {}
+        stringify = pythonLexeme.stringify_build
+        for (t, v, startL, startC, endL, endC) in flexibleTokenize.scan_lines(
+                lines, mid_line, first, indents):
+            s = stringified.get((t, v))
+            if s is None:
+                s = stringified[(t, v)] = stringify(t, v)
+            yield newLexeme(pythonLexeme, (t, v,
+                newLexeme(ucPos, (startL, startC)),
+                newLexeme(ucPos, (endL, endC)), s))
     
    
     def unCommented(self):
@@ -108,6 +125,45 @@ class pythonSource(ucSource):
         assert len(r)
         return pythonSource(r)
 
+class pythonColumnarSource(ucColumnarSource):
+
+    lexemeClass = pythonLexeme
+    sourceClass = pythonSource
+
+    def lexColumns(self, code, mid_line=False):
+        typeId = self.types.intern
+        stringId = self.vocabulary.intern
+        stringify = pythonLexeme.stringify_build
+        stringIds = {}
+        for (t, v, startL, startC, endL, endC) in flexibleTokenize.scan_tokens(
+                code, mid_line):
+            s = stringIds.get((t, v))
+            if s is None:
+                s = stringIds[(t, v)] = stringId(stringify(t, v))
+            self.typeIds.append(typeId(t))
+            self.values.append(v)
+            self.startLines.append(startL)
+            self.startCols.append(startC)
+            self.endLines.append(endL)
+            self.endCols.append(endC)
+            self.stringIds.append(s)
+
+    def scrubbed(self):
+        """Same as pythonSource.scrubbed, on the type ids."""
+        assert len(self)
+        (comment, nl, newline, indent) = map(self.types.intern,
+            ('COMMENT', 'NL', 'NEWLINE', 'INDENT'))
+        t = self.typeIds
+        last = len(t)-1
+        keep = [i for i in xrange(0, len(t))
+                if not (t[i] == comment or t[i] == nl or
+                        (t[i] == newline and i < last and
+                         (t[i+1] == newline or t[i+1] == indent)))]
+        assert len(keep)
+        return self.select(keep)
+
+pythonSource.columnarClass = pythonColumnarSource
+
 class LexPyMQ(object):
 	def __init__(self, lexer):
 		self.lexer = lexer
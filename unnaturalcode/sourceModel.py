@@ -18,24 +18,48 @@
 from unnaturalcode.ucUtil import *
 from unnaturalcode.mitlmCorpus import *
 from unnaturalcode.pythonSource import *
-from unnaturalcode.unnaturalCode import ucLexeme
+from unnaturalcode.unnaturalCode import (ucLexeme, ucSource, ucSnapshot,
+                                         ucColumnarSource, ucVocabulary)
+from unnaturalcode.ucMetrics import stageSeconds
+from unnaturalcode.uniqueTokenStore import uniqueTokenStore
+from unnaturalcode.dedupIndex import dedupIndex
 from operator import itemgetter
+from multiprocessing.pool import ThreadPool
 from logging import debug, info, warning, error
 import os.path
 import pickle
+import threading
+import numpy as np
 
 class sourceModel(object):
 
-    def __init__(self, cm=mitlmCorpus(), language=pythonSource, windowSize=20):
+    def __init__(self, cm=mitlmCorpus(), language=pythonSource, windowSize=20,
+                 fixBeam=0, fixThreads=3, nearDuplicates=None):
         self.cm = cm
         self.lang = language
+        # Lex queries and training into arrays when the language can.
+        self.lexer = language.columnarClass or language
+        # What columnar lexemes lexed here are interned in; goes with the
+        # model.
+        self.vocabulary = ucVocabulary()
         self.windowSize = windowSize
-        self.listOfUniqueTokens = {}
+        # How many of the model's likeliest next lexemes fixQuery tries
+        # inserting or replacing with; 0 tries every unique token.
+        self.fixBeam = fixBeam
+        self.fixThreads = fixThreads
+        self.fixPool = None
         self.uTokenFile = self.cm.writeCorpus + ".uniqueTokens"
         readTokenFile = self.cm.readCorpus + ".uniqueTokens"
-        if os.path.isfile(readTokenFile):
-          with open(readTokenFile, "rb") as f:
-            self.listOfUniqueTokens = pickle.load(f)
+        self.uniqueTokenStore = uniqueTokenStore(readTokenFile, self.uTokenFile)
+        self.listOfUniqueTokens = self.uniqueTokenStore.load()
+        # (string, lexeme) added to listOfUniqueTokens since it was saved.
+        self.newUniqueTokens = []
+        # Training already in the corpus is skipped. So is training this
+        # similar (0 to 1, by MinHash) to some already there, if set.
+        if nearDuplicates is None:
+            nearDuplicates = float(os.getenv("ucNearDuplicates", 0))
+        self.dedup = dedupIndex(self.cm.readCorpus, self.cm.writeCorpus,
+                                nearDuplicates)
 
     def trainFile(self, files):
         """Blindly train on a set of files whether or not it compiles..."""
@@ -47,38 +71,121 @@ class sourceModel(object):
 
     def stringifyAll(self, lexemes):
         """Clean up a list of lexemes and convert it to a list of strings"""
+        if isinstance(lexemes, (ucSource, ucSnapshot, ucColumnarSource)):
+            return lexemes.strings()
         return [i[4] for i in lexemes]
 
     def corpify(self, lexemes):
         """Corpify a string"""
         return self.cm.corpify(self.stringifyAll(lexemes))
 
+    def lex(self, sourceCode):
+        """
+        Lex source code with the language's lexer, interning into this
+        model's vocabulary if it is columnar.
+        """
+        if issubclass(self.lexer, ucColumnarSource):
+            return self.lexer(sourceCode, vocabulary=self.vocabulary)
+        return self.lexer(sourceCode)
+
     def sourceToScrubbed(self, sourceCode):
-        return self.lang(sourceCode).scrubbed()
+        return self.lex(sourceCode).scrubbed()
 
     def trainLexemes(self, lexemes):
-        """Train on a lexeme sequence."""
-        lexemes = lexemes.scrubbed()
-        for l in lexemes:
-            if l[4] not in self.listOfUniqueTokens:
-                self.listOfUniqueTokens[l[4]] = l
-        with open(self.uTokenFile, "wb") as f:
-            pickle.dump(self.listOfUniqueTokens, f)
-        windowlen = self.windowSize
-        padding = windowlen
+        """
+        Train on a lexeme sequence, unless it is a duplicate. Callers
+        train file by file, so this only flushes; the corpus is synced by
+        the next batch or when it is closed.
+        """
+        return self.addLines([self.rememberLexemes(lexemes)], sync=False)
+
+    def trainManyLexemes(self, lexemeses):
+        """
+        Train on several lexeme sequences at once: the unique tokens are
+        saved and the corpus appended to once for all of them.
+        """
+        lines = [self.rememberLexemes(lexemes) for lexemes in lexemeses]
+        return self.addLines(lines)
+
+    def addLines(self, lines, sync=True):
+        """
+        Add padded lexeme strings to the corpus, leaving out duplicates,
+        and sync them unless sync=False. Returns how many were added.
+        """
+        lines = [line for line in lines if self.dedup.admit(line)]
+        if len(lines) == 0:
+            return 0
+        try:
+            self.saveUniqueTokens()
+            self.cm.addAllToCorpus(lines, sync=sync)
+        except:
+            # Not in the corpus, so not duplicates if they come again.
+            self.dedup.abandon()
+            raise
+        self.dedup.commit(sync)
+        return len(lines)
+
+    def rememberLexemes(self, lexemes):
+        """
+        Note any tokens in lexemes not seen before, and return the padded
+        strings to add to the corpus.
+        """
+        with stageSeconds.time('scrub', self.cm.name):
+            lexemes = lexemes.scrubbed()
         lstrings = self.stringifyAll(lexemes)
-        qstrings = ((["/*<START>*/"] * windowlen)
-                    + lstrings 
-                    + (["/*<END>*/"] * windowlen)
-                   )
-        return self.cm.addToCorpus(qstrings)
+        for i in range(0, len(lstrings)):
+            if lstrings[i] not in self.listOfUniqueTokens:
+                self.listOfUniqueTokens[lstrings[i]] = lexemes[i]
+                self.newUniqueTokens.append((lstrings[i], lexemes[i]))
+        windowlen = self.windowSize
+        return ((["/*<START>*/"] * windowlen)
+                + lstrings
+                + (["/*<END>*/"] * windowlen)
+               )
+
+    @staticmethod
+    def scrubLexemes(lexemes):
+        """
+        What trainScrubbed needs of lexemes: the strings of its scrubbed
+        lexemes, and the first lexeme of each distinct string. Picklable,
+        so that training can be lexed and scrubbed in other processes.
+        """
+        lexemes = lexemes.scrubbed()
+        lstrings = lexemes.strings()
+        firsts = {}
+        for i in range(0, len(lstrings)):
+            if lstrings[i] not in firsts:
+                firsts[lstrings[i]] = lexemes[i]
+        return (lstrings, firsts)
+
+    def trainScrubbed(self, scrubbed):
+        """
+        Train on several results of scrubLexemes at once, like
+        trainManyLexemes.
+        """
+        lines = []
+        for (lstrings, firsts) in scrubbed:
+            for (string, lexeme) in firsts.iteritems():
+                if string not in self.listOfUniqueTokens:
+                    self.listOfUniqueTokens[string] = lexeme
+                    self.newUniqueTokens.append((string, lexeme))
+            windowlen = self.windowSize
+            lines.append((["/*<START>*/"] * windowlen)
+                         + lstrings
+                         + (["/*<END>*/"] * windowlen))
+        return self.addLines(lines)
+
+    def saveUniqueTokens(self):
+        """Append the tokens not seen before to the unique token log."""
+        self.uniqueTokenStore.add(self.newUniqueTokens, self.listOfUniqueTokens)
+        self.newUniqueTokens = []
 
     def trainString(self, sourceCode):
         """Train on a source code string"""
         return self.trainLexemes(self.sourceToScrubbed(sourceCode))
 
     def queryString(self, sourceCode):
-        return self.queryLexed(self.lang(sourceCode))
+        return self.queryLexed(self.lex(sourceCode))
 
     def queryLexed(self, lexemes):
         return self.cm.queryCorpus(self.stringifyAll(lexemes))
@@ -94,16 +201,58 @@ class sourceModel(object):
                 return [(lexemes, self.queryLexed(lexemes))]
             else:
                 return [(False, self.queryLexed(lexemes))]                
-        r = []
-        for i in range(0,lastWindowStarts+1): # remember range is [)
-            end = i+self.windowSize
-            w = lexemes[i:end] # remember range is [)
-            e = self.queryLexed(w)
-            if returnWindows:
-                r.append( (w,e) )
-            else:
-                r.append( (False,e) )
-        return r
+        # Score every window of the file with a single call into MITLM.
+        entropies = self.queryWindows(lexemes)
+        if returnWindows:
+            windows = []
+            for i in range(0,lastWindowStarts+1): # remember range is [)
+                end = i+self.windowSize
+                windows.append(lexemes[i:end]) # remember range is [)
+            return zip(windows, entropies)
+        else:
+            return [(False, e) for e in entropies]
+
+    def windowStrings(self, lexemes):
+        """
+        The stringified windows that windowedQuery scores: the whole of a
+        short query, else every windowSize lexemes long run of it.
+        """
+        strings = self.stringifyAll(lexemes)
+        lastWindowStarts = len(strings)-self.windowSize
+        if lastWindowStarts < 1:
+            return [strings]
+        return [strings[i:i+self.windowSize]
+                for i in range(0,lastWindowStarts+1)]
+
+    def stringIds(self, lexemes):
+        """
+        (ids, vocabulary): the stringified lexemes as an array of ids in a
+        ucVocabulary, that of columnar lexemes or else this model's.
+        """
+        if isinstance(lexemes, ucColumnarSource):
+            return (np.frombuffer(lexemes.stringIds, dtype=np.intc),
+                    lexemes.vocabulary)
+        intern = self.vocabulary.intern
+        return (np.array([intern(s) for s in self.stringifyAll(lexemes)],
+                         dtype=np.intc), self.vocabulary)
+
+    def windowIds(self, ids):
+        """
+        The windows of windowStrings, from the array of stringIds, as a 2-d
+        array with one window per row.
+        """
+        size = min(len(ids), self.windowSize)
+        count = len(ids) - size + 1
+        return ids[np.arange(count)[:, np.newaxis] + np.arange(size)]
+
+    def queryWindows(self, lexemes):
+        """
+        Entropy of each of the windows of windowStrings. They are scored by
+        string id: each lexeme is looked up once, not once per window it is
+        in, and no window is joined into a string.
+        """
+        (ids, vocabulary) = self.stringIds(lexemes)
+        return self.cm.queryCorpusIds(self.windowIds(ids), vocabulary)
 
     def worstWindows(self, lexemes):
         lexemes = lexemes.scrubbed()
@@ -131,33 +280,36 @@ class sourceModel(object):
                        * windowlen)
                    )
         total_len = len(qstrings)
-        window_entropies = []
+        # Every token is scored once; surprisal[i] is the total surprisal
+        # of the first i tokens, so any window is a difference of two sums.
+        surprisal = [0.0]
+        if isinstance(lexemes, ucColumnarSource):
+            vocabulary = lexemes.vocabulary
+            logprobs = self.cm.queryLogProbIds(
+                [vocabulary.intern("/*<START>*/")] * windowlen
+                + list(lexemes.stringIds)
+                + [vocabulary.intern("/*<END>*/")] * windowlen,
+                vocabulary)
+        else:
+            logprobs = self.cm.queryLogProbs(qstrings)
+        for logprob in logprobs:
+            surprisal.append(surprisal[-1] - logprob)
         windows = []
-        unwindow_entropies = []
+        window_entropies = []
+        # Each window spreads its entropy evenly over its tokens; shares
+        # holds the running total of those per-token shares.
+        shares = [0.0]
         for token_i in range(0, total_len):
             qstart = max(0,token_i+1-windowlen)
             qend = token_i+1
-            query = qstrings[qstart:qend]
             windows.append(qtokens[qstart:qend])
-            entropy = self.cm.queryCorpus(query)
+            entropy = (surprisal[qend] - surprisal[qstart])/(qend-qstart)
             window_entropies.append(entropy)
-            unwindow_entropies.append(0)
-            for token_j in range(qstart, qend):
-                unwindow_entropies[token_j] += window_entropies[token_i]/(qend-qstart)
-            #if token_i >= content_start and token_i < content_end:
-                #"""
-                #This part is magical. It comes from building an array with a moving
-                #band of 1s representing the window and then inverting it.
-                #It could be made non-quadratic if necessary by saving earlier sums
-                #and reusing them.
-                #Apprently doesn't work that well, however.
-                #"""
-                #unwindow_entropies.append(
-                    #sum([window_entropies[i] for i in xrange(token_i,-1,-windowlen)])
-                    #- sum([window_entropies[i] for i in xrange(token_i-1,-1,-windowlen)])
-                #)
-            #else:
-                #unwindow_entropies.append(0) # don't consider padding tokens
+            shares.append(shares[-1] + entropy/(qend-qstart))
+        # Token j is covered by the windows ending at j .. j+windowlen-1.
+        unwindow_entropies = [shares[min(total_len, token_j+windowlen)]
+                              - shares[token_j]
+                              for token_j in range(0, total_len)]
         windows = zip(windows, window_entropies)
         windows = windows[content_start:content_end]
         unwindows = zip(qtokens, unwindow_entropies)
@@ -172,72 +324,84 @@ class sourceModel(object):
         else:
             return False
     
-    def tryDelete(self, lexemes, loci):
-        ta = lexemes[loci]
-        attempt = copy(lexemes)
+    def fixContext(self, lexemes, start, end):
+        """
+        Stringified lexemes either side of lexemes[start:end], windowSize
+        of them each, padded at the ends of the file.
+        """
+        left = (["/*<START>*/"] * max(0, self.windowSize-start) +
+                self.stringifyAll(lexemes[max(0, start-self.windowSize):start]))
+        right = (self.stringifyAll(lexemes[end:min(len(lexemes),end+self.windowSize)]) +
+                 ["/*<END>*/"] * max(0, (end-len(lexemes))+self.windowSize))
+        assert len(left) == self.windowSize, len(left)
+        assert len(right) == self.windowSize, len(right)
+        return (left, right)
+
+    def fixCandidates(self, left):
+        """
+        Strings of the lexemes worth trying after left: every unique token,
+        or only those among the model's fixBeam best successors.
+        """
+        if self.fixBeam:
+            successors = self.cm.successorCandidates(left, self.fixBeam)
+            if successors is not None:
+                return [s for s in successors if s in self.listOfUniqueTokens]
+        return self.listOfUniqueTokens.keys()
+
+    def bestCandidate(self, lexemes, start, end):
+        """
+        The unique token that fits best in place of lexemes[start:end], and
+        the entropy of the window with it there.
+        """
+        (left, right) = self.fixContext(lexemes, start, end)
+        candidates = self.fixCandidates(left)
+        if len(candidates) == 0:
+            candidates = self.listOfUniqueTokens.keys()
+        entropies = self.cm.queryCandidates(left, candidates, right)
+        best = min(range(0, len(candidates)), key=entropies.__getitem__)
+        return (self.listOfUniqueTokens[candidates[best]], entropies[best])
+
+    def proposeDelete(self, lexemes, loci):
+        attempt = lexemes.snapshot()
         deleted = attempt.pop(loci)
-        window = lexemes[max(0, loci-self.windowSize):
-                           min(len(lexemes),loci+self.windowSize+1)]
-        tb = window.pop(min(self.windowSize, loci))
-        assert ta == tb, "\n".join((repr(ta), repr(tb)))
-        qattempt = (["/*<START>*/"] * max(0, self.windowSize-loci) +
-                    self.stringifyAll(window) +
-                    ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize+1))
-        assert len(qattempt) == (2*self.windowSize), len(qattempt)
-        entropy = self.cm.queryCorpus(qattempt)
+        (left, right) = self.fixContext(lexemes, loci, loci+1)
+        entropy = self.cm.queryCorpus(left + right)
         assert len(attempt) == len(lexemes)-1
-        if self.isValid(attempt):
-            return (True, attempt, "Delete", loci, deleted, entropy)
-        else:
-            return (False, attempt, "Delete", loci, deleted, entropy)
-    
-    def tryInsert(self, lexemes, loci):
-        window = lexemes[max(0, loci-self.windowSize):
-                           min(len(lexemes),loci+self.windowSize)]
-        results = []
-        for string, token in self.listOfUniqueTokens.items():
-            wattempt = copy(window)
-            wattempt.insert(min(self.windowSize, loci), token)
-            qattempt = (["/*<START>*/"] * max(0, self.windowSize-loci) +
-                        self.stringifyAll(wattempt) +
-                        ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize))
-            assert len(qattempt) == (2*self.windowSize)+1, len(qattempt)
-            entropy = self.cm.queryCorpus(qattempt)
-            results.append((token, entropy))
-        bestresults = sorted(results, key=itemgetter(1), reverse=False)    
-        attempt = copy(lexemes)
-        attempt.insert(loci,bestresults[0][0])
+        return (attempt, "Delete", loci, deleted, entropy)
+
+    def proposeInsert(self, lexemes, loci):
+        (token, entropy) = self.bestCandidate(lexemes, loci, loci)
+        attempt = lexemes.snapshot()
+        attempt.insert(loci, token)
         assert len(attempt) == len(lexemes)+1
-        if self.isValid(attempt):
-            return (True, attempt, "Insert", loci, attempt[loci], bestresults[0][1])
-        else:
-            return (False, attempt, "Insert", loci, attempt[loci], bestresults[0][1])
+        return (attempt, "Insert", loci, attempt[loci], entropy)
 
-    def tryReplace(self, lexemes, loci):
-        ta = lexemes[loci]
-        window = lexemes[max(0, loci-self.windowSize):
-                           min(len(lexemes),loci+self.windowSize+1)]
-        results = []
-        for string, token in self.listOfUniqueTokens.items():
-            wattempt = copy(window)
-            tb = wattempt.pop(min(self.windowSize, loci))
-            assert ta == tb, "\n".join((repr(ta), repr(tb)))
-            wattempt.insert(self.windowSize, token)
-            qattempt = (["/*<START>*/"] * max(0, self.windowSize-loci) +
-                        self.stringifyAll(wattempt) +
-                        ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize+1))
-            assert len(qattempt) == (2*self.windowSize)+1, len(qattempt)
-            entropy = self.cm.queryCorpus(qattempt)
-            results.append((token, entropy))
-        bestresults = sorted(results, key=itemgetter(1), reverse=False)    
-        attempt = copy(lexemes)
+    def proposeReplace(self, lexemes, loci):
+        (token, entropy) = self.bestCandidate(lexemes, loci, loci+1)
+        attempt = lexemes.snapshot()
         attempt.pop(loci)
-        attempt.insert(loci,bestresults[0][0])
+        attempt.insert(loci, token)
         assert len(attempt) == len(lexemes)
-        if self.isValid(attempt):
-            return (True, attempt, "Replace", loci, attempt[loci], bestresults[0][1])
-        else:
-            return (False, attempt, "Replace", loci, attempt[loci], bestresults[0][1])
+        return (attempt, "Replace", loci, attempt[loci], entropy)
+
+    def validated(self, proposal):
+        """A proposed fix, prefixed with whether the result is valid."""
+        return (self.isValid(proposal[0]),) + proposal
+
+    def tryDelete(self, lexemes, loci):
+        return self.validated(self.proposeDelete(lexemes, loci))
+    
+    def tryInsert(self, lexemes, loci):
+        return self.validated(self.proposeInsert(lexemes, loci))
+
+    def tryReplace(self, lexemes, loci):
+        return self.validated(self.proposeReplace(lexemes, loci))
+
+    def startFixPool(self):
+        """Called automatically. Threads that fixQuery scores and checks on."""
+        if self.fixPool is None:
+            self.fixPool = ThreadPool(self.fixThreads)
+        return self.fixPool
 
     def fixQuery(self, lexemes, location):
         found = False
@@ -248,15 +412,34 @@ class sourceModel(object):
         assert found
         #TODO: This is wrong and needs to be fixed, but its compatible
         # with the ICSME paper
-        fixes = [(False, None, "None", loci, None, 1e70)]
-        fix = self.tryDelete(lexemes, loci)
-        if fix[0]: fixes.append(fix)
-        fix = self.tryInsert(lexemes, loci)
-        if fix[0]: fixes.append(fix)
-        fix = self.tryReplace(lexemes, loci)
-        if fix[0]: fixes.append(fix)
-        fixes = sorted(fixes, key=itemgetter(5), reverse=False)
-        return fixes[0]
+        pool = self.startFixPool()
+        # Have the model ready before three threads ask for it.
+        self.cm.startMitlm()
+        proposals = pool.map(lambda propose: propose(lexemes, loci),
+                             (self.proposeDelete,
+                              self.proposeInsert,
+                              self.proposeReplace))
+        proposals = sorted(proposals, key=itemgetter(4), reverse=False)
+        # Check them all at once, but take the lowest entropy valid one:
+        # once that is known the checks not yet started are skipped, so
+        # they don't hold up the pool.
+        done = threading.Event()
+        def check(attempt):
+            if done.is_set():
+                return None
+            return self.isValid(attempt)
+        checks = [pool.apply_async(check, (proposal[0],))
+                  for proposal in proposals]
+        try:
+            for (proposal, valid) in zip(proposals, checks):
+                if valid.get():
+                    return (True,) + proposal
+        finally:
+            done.set()
+        return (False, None, "None", loci, None, 1e70)
 
     def release(self):
+        if self.fixPool is not None:
+            self.fixPool.terminate()
+            self.fixPool = None
         self.cm.release()
@@ -0,0 +1,216 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Counters, gauges and histograms, written out in the Prometheus text
+format.
+
+Recording a value only takes a lock and a couple of additions; nothing is
+formatted until exposition() is called. Values that are cheap to read off
+other objects (sizes of models and caches) are better read by a collector,
+a function registered with addCollector that exposition() calls first.
+"""
+
+import os
+import time
+import threading
+from bisect import bisect_left
+
+# Seconds; from a fraction of a millisecond up to model re-estimation.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 300.0)
+
+metrics = []
+collectors = []
+
+
+def escape(value):
+    return (unicode(value).replace(u'\\', u'\\\\').replace(u'\n', u'\\n')
+            .replace(u'"', u'\\"'))
+
+
+def formatLabels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return u''
+    return u'{%s}' % u','.join(u'%s="%s"' % (n, escape(v)) for (n, v) in pairs)
+
+
+def formatValue(value):
+    if value == float('inf'):
+        return u'+Inf'
+    return repr(float(value))
+
+
+class ucMetric(object):
+    """A named family of values, one per combination of label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def samples(self):
+        """(name suffix, label values, extra labels, value) to write out."""
+        with self.lock:
+            return [(u'', k, (), v) for (k, v) in sorted(self.values.items())]
+
+    def discard(self, **match):
+        """
+        Forget the values whose labels have the values given, as in
+        discard(corpus='py'). Metrics without those labels keep theirs.
+        """
+        if not all(name in self.labels for name in match):
+            return
+        positions = [(self.labels.index(name), value)
+                     for (name, value) in match.items()]
+        with self.lock:
+            for key in list(self.values):
+                if all(key[i] == value for (i, value) in positions):
+                    del self.values[key]
+
+    def exposition(self):
+        lines = [u'# HELP %s %s' % (self.name, self.help),
+                 u'# TYPE %s %s' % (self.name, self.kind)]
+        for (suffix, values, extra, value) in self.samples():
+            lines.append(u'%s%s%s %s' % (
+                self.name, suffix, formatLabels(self.labels, values, extra),
+                formatValue(value)))
+        return u'\n'.join(lines)
+
+
+class ucCounter(ucMetric):
+    kind = 'counter'
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """For totals counted somewhere else, set by a collector."""
+        with self.lock:
+            self.values[labels] = value
+
+
+class ucGauge(ucMetric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class ucHistogram(ucMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(ucHistogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # One count per bucket and one past the last, then the sum.
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, *labels):
+        """
+        Use as `with histogram.time(labels...):` to observe how long the
+        block took.
+        """
+        return ucTimer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, list(v)) for (k, v) in self.values.items())
+        r = []
+        for (labels, counts) in items:
+            total = 0
+            for (bound, count) in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                r.append((u'_bucket', labels, [('le', formatValue(bound))],
+                          total))
+            r.append((u'_sum', labels, (), counts[-1]))
+            r.append((u'_count', labels, (), total))
+        return r
+
+
+class ucTimer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.start, *self.labels)
+
+
+def addCollector(collector):
+    """Call collector(), which sets gauges, before each exposition."""
+    collectors.append(collector)
+
+
+def discardLabels(**match):
+    """
+    Forget the values of every metric whose labels have the values given,
+    such as everything about a corpus that is no longer loaded.
+    """
+    for metric in metrics:
+        metric.discard(**match)
+
+
+def exposition():
+    """Every metric, in the Prometheus text format."""
+    for collector in collectors:
+        collector()
+    return u'\n'.join(m.exposition() for m in metrics) + u'\n'
+
+
+# Used across modules.
+stageSeconds = ucHistogram(
+    'unnaturalcode_stage_seconds',
+    'Time spent in each stage of handling source code.',
+    ('stage', 'corpus'))
+modelRebuilds = ucCounter(
+    'unnaturalcode_model_rebuilds_total',
+    'Models estimated from a corpus.', ('corpus',))
+residentBytes = ucGauge(
+    'process_resident_memory_bytes', 'Resident memory of this process.')
+
+
+def collectResident():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return
+    residentBytes.set(pages * os.sysconf('SC_PAGE_SIZE'))
+
+addCollector(collectResident)
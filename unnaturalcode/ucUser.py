@@ -34,17 +34,22 @@ class genericUser(object):
       assert os.access(self.ucDir, os.X_OK & os.R_OK & os.W_OK)
       assert os.path.isdir(self.ucDir)
   
-  def __init__(self, ngram_order=10):
+  def __init__(self, ngram_order=10, corpusName=None):
       self.getHome()
       
-      self.readCorpus = os.path.join(self.ucDir, 'genericCorpus') 
+      self.readCorpus = os.path.join(self.ucDir, self.fileName('genericCorpus', corpusName)) 
       if not os.path.exists(self.readCorpus):
         with open(self.readCorpus, 'wb') as f:
             corpus = 'for i in range ( 10 ) : <NEWLINE> <INDENT> print i\n'
             f.write(corpus)
-      self.logFilePath = os.path.join(self.ucDir, 'genericLogFile')
+      self.logFilePath = os.path.join(self.ucDir, self.fileName('genericLogFile', corpusName))
       self.lm = genericSource
       self.basicSetup(ngram_order)
+
+  @staticmethod
+  def fileName(base, corpusName=None):
+      """Each named corpus has its own files in UC_DATA: name.pyCorpus, ..."""
+      return base if corpusName is None else corpusName + '.' + base
    
   def basicSetup(self, ngram_order=10):
       self.uc = unnaturalCode(logFilePath=self.logFilePath)
@@ -67,14 +72,14 @@ class genericUser(object):
 
 class pyUser(genericUser):
   
-  def __init__(self, ngram_order=10):
+  def __init__(self, ngram_order=10, corpusName=None):
       self.getHome()
-      self.readCorpus = os.path.join(self.ucDir, 'pyCorpus') 
+      self.readCorpus = os.path.join(self.ucDir, self.fileName('pyCorpus', corpusName)) 
       if not os.path.exists(self.readCorpus):
         with open(self.readCorpus, 'wb') as f:
             corpus = 'for i in range ( 10 ) : <NEWLINE> <INDENT> print i\n'
             f.write(corpus)
-      self.logFilePath = os.path.join(self.ucDir, 'pyLogFile')
+      self.logFilePath = os.path.join(self.ucDir, self.fileName('pyLogFile', corpusName))
       self.lm = pythonSource
       self.basicSetup(ngram_order)
       
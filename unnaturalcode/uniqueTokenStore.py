@@ -0,0 +1,157 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The unique tokens of a corpus, {string: lexeme}, on disk.
+
+They are kept as a pickled snapshot, `<corpus>.uniqueTokens`, and a log of
+the tokens added since, `<corpus>.uniqueTokens.log`. Adding tokens appends
+one record to the log; once the log outgrows the snapshot, the two are
+merged into a new snapshot. Each log record is checked on loading, so a
+record torn by a killed process is skipped rather than spoiling the rest.
+Processes sharing a corpus lock the log while using it.
+"""
+
+import os
+import zlib
+import fcntl
+import struct
+import cPickle as pickle
+
+# Each log record: MAGIC, the length and CRC32 of the pickle, the pickle.
+MAGIC = b'UCT1'
+HEADER = struct.Struct('<4sIi')
+# The log is merged into the snapshot once it is bigger than this and the
+# snapshot.
+MIN_COMPACT_BYTES = 1 << 20
+
+
+def readRecords(data):
+    """Generates the lists of (string, lexeme) in data, skipping bad ones."""
+    i = 0
+    while i + HEADER.size <= len(data):
+        (magic, length, crc) = HEADER.unpack_from(data, i)
+        start = i + HEADER.size
+        payload = data[start:start + length]
+        if (magic == MAGIC and len(payload) == length
+                and zlib.crc32(payload) == crc):
+            try:
+                yield pickle.loads(payload)
+                i = start + length
+                continue
+            except Exception:
+                pass
+        # Torn or garbled; carry on from the next record.
+        i = data.find(MAGIC, i + 1)
+        if i < 0:
+            return
+
+
+class uniqueTokenStore(object):
+    """
+    The snapshot and log of one corpus. Tokens are read from readPath and
+    saved to writePath, like the corpus itself.
+    """
+
+    def __init__(self, readPath, writePath):
+        self.readPath = readPath
+        self.writePath = writePath
+        self.logPath = writePath + ".log"
+        # Until its first snapshot, writePath has none of readPath's tokens.
+        self.snapshotted = readPath == writePath
+
+    def lockedLog(self, path, mode, lock):
+        """The log at path, opened and locked, or None if there is none."""
+        try:
+            f = open(path, mode)
+        except IOError:
+            return None
+        fcntl.flock(f, lock)
+        return f
+
+    def read(self, path, log):
+        """The tokens in the snapshot at path, then in the open log."""
+        tokens = {}
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                tokens = pickle.load(f)
+        if log is not None:
+            log.seek(0)
+            for records in readRecords(log.read()):
+                for (string, lexeme) in records:
+                    if string not in tokens:
+                        tokens[string] = lexeme
+        return tokens
+
+    def load(self):
+        """All the unique tokens, {string: lexeme}."""
+        log = self.lockedLog(self.readPath + ".log", "rb", fcntl.LOCK_SH)
+        try:
+            return self.read(self.readPath, log)
+        finally:
+            if log is not None:
+                log.close()
+
+    def add(self, new, tokens):
+        """
+        Save new, a list of (string, lexeme) just added to tokens, all the
+        unique tokens.
+        """
+        if not self.snapshotted:
+            return self.compact(tokens)
+        if len(new) == 0:
+            return
+        payload = pickle.dumps(new, 2)
+        record = HEADER.pack(MAGIC, len(payload), zlib.crc32(payload))
+        log = self.lockedLog(self.logPath, "ab", fcntl.LOCK_EX)
+        try:
+            log.write(record + payload)
+            log.flush()
+            logBytes = os.fstat(log.fileno()).st_size
+        finally:
+            log.close()
+        try:
+            snapshotBytes = os.path.getsize(self.writePath)
+        except OSError:
+            snapshotBytes = 0
+        if logBytes > max(snapshotBytes, MIN_COMPACT_BYTES):
+            self.compact(tokens)
+
+    def compact(self, tokens):
+        """
+        Write a new snapshot of everything in the old one, the log and
+        tokens, and empty the log.
+        """
+        log = self.lockedLog(self.logPath, "a+b", fcntl.LOCK_EX)
+        try:
+            # Other processes may have logged tokens this one hasn't seen.
+            merged = self.read(self.writePath, log)
+            for (string, lexeme) in tokens.iteritems():
+                if string not in merged:
+                    merged[string] = lexeme
+            temporary = "%s.%i.tmp" % (self.writePath, os.getpid())
+            with open(temporary, "wb") as f:
+                pickle.dump(merged, f, 2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temporary, self.writePath)
+            log.truncate(0)
+            log.flush()
+            os.fsync(log.fileno())
+        finally:
+            log.close()
+        self.snapshotted = True
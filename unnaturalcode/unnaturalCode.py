@@ -16,9 +16,11 @@
 #    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
 from unnaturalcode.ucUtil import *
 import sys, os, zmq
+import threading
 import logging
 from logging import debug, info, warning, error
 from copy import copy
+from array import array
 
 if hasattr(sys, 'maxint'): # Python 2/3 Compatibility
   maxint = sys.maxint
@@ -199,9 +201,23 @@ class ucSource(list):
     
     Remember to override lexemeClass in subclasses so that the code here
     fills the source list with lexemes of the correct class!
+    
+    insert() and pop() don't move the lexemes after the edit right away:
+    the shift is logged, and applied to a lexeme when it is read. Anything
+    that reads the whole list (iterating, slicing, comparing, copying) or
+    changes it any other way applies the logged shifts to every lexeme
+    first, and so does the maxEdits-th logged edit.
     """
   
     lexemeClass = ucLexeme
+    maxEdits = 64
+    # (index, count, shift) for each insert (count lexemes) or pop (count
+    # -1) since positions were last brought up to date.
+    edits = ()
+    # The lexemes as a tuple, shared by snapshot()s until the source changes.
+    frozen = None
+    # The ucColumnarSource subclass for the same language, if there is one.
+    columnarClass = None
 
     def __init__(self, value=[], **kwargs):
         if isinstance(value, basestring):
@@ -249,22 +265,40 @@ class ucSource(list):
         assert isinstance(self[i], ucLexeme)
         assert self[i].end <= self[i+1].start, repr(self[i:i+2])
     
-    if ucParanoid:
-        def extend(self, arg):
+    def extend(self, arg):
+        self.changing()
+        if ucParanoid:
+            arg = list(arg)
             for a in arg:
                 assert isinstance(a, ucLexeme)
-            s = len(self)-1
-            r = super(ucSource, self).extend(arg)
-            if s >= 0:
-                self.check(start=s)
-            return r
+        s = len(self)-1
+        r = super(ucSource, self).extend(arg)
+        if ucParanoid and s >= 0:
+            self.check(start=s)
+        return r
     
-        def append(self, *args):
-            return self.extend(args)
+    def append(self, *args):
+        return self.extend(args)
       
     def insert(self, i, arg):
         assert i <= len(self), str(i) + " " + str(len(self))
         assert i >= 0
+        (a, shift) = self.placed(i, arg)
+        # Everything from i on moves down by the inserted lexemes.
+        self.logEdit(i, len(a), shift)
+        for j in range(0, len(a)):
+          r = super(ucSource, self).insert(i+j, a[j])
+        if len(self.edits) > self.maxEdits:
+            self.flush()
+        if ucParanoid:
+            self.check()
+        return a
+
+    def placed(self, i, arg):
+        """
+        The lexemes in arg positioned to go in at i, and the shift that
+        putting them there makes to what follows.
+        """
         if not isinstance(arg, list):
           arg = [arg]
         if not isinstance(arg, ucSource):
@@ -275,7 +309,6 @@ class ucSource(list):
         if (a[0].start.l == a[-1].end.l):
           width = a[-1].end.c - a[0].start.c
         height = a[-1].end.l - a[0].start.l
-        oldend = self[-1].end.l
         for j in range(0, len(a)):
           ((startL, startC), (endL, endC)) = (a[j].start, a[j].end)
           #info(repr(self[i-1]))
@@ -291,68 +324,201 @@ class ucSource(list):
           #info(" >" + repr(self[i-1]))
           #info(" >" + repr(a[j]))
           #info(" >" + repr(self[i]))
-        for j in range(i, len(self)):
-          ((startL, startC), (endL, endC)) = (self[j].start, self[j].end)
-          if startL == a[-1].end.l:
-            startC += width+1
-          if endL == a[-1].start.l:
-            endC += width+1
-          startL += height
-          endL += height
-          self[j:j+1] = [self[j].__class__((self[j][0], self[j][1], ucPos((startL, startC)), ucPos((endL, endC)), self[j][4]))]
-        #info(" >>" + repr(self[i-1]))
-        #info(" >>" + repr(a[0]))
-        #info(" >>" + repr(self[i]))
-        for j in range(0, len(a)):
-          r = super(ucSource, self).insert(i+j, a[j])
-        #info(" >>>" + repr(self[i-1]))
-        #info(" >>>" + repr(self[i]))
-        #info(" >>>" + repr(self[i+1]))
-        #if ( self[-1].end.l > oldend +1):
-          #info(str(self[-1].end.l) + " > " + str(oldend + 1))
-          #assert(false, 'waugh!')
-        if ucParanoid:
-            self.check()
-        return a
+        return (a, ('insert', width, height, a[-1].end.l, a[-1].start.l))
     
     def pop(self, i):
         assert i < len(self)
         assert i >= 0
-        r = super(ucSource, self).pop(i)
-        removedLines = r.lines()
-        for j in range(i, len(self)):
-          ((startL, startC), (endL, endC)) = (self[j].start, self[j].end)
-          if startL == r.end.l:
-            startC += r.start.c - r.end.c
-            if endL == startL:
-              endC += r.start.c - r.end.c
-          startL -= r.lines()
-          endL -= r.lines()
-          self[j:j+1] = [self[j].__class__((self[j][0], self[j][1], ucPos((startL, startC)), ucPos((endL, endC)), self[j][4]))]
+        r = self[i]
+        super(ucSource, self).pop(i)
+        # Everything after it moves up into the gap.
+        self.logEdit(i, -1, self.popShift(r))
+        if len(self.edits) > self.maxEdits:
+            self.flush()
         if ucParanoid:
             self.check()
         return r
 
+    @staticmethod
+    def popShift(r):
+        """The shift that popping r makes to what follows it."""
+        return ('pop', r.end.l, r.start.c - r.end.c, r.lines())
+
+    def logEdit(self, i, count, shift):
+        self.frozen = None
+        if not self.edits:
+            self.edits = []
+        self.edits.append((i, count, shift))
+
+    def shifted(self, lexeme, shifts):
+        """Move lexeme the way the edits that made shifts moved it."""
+        ((startL, startC), (endL, endC)) = (lexeme[2], lexeme[3])
+        for shift in shifts:
+            if shift[0] == 'insert':
+                (kind, width, height, aEndL, aStartL) = shift
+                if startL == aEndL:
+                    startC += width+1
+                if endL == aStartL:
+                    endC += width+1
+                startL += height
+                endL += height
+            else:
+                (kind, rEndL, dC, lines) = shift
+                if startL == rEndL:
+                    startC += dC
+                    if endL == startL:
+                        endC += dC
+                startL -= lines
+                endL -= lines
+        return lexeme.__class__((lexeme[0], lexeme[1], ucPos((startL, startC)), ucPos((endL, endC)), lexeme[4]))
+
+    def current(self, i):
+        """The lexeme at i, moved by any edits logged since it was stored."""
+        r = super(ucSource, self).__getitem__(i)
+        if not self.edits:
+            return r
+        if i < 0:
+            i += len(self)
+        shifts = []
+        # Follow the lexeme back through the edits until it was inserted.
+        for (at, count, shift) in reversed(self.edits):
+            if i < at:
+                continue
+            if count > 0:
+                if i < at + count:
+                    break
+                i -= count
+            else:
+                i += 1
+            shifts.append(shift)
+        if len(shifts) == 0:
+            return r
+        return self.shifted(r, reversed(shifts))
+
+    def flush(self):
+        """Apply the logged edits to every lexeme."""
+        if not self.edits:
+            return
+        updated = [self.current(i) for i in range(0, len(self))]
+        self.edits = ()
+        super(ucSource, self).__setitem__(slice(None), updated)
+
+    def changing(self):
+        """Called before the list is changed other than by insert or pop."""
+        self.flush()
+        self.frozen = None
+
+    def snapshot(self):
+        """
+        A ucSnapshot of the source as it is now: a copy that shares the
+        lexemes with the source and other snapshots, and can be edited.
+        """
+        if self.frozen is None:
+            self.flush()
+            self.frozen = tuple(super(ucSource, self).__iter__())
+        return ucSnapshot(self.frozen, self.__class__)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.flush()
+            return super(ucSource, self).__getitem__(index)
+        return self.current(index)
+
+    def __getslice__(self, i, j):
+        self.flush()
+        return super(ucSource, self).__getslice__(i, j)
+
+    def __iter__(self):
+        self.flush()
+        return super(ucSource, self).__iter__()
+
+    def __reversed__(self):
+        self.flush()
+        return super(ucSource, self).__reversed__()
+
+    def __contains__(self, value):
+        self.flush()
+        return super(ucSource, self).__contains__(value)
+
+    def __eq__(self, other):
+        self.flush()
+        return super(ucSource, self).__eq__(other)
+
+    def __ne__(self, other):
+        self.flush()
+        return super(ucSource, self).__ne__(other)
+
+    def __add__(self, other):
+        self.flush()
+        return super(ucSource, self).__add__(other)
+
+    def __radd__(self, other):
+        return other + list(self)
+
+    def __repr__(self):
+        self.flush()
+        return super(ucSource, self).__repr__()
+
+    def __copy__(self):
+        self.flush()
+        r = list.__new__(self.__class__)
+        r.__dict__.update(self.__dict__)
+        super(ucSource, r).extend(self)
+        return r
+
+    def index(self, *args):
+        self.flush()
+        return super(ucSource, self).index(*args)
+
+    def count(self, value):
+        self.flush()
+        return super(ucSource, self).count(value)
+
+    def remove(self, value):
+        self.changing()
+        return super(ucSource, self).remove(value)
+
+    def reverse(self):
+        self.changing()
+        return super(ucSource, self).reverse()
+
+    def __delitem__(self, index):
+        self.changing()
+        return super(ucSource, self).__delitem__(index)
+
+    def __delslice__(self, i, j):
+        self.changing()
+        return super(ucSource, self).__delslice__(i, j)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def strings(self):
+        """The stringified lexemes; edits never change those."""
+        return [l[4] for l in super(ucSource, self).__iter__()]
+
     def scrubbed(self):
         raise NotImplementedError
         
-    if ucParanoid:
-        def __setitem__(self, index, value):
+    def __setitem__(self, index, value):
+        self.changing()
+        if ucParanoid:
             if isinstance(value, list):
                 for i in value:
                     assert isinstance(i, ucLexeme)
             else:
                 assert isinstance(value, ucLexeme)
-            r = super(ucSource, self).__setitem__(index, value)
-            if isinstance(index, int):
-                self.check(index-1, index+2)
-            return r
+        r = super(ucSource, self).__setitem__(index, value)
+        if ucParanoid and isinstance(index, int):
+            self.check(index-1, index+2)
+        return r
        
-        # Taken from the python documentation: http://docs.python.org/2/reference/datamodel.html v2.7.5 November 2013
-        # Licesne: PSF
-        def __setslice__(self, i, j, seq):
-            self[max(0, i):max(0, j):] = seq
-        # End License
+    # Taken from the python documentation: http://docs.python.org/2/reference/datamodel.html v2.7.5 November 2013
+    # Licesne: PSF
+    def __setslice__(self, i, j, seq):
+        self[max(0, i):max(0, j):] = seq
+    # End License
     
     def sort():
       raise TypeError("Je refuse!")
@@ -363,8 +529,7 @@ class ucSource(list):
         col = 0
         src = StringIO()
         charpositions = {}
-        for j in range(0, len(self)):
-            l = self[j]
+        for (j, l) in enumerate(self):
             if line < l[2][0]:
                 src.write(os.linesep * (l[2][0] - line))
                 col = 0
@@ -389,4 +554,304 @@ class ucSource(list):
         src, charpositions = self.deLexWithCharPositions()
         return src
       
+class ucSnapshot(object):
+
+    """
+    A source frozen at some point, plus the inserts and pops made to it
+    since. Snapshots of the same source share its lexemes, so making one and
+    editing it costs about what the edits do rather than a copy of the
+    whole source. Lexemes are read through the edits like a ucSource reads
+    through its edit log. Anything else is answered by a sourceClass list
+    built from the snapshot when first needed; change that list and the
+    snapshot won't know, so take a copy of it instead.
+    """
+
+    maxEdits = ucSource.maxEdits
+
+    def __init__(self, base, sourceClass, edits=(), length=None):
+        self.source = None
+        self.base = base
+        self.sourceClass = sourceClass
+        # (index, count, shift, lexemes) for each insert of count lexemes,
+        # or pop (count -1, no lexemes), made since base.
+        self.edits = list(edits)
+        self.length = len(base) if length is None else length
+
+    def snapshot(self):
+        return ucSnapshot(self.base, self.sourceClass, self.edits, self.length)
+
+    __copy__ = snapshot
+
+    def locate(self, i):
+        """The lexeme stored for index i, and the shifts logged since."""
+        if i < 0:
+            i += self.length
+        if i < 0 or i >= self.length:
+            raise IndexError("lexeme index out of range")
+        shifts = []
+        for (at, count, shift, lexemes) in reversed(self.edits):
+            if i < at:
+                continue
+            if count > 0:
+                if i < at + count:
+                    shifts.reverse()
+                    return (lexemes[i - at], shifts)
+                i -= count
+            else:
+                i += 1
+            shifts.append(shift)
+        shifts.reverse()
+        return (self.base[i], shifts)
+
+    shifted = ucSource.__dict__['shifted']
+    placed = ucSource.__dict__['placed']
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.materialized()[index]
+        (lexeme, shifts) = self.locate(index)
+        if len(shifts) == 0:
+            return lexeme
+        return self.shifted(lexeme, shifts)
+
+    def __getslice__(self, i, j):
+        return self.materialized()[max(0, i):max(0, j)]
+
+    def __len__(self):
+        return self.length
+
+    def insert(self, i, arg):
+        assert i <= len(self), str(i) + " " + str(len(self))
+        assert i >= 0
+        (a, shift) = self.placed(i, arg)
+        self.logEdit(i, len(a), shift, tuple(a))
+        return a
+
+    def pop(self, i):
+        assert i < len(self)
+        assert i >= 0
+        r = self[i]
+        self.logEdit(i, -1, ucSource.popShift(r), None)
+        return r
+
+    def logEdit(self, i, count, shift, lexemes):
+        self.source = None
+        self.edits.append((i, count, shift, lexemes))
+        self.length += max(count, -1)
+        if len(self.edits) > self.maxEdits:
+            self.base = tuple(self.materialized())
+            self.edits = []
+
+    def materialized(self):
+        """The snapshot as a sourceClass list."""
+        if self.source is None:
+            source = list.__new__(self.sourceClass)
+            list.extend(source, [self[i] for i in xrange(0, self.length)])
+            self.source = source
+        return self.source
+
+    def strings(self):
+        """The stringified lexemes; edits never change those."""
+        return [self.locate(i)[0][4] for i in xrange(0, self.length)]
+
+    def __iter__(self):
+        return iter(self.materialized())
+
+    def __eq__(self, other):
+        return self.materialized() == other
+
+    def __ne__(self, other):
+        return self.materialized() != other
+
+    def __add__(self, other):
+        return self.materialized() + other
+
+    def __radd__(self, other):
+        return other + list(self.materialized())
+
+    def __repr__(self):
+        return "ucSnapshot(%r)" % (self.materialized(),)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.materialized(), name)
+
+
+class ucVocabulary(object):
+    """
+    Interns strings: each distinct string gets a small int id, which stays
+    the same for as long as the vocabulary does. Safe to share between
+    threads.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+        self.lock = threading.Lock()
+
+    def intern(self, string):
+        i = self.ids.get(string)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(string)
+                if i is None:
+                    # The string goes in first, so whoever sees the id
+                    # can look it up.
+                    self.strings.append(string)
+                    i = self.ids[string] = len(self.strings) - 1
+        return i
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class ucColumnarSource(object):
+
+    """
+    Source code kept as parallel arrays rather than a list of lexemes: type
+    id, value, start and end line and column, and the id of the stringified
+    lexeme. Types are interned in a vocabulary shared by every columnar
+    source. Stringified lexemes are interned in the vocabulary given, so
+    that whatever owns it (a sourceModel) can drop it, or else in one
+    shared by the sources not given one. Sources made from a source share
+    its vocabulary. Lexemes are only built when asked for, by indexing or
+    iterating; slicing, scrubbing and stringifying work on the arrays.
+    
+    Remember to override lexemeClass and sourceClass in subclasses, and
+    lexColumns if the language's lexer can fill the arrays directly.
+    """
+
+    lexemeClass = ucLexeme
+    sourceClass = ucSource
+    types = ucVocabulary()
+    vocabulary = ucVocabulary()
+
+    def __init__(self, value=[], vocabulary=None, **kwargs):
+        if vocabulary is not None:
+            self.vocabulary = vocabulary
+        self.typeIds = array('i')
+        self.values = []
+        self.startLines = array('i')
+        self.startCols = array('i')
+        self.endLines = array('i')
+        self.endCols = array('i')
+        self.stringIds = array('i')
+        if isinstance(value, basestring):
+            self.lexColumns(value, **kwargs)
+        else:
+            self.extend(value)
+
+    def lexColumns(self, code, **kwargs):
+        self.extend(self.sourceClass(code, **kwargs))
+
+    def appendColumns(self, t, v, startL, startC, endL, endC, s):
+        self.typeIds.append(self.types.intern(t))
+        self.values.append(v)
+        self.startLines.append(startL)
+        self.startCols.append(startC)
+        self.endLines.append(endL)
+        self.endCols.append(endC)
+        self.stringIds.append(self.vocabulary.intern(s))
+
+    def append(self, lexeme):
+        ((startL, startC), (endL, endC)) = (lexeme[2], lexeme[3])
+        self.appendColumns(lexeme[0], lexeme[1], startL, startC, endL, endC,
+                           lexeme[4])
+
+    def extend(self, lexemes):
+        if isinstance(lexemes, ucColumnarSource):
+            self.typeIds.extend(lexemes.typeIds)
+            self.values.extend(lexemes.values)
+            self.startLines.extend(lexemes.startLines)
+            self.startCols.extend(lexemes.startCols)
+            self.endLines.extend(lexemes.endLines)
+            self.endCols.extend(lexemes.endCols)
+            if lexemes.vocabulary is self.vocabulary:
+                self.stringIds.extend(lexemes.stringIds)
+            else:
+                strings = lexemes.vocabulary.strings
+                self.stringIds.extend(self.vocabulary.intern(strings[i])
+                                      for i in lexemes.stringIds)
+        else:
+            for l in lexemes:
+                self.append(l)
+
+    def select(self, indices):
+        """A new source with the lexemes at indices, in that order."""
+        r = self.__class__(vocabulary=self.vocabulary)
+        r.typeIds = array('i', [self.typeIds[i] for i in indices])
+        r.values = [self.values[i] for i in indices]
+        r.startLines = array('i', [self.startLines[i] for i in indices])
+        r.startCols = array('i', [self.startCols[i] for i in indices])
+        r.endLines = array('i', [self.endLines[i] for i in indices])
+        r.endCols = array('i', [self.endCols[i] for i in indices])
+        r.stringIds = array('i', [self.stringIds[i] for i in indices])
+        return r
+
+    def lexeme(self, i):
+        return tuple.__new__(self.lexemeClass, (
+            self.types.strings[self.typeIds[i]],
+            self.values[i],
+            tuple.__new__(ucPos, (self.startLines[i], self.startCols[i])),
+            tuple.__new__(ucPos, (self.endLines[i], self.endCols[i])),
+            self.vocabulary.strings[self.stringIds[i]]))
+
+    def __len__(self):
+        return len(self.typeIds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            r = self.__class__(vocabulary=self.vocabulary)
+            r.typeIds = self.typeIds[i]
+            r.values = self.values[i]
+            r.startLines = self.startLines[i]
+            r.startCols = self.startCols[i]
+            r.endLines = self.endLines[i]
+            r.endCols = self.endCols[i]
+            r.stringIds = self.stringIds[i]
+            return r
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("lexeme index out of range")
+        return self.lexeme(i)
+
+    # Python 2 slices with __getslice__ when it can.
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(max(0, i), max(0, j)))
+
+    def __iter__(self):
+        for i in xrange(0, len(self)):
+            yield self.lexeme(i)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def strings(self):
+        """The stringified lexemes, without building any lexemes."""
+        return map(self.vocabulary.strings.__getitem__, self.stringIds)
+
+    def toSource(self):
+        """The same lexemes as a sourceClass list."""
+        return self.sourceClass(list(self))
+
+    def scrubbed(self):
+        raise NotImplementedError
+
+    deLexWithCharPositions = ucSource.__dict__['deLexWithCharPositions']
+    deLex = ucSource.__dict__['deLex']
+
 # rwfubmqqoiigevcdefhmidzavjwg
@@ -75,9 +75,9 @@ def main(mode="wrap"):
     from unnaturalcode.ucUser import pyUser
     ucpy = pyUser()
     
-    worst = ucpy.sm.worstWindows(ucpy.lm(source))
+    worst = ucpy.sm.worstWindows(ucpy.sm.lex(source))
     print("Suggest checking around %s:%d:%d" % (program, worst[0][0][10][2][0], worst[0][0][10][2][1]), file=sys.stderr)
-    print("Near:\n" + ucpy.lm(worst[0][0]).settle().deLex())
+    print("Near:\n" + worst[0][0].toSource().settle().deLex())
     
     ucpy.release()
     